@@ -500,6 +500,7 @@
 - (void)nextPage:(id)sender;
 - (void)previousPage:(id)sender;
 - (void)downloadVideoToDesktop:(NSString *)videoUrl forPost:(RedditPost *)post;
+- (BOOL)downloadRedditVideoToDesktop:(NSString *)videoUrl forPost:(RedditPost *)post;
 - (void)downloadGalleryToDesktop:(RedditPost *)post;
 - (NSString *)getYtDlpPath;
 - (NSString *)sanitizeFilename:(NSString *)filename;
@@ -537,9 +538,14 @@
 
 - (NSString *)getBundledScriptPath {
     NSString *resourcesPath = [[[NSBundle mainBundle] resourcePath] retain];
+    // Prefer the precompiled bundle (make bundle-python) - it skips compiling the script on every launch
+    NSString *bundlePath = [resourcesPath stringByAppendingPathComponent:@"reddit_fetcher.pyz"];
     NSString *scriptPath = [resourcesPath stringByAppendingPathComponent:@"reddit_fetcher.py"];
     [resourcesPath release];
 
+    if ([[NSFileManager defaultManager] fileExistsAtPath:bundlePath]) {
+        return bundlePath;
+    }
     if ([[NSFileManager defaultManager] fileExistsAtPath:scriptPath]) {
         return scriptPath;
     }
@@ -839,8 +845,12 @@
 - (NSString *)getScriptPathWithSimple:(BOOL)useSimple {
     NSString *scriptName = useSimple ? @"reddit_fetcher_simple" : @"reddit_fetcher";
 
-    // First try to find the script in the app bundle's Resources folder
-    NSString *bundleScriptPath = [[NSBundle mainBundle] pathForResource:scriptName ofType:@"py"];
+    // First try to find the script in the app bundle's Resources folder,
+    // preferring the precompiled bundle when one was built
+    NSString *bundleScriptPath = [[NSBundle mainBundle] pathForResource:scriptName ofType:@"pyz"];
+    if (!bundleScriptPath) {
+        bundleScriptPath = [[NSBundle mainBundle] pathForResource:scriptName ofType:@"py"];
+    }
     if (bundleScriptPath) {
         NSLog(@"Found %@ script in app bundle: %@", scriptName, bundleScriptPath);
         return bundleScriptPath;
@@ -1298,7 +1308,81 @@
     [task release];
 }
 
+- (BOOL)downloadRedditVideoToDesktop:(NSString *)videoUrl forPost:(RedditPost *)post {
+    // Reddit-hosted video is fetched by reddit_fetcher.py straight from its DASH
+    // manifest, which skips loading yt-dlp and all of its extractors
+    if ([videoUrl rangeOfString:@"v.redd.it/"].location == NSNotFound &&
+        [videoUrl rangeOfString:@"reddit.com/"].location == NSNotFound) {
+        return NO;
+    }
+
+    [statusText setString:@"Downloading video to Desktop..."];
+    [progressIndicator startAnimation:nil];
+
+    NSTask *task = [[NSTask alloc] init];
+    [task setLaunchPath:[self getPythonPath]];
+    [task setArguments:[NSArray arrayWithObjects:[self getScriptPath], @"download_video", videoUrl, [post title], nil]];
+
+    NSPipe *outPipe = [NSPipe pipe];
+    [task setStandardOutput:outPipe];
+    [task setCurrentDirectoryPath:NSHomeDirectory()];
+
+    NSLog(@"Downloading Reddit video natively: %@", videoUrl);
+    [task launch];
+
+    // Keep the UI responsive while waiting; the result is a single line, so the pipe can't fill
+    NSDate *timeout = [NSDate dateWithTimeIntervalSinceNow:120.0]; // 2 minute timeout
+    while ([task isRunning] && [timeout timeIntervalSinceNow] > 0) {
+        [[NSRunLoop currentRunLoop] runUntilDate:[NSDate dateWithTimeIntervalSinceNow:1.0]];
+        int elapsed = 120 - (int)[timeout timeIntervalSinceNow];
+        [statusText setString:[NSString stringWithFormat:@"Downloading video... (%d sec)", elapsed]];
+    }
+
+    if ([task isRunning]) {
+        NSLog(@"Native video download timeout - terminating");
+        [task terminate];
+        [statusText setString:@"Video download timed out"];
+        [progressIndicator stopAnimation:nil];
+        [task release];
+        // A stalled Reddit download would stall yt-dlp too, so don't start it
+        return YES;
+    }
+
+    [task waitUntilExit];
+    NSData *data = [[outPipe fileHandleForReading] readDataToEndOfFile];
+    NSString *output = [[[NSString alloc] initWithData:data encoding:NSUTF8StringEncoding] autorelease];
+    [task release];
+    [progressIndicator stopAnimation:nil];
+
+    BOOL downloaded = NO;
+    BOOL muxed = NO;
+    cJSON *root = cJSON_Parse([output UTF8String]);
+    if (root) {
+        downloaded = cJSON_IsTrue(cJSON_GetObjectItem(root, "success"));
+        muxed = cJSON_IsTrue(cJSON_GetObjectItem(root, "muxed"));
+        cJSON_Delete(root);
+    }
+
+    if (!downloaded) {
+        NSLog(@"Native video download failed, falling back to yt-dlp: %@", output);
+        return NO;
+    }
+
+    NSLog(@"Native video download finished: %@", output);
+    if (muxed) {
+        [statusText setString:@"Video downloaded to Desktop"];
+    } else {
+        [statusText setString:@"Video downloaded to Desktop (sound saved separately - install ffmpeg to combine)"];
+    }
+    [[NSWorkspace sharedWorkspace] openFile:[NSHomeDirectory() stringByAppendingPathComponent:@"Desktop"]];
+    return YES;
+}
+
 - (void)downloadVideoToDesktop:(NSString *)videoUrl forPost:(RedditPost *)post {
+    if ([self downloadRedditVideoToDesktop:videoUrl forPost:post]) {
+        return;
+    }
+
     NSString *ytDlpPath = [self getYtDlpPath];
     if (!ytDlpPath) {
         [statusText setString:@"yt-dlp not found in bundle"];
@@ -1596,6 +1680,10 @@
         if (error && cJSON_IsString(error)) {
             NSLog(@"Error from Python script: %s", error->valuestring);
         }
+        cJSON *retryAfter = cJSON_GetObjectItem(root, "retry_after");
+        if (retryAfter && cJSON_IsNumber(retryAfter)) {
+            NSLog(@"Reddit asked to retry after %.0f seconds", retryAfter->valuedouble);
+        }
 
         cJSON_Delete(root);
         return result;
@@ -2028,7 +2116,9 @@
     }
 
     [task setLaunchPath:pythonPath];
-    [task setArguments:[NSArray arrayWithObjects:scriptPath, subreddit, [sort lowercaseString], @"15", nil]]; // Reduced to 15 posts
+    // Same page size as Next/Previous, so the first page hits listings warmed by sync
+    [task setArguments:[NSArray arrayWithObjects:scriptPath, subreddit, [sort lowercaseString],
+                        [NSString stringWithFormat:@"%d", currentPostCount], nil]];
 
     NSPipe *outPipe = [NSPipe pipe];
     [task setStandardOutput:outPipe];
@@ -2273,7 +2363,8 @@
     NSLog(@"Files verified - setting up task");
 
     [task setLaunchPath:pythonPath];
-    [task setArguments:[NSArray arrayWithObjects:scriptPath, subreddit, sort, @"10", nil]]; // Reduced to 10 for faster testing
+    [task setArguments:[NSArray arrayWithObjects:scriptPath, subreddit, sort,
+                        [NSString stringWithFormat:@"%d", currentPostCount], nil]];
 
     NSPipe *outPipe = [NSPipe pipe];
     [task setStandardOutput:outPipe];
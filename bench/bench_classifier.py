@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+#
+# Micro-benchmark for post classification (content type, image/thumbnail
+# extraction). Compares the original is_video_url/is_image_url/is_article_url
+# chain, kept below as a frozen reference, against reddit_fetcher's
+# classify_url-based extract_image_info, and checks both produce identical
+# output for every post.
+#
+# Usage: python3 bench/bench_classifier.py [--posts N] [--fixture listing.json ...]
+#
+
+import os
+import re
+import sys
+import json
+import time
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import reddit_fetcher
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# --- Reference implementation (reddit_fetcher.py before the compiled classifier) ---
+
+def legacy_clean_image_url(url):
+    if not url:
+        return url
+    pattern = r'\.(jpe?g|png|gif|webp|bmp)(?=[\?&]|$)'
+    match = re.search(pattern, url, re.IGNORECASE)
+    if match:
+        return url[:match.end()]
+    return url
+
+def legacy_is_image_url(url):
+    if not url:
+        return False
+    image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp']
+    parsed = urlparse(url.lower())
+    for ext in image_extensions:
+        if parsed.path.endswith(ext):
+            return True
+    image_hosts = ['i.redd.it', 'i.imgur.com', 'imgur.com', 'i.postimg.cc']
+    if any(host in parsed.netloc for host in image_hosts):
+        return True
+    return False
+
+def legacy_is_video_url(url):
+    if not url:
+        return False
+    video_extensions = ['.mp4', '.webm', '.mov', '.avi', '.mkv', '.m4v']
+    parsed = urlparse(url.lower())
+    for ext in video_extensions:
+        if parsed.path.endswith(ext):
+            return True
+    video_hosts = [
+        'v.redd.it', 'v.reddit.com', 'youtube.com', 'youtu.be',
+        'streamable.com', 'gfycat.com', 'redgifs.com', 'imgur.com/a/',
+        'clips.twitch.tv', 'vimeo.com'
+    ]
+    return any(host in url.lower() for host in video_hosts)
+
+def legacy_is_article_url(url):
+    if not url:
+        return False
+    if 'reddit.com' in url or 'redd.it' in url:
+        return False
+    if legacy_is_image_url(url) or legacy_is_video_url(url):
+        return False
+    article_indicators = [
+        '.com', '.org', '.net', '.edu', '.gov', '.co.uk', '.io',
+        'news', 'blog', 'article', 'medium.com', 'substack.com'
+    ]
+    return any(indicator in url.lower() for indicator in article_indicators)
+
+def legacy_get_content_type(post_data):
+    url = post_data.get('url', '')
+    if post_data.get('is_self', False):
+        return 'self'
+    elif legacy_is_video_url(url):
+        return 'video'
+    elif legacy_is_image_url(url):
+        return 'image'
+    elif legacy_is_article_url(url):
+        return 'article'
+    return 'link'
+
+def legacy_video_thumbnail(post_data, url):
+    thumbnail = post_data.get('thumbnail', '')
+    if thumbnail and thumbnail.startswith('http') and thumbnail not in ['self', 'default', 'spoiler', 'nsfw']:
+        return thumbnail
+    if 'redgifs.com' in url and '/watch/' in url:
+        video_id = url.split('/watch/')[-1].split('?')[0]
+        return f"https://thumbs2.redgifs.com/{video_id}-mobile.jpg"
+    if 'youtube.com' in url or 'youtu.be' in url:
+        match = re.search(r'(?:youtube\.com\/watch\?v=|youtu\.be\/)([a-zA-Z0-9_-]{11})', url)
+        if match:
+            return f"https://img.youtube.com/vi/{match.group(1)}/mqdefault.jpg"
+    return None
+
+def legacy_extract_image_info(post_data):
+    image_info = {
+        'has_image': False, 'image_url': None, 'thumbnail': None, 'image_type': 'none',
+        'content_type': 'none', 'gallery_images': [], 'is_video': False, 'video_url': None,
+        'is_article': False, 'article_url': None, 'is_nsfw': post_data.get('over_18', False)
+    }
+    url = post_data.get('url', '')
+    content_type = legacy_get_content_type(post_data)
+    image_info['content_type'] = content_type
+    placeholders = ['self', 'default', 'spoiler', 'nsfw']
+
+    if content_type == 'video':
+        image_info['is_video'] = True
+        image_info['video_url'] = url
+        image_info['image_type'] = 'video'
+        video_thumb = legacy_video_thumbnail(post_data, url)
+        if video_thumb:
+            image_info['thumbnail'] = video_thumb
+            image_info['has_image'] = True
+        return image_info
+
+    elif content_type == 'article':
+        image_info['is_article'] = True
+        image_info['article_url'] = url
+        image_info['image_type'] = 'article'
+        thumbnail = post_data.get('thumbnail', '')
+        if thumbnail and thumbnail.startswith('http') and thumbnail not in placeholders:
+            image_info['thumbnail'] = thumbnail
+            image_info['has_image'] = True
+        return image_info
+
+    if ('reddit.com/gallery/' in url or post_data.get('is_gallery', False)) and 'media_metadata' in post_data:
+        gallery_images = reddit_fetcher.extract_gallery_images(post_data)
+        if gallery_images:
+            image_info['has_image'] = True
+            image_info['image_url'] = gallery_images[0]
+            image_info['gallery_images'] = gallery_images
+            image_info['image_type'] = 'gallery'
+            thumbnail = post_data.get('thumbnail', '')
+            if thumbnail and thumbnail.startswith('http') and thumbnail not in placeholders:
+                image_info['thumbnail'] = thumbnail
+            else:
+                image_info['thumbnail'] = gallery_images[0]
+            return image_info
+
+    if legacy_is_image_url(url):
+        image_info['has_image'] = True
+        image_info['image_url'] = legacy_clean_image_url(url)
+        image_info['image_type'] = 'direct'
+        thumbnail = post_data.get('thumbnail', '')
+        if thumbnail and thumbnail.startswith('http') and thumbnail not in placeholders:
+            image_info['thumbnail'] = thumbnail
+        else:
+            image_info['thumbnail'] = legacy_clean_image_url(url)
+    elif 'preview' in post_data and 'images' in post_data['preview']:
+        preview_images = post_data['preview']['images']
+        if len(preview_images) > 0:
+            image_info['has_image'] = True
+            source = preview_images[0].get('source', {})
+            if 'url' in source:
+                image_info['image_url'] = source['url'].replace('&amp;', '&')
+                image_info['image_type'] = 'preview'
+                resolutions = preview_images[0].get('resolutions', [])
+                if resolutions:
+                    suitable_res = None
+                    for res in resolutions:
+                        if res.get('width', 0) >= 150:
+                            suitable_res = res
+                            break
+                    if suitable_res:
+                        image_info['thumbnail'] = suitable_res['url'].replace('&amp;', '&')
+                    else:
+                        image_info['thumbnail'] = resolutions[0]['url'].replace('&amp;', '&')
+                else:
+                    image_info['thumbnail'] = image_info['image_url']
+    elif post_data.get('thumbnail', '') and post_data['thumbnail'].startswith('http'):
+        thumbnail = post_data['thumbnail']
+        if thumbnail not in placeholders:
+            image_info['has_image'] = True
+            image_info['thumbnail'] = thumbnail
+            image_info['image_url'] = thumbnail
+            image_info['image_type'] = 'thumbnail'
+    return image_info
+
+# --- Benchmark ---
+
+def load_posts(paths, count):
+    """Load post payloads from listing fixtures and repeat them with unique URLs up to count"""
+    base = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        listings = data if isinstance(data, list) else [data]
+        for listing in listings:
+            for child in listing.get('data', {}).get('children', []):
+                if child.get('kind') == 't3':
+                    base.append(child['data'])
+
+    posts = []
+    copy = 0
+    while len(posts) < count and base:
+        for post in base:
+            if len(posts) >= count:
+                break
+            post = dict(post)
+            url = post.get('url') or ''
+            if url and copy:
+                # Unique URLs so the memoized classifier can't just replay earlier answers
+                post['url'] = url + ('&' if '?' in url else '?') + f'bench={copy}'
+            posts.append(post)
+        copy += 1
+    return posts
+
+def time_per_post(func, posts, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for post in posts:
+            func(post)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(posts) * 1e6
+
+def main():
+    count = 5000
+    rounds = 5
+    fixtures = []
+    args = sys.argv[1:]
+    while args:
+        option = args.pop(0)
+        if option == '--posts' and args:
+            count = int(args.pop(0))
+        elif option == '--rounds' and args:
+            rounds = int(args.pop(0))
+        elif option == '--fixture' and args:
+            fixtures.append(args.pop(0))
+    if not fixtures:
+        fixtures = [os.path.join(FIXTURE_DIR, name) for name in sorted(os.listdir(FIXTURE_DIR))
+                    if name.startswith('listing_') and name.endswith('.json')]
+
+    posts = load_posts(fixtures, count)
+    if not posts:
+        print("No posts found in fixtures", file=sys.stderr)
+        sys.exit(1)
+
+    mismatches = 0
+    for post in posts:
+        if legacy_extract_image_info(post) != reddit_fetcher.extract_image_info(post):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"MISMATCH: {post.get('url')!r}", file=sys.stderr)
+
+    def compiled_cold(post):
+        reddit_fetcher.classify_url.cache_clear()
+        return reddit_fetcher.extract_image_info(post)
+
+    legacy_us = time_per_post(legacy_extract_image_info, posts, rounds)
+    cold_us = time_per_post(compiled_cold, posts, rounds)
+    # Re-classifying posts already seen (reopening a page in serve mode); keep
+    # the working set inside the memo so this measures hits, not LRU churn
+    reddit_fetcher.classify_url.cache_clear()
+    warm_posts = posts[:reddit_fetcher.classify_url.cache_info().maxsize // 2]
+    warm_us = time_per_post(reddit_fetcher.extract_image_info, warm_posts, rounds)
+
+    result = {
+        'posts': len(posts),
+        'fixtures': [os.path.basename(path) for path in fixtures],
+        'legacy_us_per_post': round(legacy_us, 2),
+        'compiled_us_per_post': round(cold_us, 2),
+        'compiled_memoized_us_per_post': round(warm_us, 2),
+        'speedup': round(legacy_us / cold_us, 2) if cold_us else None,
+        'mismatches': mismatches
+    }
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
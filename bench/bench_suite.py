@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+#
+# Offline benchmark suite for reddit_fetcher.py. Each scenario runs the real
+# command-line script in a fresh process against the local stand-in server
+# (bench/standin_server.py, in its own process so it does not inflate the
+# scenarios' peak RSS) and reports wall time, requests, bytes transferred
+# and peak RSS. Results are appended to bench/results/results.jsonl, tagged
+# with the current git commit, so runs can be compared across commits.
+#
+# Usage: python3 bench/bench_suite.py [--only NAME[,NAME]] [--repeat N] [--no-save] [--compare]
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+SCRIPT = os.path.join(REPO_DIR, 'reddit_fetcher.py')
+RESULTS_FILE = os.path.join(BENCH_DIR, 'results', 'results.jsonl')
+
+GALLERY_MANIFEST = json.dumps({
+    'title': 'Bench Gallery',
+    'urls': [f'https://i.redd.it/gallery{i:02d}.jpg' for i in range(12)]
+})
+
+# The app asks for every page, the first included, with its post count
+# setting (currentPostCount, 25 by default). sync_favorites relies on the sync
+# default limit, so listing_after_sync only hits if the two agree.
+APP_PAGE_SIZE = '25'
+
+SYNC_CONFIG = json.dumps({'subreddits': ['bench', 'pics/new', 'news/top'], 'max_bytes': 2 * 1024 * 1024})
+
+# name, argv, stdin, server conditions, whether to keep the cache from the previous scenario
+SCENARIOS = [
+    ('listing_cold', ['bench', 'hot', '25'], None, {}, False),
+    ('listing_warm', ['bench', 'hot', '25'], None, {}, True),
+    ('listing_next_page', ['bench', 'hot', '25', 't3_bench_p1'], None, {}, True),
+    ('listing_slow_link', ['bench', 'new', '25'], None, {'latency': 0.15, 'bandwidth': 64 * 1024}, False),
+    ('listing_errors', ['bench', 'top', '25'], None, {'error_rate': 0.2}, False),
+    ('sync_favorites', ['sync', '-'], SYNC_CONFIG, {'latency': 0.05}, False),
+    ('listing_after_sync', ['bench', 'hot', APP_PAGE_SIZE], None, {'latency': 0.05}, True),
+    ('multi_rate_limited', ['multi', 'bench+pics+news+aww+cats+dogs', 'hot', '10'], None,
+     {'ratelimit': 4, 'ratelimit_window': 3}, False),
+    ('comments_raw', ['fetch_comments', '/r/cats/comments/1a2b3c/x/'], None, {}, False),
+    ('comments_large_raw', ['fetch_comments', '/r/cats/comments/1a2b3c/x/'], None, {'comment_multiplier': 20}, False),
+    ('comments_large_plain', ['fetch_comments', '/r/cats/comments/1a2b3c/x/'], None,
+     {'comment_multiplier': 20, 'compress': False}, False),
+    ('comments_large_flat', ['fetch_comments', '/r/cats/comments/1a2b3c/x/', '--max-depth', '3', '--max-comments', '500'],
+     None, {'comment_multiplier': 20}, False),
+    ('gallery', ['download_gallery', '--manifest', '-'], GALLERY_MANIFEST, {'image_size': 256 * 1024}, False),
+    ('video_dash', ['download_video', 'https://v.redd.it/benchvideo', 'Bench Video'], None,
+     {'image_size': 512 * 1024}, False),
+    ('full_image_slow_link', ['download_full_image', 'https://i.redd.it/fullsize.jpg', 'Full'], None,
+     {'image_size': 1024 * 1024, 'bandwidth': 512 * 1024}, False),
+]
+
+DEFAULT_CONDITIONS = {'latency': 0.0, 'bandwidth': 0, 'error_rate': 0.0, 'image_size': 24 * 1024,
+                      'comment_multiplier': 1, 'ratelimit': 0, 'ratelimit_window': 600.0,
+                      'compress': True}
+
+class StandIn:
+    """A stand-in server running as a child process, driven through its control endpoints"""
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, 'standin_server.py'), '--port', '0'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        self.url = self.process.stdout.readline().decode().strip()
+        if not self.url:
+            raise RuntimeError('stand-in server failed to start')
+
+    def set_conditions(self, conditions):
+        body = json.dumps(dict(DEFAULT_CONDITIONS, **conditions)).encode('utf-8')
+        request = urllib.request.Request(self.url + '/_standin/conditions', data=body, method='POST')
+        urllib.request.urlopen(request, timeout=5).read()
+
+    def counters(self):
+        return json.loads(urllib.request.urlopen(self.url + '/_standin/counters', timeout=5).read())
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+def run_scenario(server, argv, stdin_text, workdir):
+    """Run reddit_fetcher.py once; return wall time, peak RSS (KB), exit code and stdout"""
+    env = dict(os.environ)
+    env.update({
+        'REDDIT_VIEWER_UPSTREAM': server.url,
+        'REDDIT_VIEWER_CACHE_DIR': os.path.join(workdir, 'cache'),
+        'HOME': workdir,
+    })
+    os.makedirs(os.path.join(workdir, 'Desktop'), exist_ok=True)
+
+    # stdout goes to a file: holding large outputs here would raise this process's
+    # peak RSS, which forked children inherit in their own ru_maxrss
+    output_path = os.path.join(workdir, 'stdout.json')
+    started = time.perf_counter()
+    with open(output_path, 'wb') as output:
+        process = subprocess.Popen(
+            [sys.executable, SCRIPT] + argv,
+            stdin=subprocess.PIPE if stdin_text is not None else subprocess.DEVNULL,
+            stdout=output, stderr=subprocess.DEVNULL, env=env, cwd=workdir
+        )
+        if stdin_text is not None:
+            process.stdin.write(stdin_text.encode('utf-8'))
+            process.stdin.close()
+
+        # wait4 gives this child's own rusage, so peak RSS is per scenario
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - started
+
+    # ru_maxrss is kilobytes on Linux but bytes on Mac OS X
+    peak_rss_kb = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    return wall, peak_rss_kb, process.returncode, output_path
+
+def output_succeeded(output_path):
+    """Best-effort check that the command printed a successful result, without parsing all of it"""
+    with open(output_path, 'rb') as f:
+        head = f.read(4096)
+        f.seek(max(0, os.path.getsize(output_path) - 4096))
+        tail = f.read()
+    if head.startswith(b'['):
+        # Raw comment listings are a bare JSON array
+        return tail.rstrip().endswith(b']')
+    last_line = tail.rstrip().rsplit(b'\n', 1)[-1]
+    return any(marker in text for text in (head, last_line)
+               for marker in (b'"success": true', b'"success":true', b'"event": "done"', b'"event":"done"'))
+
+def git_revision():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                           stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD', '--', 'reddit_fetcher.py'], cwd=REPO_DIR,
+                                stderr=subprocess.DEVNULL) != 0
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def load_previous_run():
+    try:
+        with open(RESULTS_FILE, 'r', encoding='utf-8') as f:
+            lines = [line for line in f if line.strip()]
+    except OSError:
+        return None
+    return json.loads(lines[-1]) if lines else None
+
+def print_comparison(previous, scenarios):
+    print(f"\nCompared with {previous['commit']} ({previous['timestamp']}):")
+    for name, current in scenarios.items():
+        before = previous['scenarios'].get(name)
+        if not before:
+            continue
+        changes = []
+        for metric in ('wall_s', 'requests', 'bytes', 'peak_rss_kb'):
+            if before.get(metric):
+                delta = (current[metric] - before[metric]) / before[metric] * 100
+                changes.append(f"{metric} {delta:+.0f}%")
+        print(f"  {name:<22} " + ', '.join(changes))
+
+def main():
+    only = None
+    repeat = 1
+    save = True
+    compare = False
+    args = sys.argv[1:]
+    while args:
+        option = args.pop(0)
+        if option == '--only' and args:
+            only = set(args.pop(0).split(','))
+        elif option == '--repeat' and args:
+            repeat = max(1, int(args.pop(0)))
+        elif option == '--no-save':
+            save = False
+        elif option == '--compare':
+            compare = True
+
+    previous = load_previous_run() if compare else None
+    server = StandIn()
+    workdir = None
+    results = {}
+
+    print(f"{'scenario':<22} {'wall_s':>8} {'requests':>9} {'bytes':>10} {'rss_kb':>8}  ok")
+    try:
+        for name, argv, stdin_text, conditions, keep_cache in SCENARIOS:
+            if only and name not in only:
+                continue
+
+            runs = []
+            for _ in range(repeat):
+                if workdir is None or not keep_cache:
+                    if workdir:
+                        shutil.rmtree(workdir, ignore_errors=True)
+                    workdir = tempfile.mkdtemp(prefix='reddit_bench_')
+
+                server.set_conditions(conditions)
+                wall, rss, code, output_path = run_scenario(server, argv, stdin_text, workdir)
+                # Detached background helpers (revalidation, prefetch) must not leak into the next scenario
+                time.sleep(0.2)
+                counters = server.counters()
+                runs.append({
+                    'wall_s': round(wall, 3),
+                    'requests': counters['requests'],
+                    'bytes': counters['bytes_sent'],
+                    'peak_rss_kb': rss,
+                    'exit_code': code,
+                    'success': code == 0 and output_succeeded(output_path),
+                    'output_bytes': os.path.getsize(output_path),
+                    'errors_injected': counters['errors_injected'],
+                })
+
+            # Report the fastest run; counters come from that same run
+            best = min(runs, key=lambda run: run['wall_s'])
+            results[name] = best
+            print(f"{name:<22} {best['wall_s']:>8.3f} {best['requests']:>9} {best['bytes']:>10} "
+                  f"{best['peak_rss_kb']:>8}  {'yes' if best['success'] else 'NO'}")
+    finally:
+        server.stop()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    record = {
+        'commit': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'scenarios': results,
+    }
+
+    if previous:
+        print_comparison(previous, results)
+
+    if save:
+        os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+        with open(RESULTS_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+        print(f"\nSaved to {os.path.relpath(RESULTS_FILE, REPO_DIR)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+#
+# Local stand-in for old.reddit.com, reddit.com and the image hosts, used by
+# the offline benchmarks. reddit_fetcher.py is pointed at it with
+# REDDIT_VIEWER_UPSTREAM=http://127.0.0.1:PORT; the original host arrives in
+# the X-Original-Host header.
+#
+# Serves:
+#   /r/<sub>/[<sort>/].json     - the listing fixtures (listing_*.json), paged by ?after=
+#   /r/<sub>/comments/<id>/...  - the comment fixture (comments_*.json), optionally
+#                                 multiplied into a mega-thread
+#   /api/morechildren.json      - synthetic comments for the ids in the fixture's
+#                                 "more" stubs, some nested under each other
+#   /<id>/DASHPlaylist.mpd      - a v.redd.it style manifest with 240p-720p video
+#                                 renditions and one audio track
+#   anything else               - a valid synthetic image matching the path extension
+#
+# JSON is gzip-compressed for clients that send Accept-Encoding: gzip unless
+# the "compress" condition is turned off.
+#
+# With a rate limit budget set, API responses (listings, comments,
+# morechildren) carry X-Ratelimit-Used/-Remaining/-Reset headers like Reddit's,
+# and requests over the budget get 429 with Retry-After until the window resets.
+#
+# Latency, bandwidth, error injection and the rate limit are set per server and can be changed
+# between scenarios through the control endpoints, which is how the benchmark
+# suite drives a stand-in running in its own process:
+#   POST /_standin/conditions   - JSON object of conditions; also resets the counters
+#   GET  /_standin/counters     - requests, bytes sent, injected errors, 304s, 429s
+#
+# The server's URL is printed as the first line on stdout.
+#
+# Usage: python3 bench/standin_server.py [--port 8800] [--latency 0.05] [--bandwidth 65536] [--error-rate 0.1]
+#                                       [--ratelimit 100] [--ratelimit-window 60] [--no-compress]
+#
+
+import os
+import sys
+import json
+import time
+import gzip
+import zlib
+import struct
+import random
+import hashlib
+import threading
+import http.server
+from urllib.parse import urlparse, parse_qs
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def synthetic_image(name, size):
+    """Build image bytes of roughly size bytes that pass the fetcher's integrity checks"""
+    ext = os.path.splitext(name.lower())[1]
+    seed = hashlib.md5(name.encode()).digest()
+    filler = (seed * (size // len(seed) + 1))[:max(size - 64, 16)]
+
+    if ext == '.png':
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+        return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 0, 0, 0, 0))
+                + chunk(b'tEXt', b'pad\x00' + filler) + chunk(b'IDAT', zlib.compress(b'\x00\x00'))
+                + chunk(b'IEND', b''))
+    if ext == '.gif':
+        return b'GIF89a\x01\x00\x01\x00\x00\x00\x00' + filler + b'\x3b'
+    if ext == '.webp':
+        body = b'WEBP' + b'VP8 ' + struct.pack('<I', len(filler)) + filler
+        return b'RIFF' + struct.pack('<I', len(body)) + body
+    return b'\xff\xd8\xff\xe0' + filler + b'\xff\xd9'
+
+DASH_HEIGHTS = (240, 360, 480, 720)
+
+def dash_manifest(duration=30):
+    """A v.redd.it style DASH manifest; its media files are served as synthetic data"""
+    videos = ''.join(
+        f'<Representation id="{height}" bandwidth="{height * 2500}" height="{height}" width="{height * 16 // 9}" '
+        f'mimeType="video/mp4" codecs="avc1.4d401f"><BaseURL>DASH_{height}.mp4</BaseURL></Representation>'
+        for height in DASH_HEIGHTS
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT{duration}.0S">'
+        f'<Period duration="PT{duration}.0S">'
+        f'<AdaptationSet contentType="video" segmentAlignment="true">{videos}</AdaptationSet>'
+        '<AdaptationSet contentType="audio"><Representation id="5" bandwidth="130330" mimeType="audio/mp4" '
+        'codecs="mp4a.40.2"><BaseURL>DASH_AUDIO_128.mp4</BaseURL></Representation></AdaptationSet>'
+        '</Period></MPD>'
+    ).encode('utf-8')
+
+def page_variant(url, page):
+    """Give an http(s) URL a per-page file name without changing its host or extension"""
+    if not url.startswith('http'):
+        return url
+    base, sep, query = url.partition('?')
+    dot = base.rfind('.')
+    if dot > base.rfind('/'):
+        base = f"{base[:dot]}_p{page}{base[dot:]}"
+    else:
+        base = f"{base.rstrip('/')}_p{page}"
+    return base + sep + query
+
+class StandInState:
+    """Fixtures, network conditions and counters shared by all handler threads"""
+
+    def __init__(self, latency=0.0, bandwidth=0, error_rate=0.0, image_size=24 * 1024,
+                 comment_multiplier=1, ratelimit=0, ratelimit_window=600.0, compress=True, seed=1):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.ratelimit = ratelimit
+        self.ratelimit_window = ratelimit_window
+        self.compress = compress
+        self.image_size = image_size
+        self.comment_multiplier = comment_multiplier
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.listings = []
+        self.comments = None
+        self.comment_cache = {}
+        self.more_parents = {}
+        self.load_fixtures()
+        self.reset_counters()
+
+    def load_fixtures(self):
+        for name in sorted(os.listdir(FIXTURE_DIR)):
+            path = os.path.join(FIXTURE_DIR, name)
+            if name.startswith('listing_') and name.endswith('.json'):
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.listings.append(json.load(f))
+            elif name.startswith('comments_') and name.endswith('.json') and self.comments is None:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.comments = json.load(f)
+                self.index_more_stubs(self.comments[1]['data']['children'])
+
+    def index_more_stubs(self, children):
+        """Remember which stub (and so which parent) each hidden comment id belongs to"""
+        for child in children:
+            data = child.get('data') or {}
+            if child.get('kind') == 'more':
+                for position, comment_id in enumerate(data.get('children', [])):
+                    self.more_parents[comment_id] = (data.get('parent_id'), position, data.get('children'))
+            elif isinstance(data.get('replies'), dict):
+                self.index_more_stubs(data['replies']['data']['children'])
+
+    def more_children(self, query):
+        """Answer /api/morechildren with a flat list of things, every third one a reply to the one before"""
+        ids = [comment_id for comment_id in query.get('children', [''])[0].split(',') if comment_id]
+        things = []
+        for comment_id in ids:
+            parent_id, position, siblings = self.more_parents.get(comment_id, (None, 0, []))
+            if parent_id is None:
+                continue
+            if position % 3 == 2:
+                parent_id = 't1_' + siblings[position - 1]
+            things.append({'kind': 't1', 'data': {
+                'id': comment_id, 'name': 't1_' + comment_id, 'parent_id': parent_id,
+                'author': 'bench_user', 'score': position + 1, 'created_utc': 1700000000 + position,
+                'body': f'Hidden comment {comment_id}', 'replies': ''
+            }})
+        return json.dumps({'json': {'errors': [], 'data': {'things': things}}}).encode('utf-8')
+
+    def apply(self, conditions):
+        for name in ('latency', 'bandwidth', 'error_rate', 'image_size', 'comment_multiplier',
+                     'ratelimit', 'ratelimit_window', 'compress'):
+            if name in conditions:
+                setattr(self, name, type(getattr(self, name))(conditions[name]))
+        self.reset_counters()
+
+    def reset_counters(self):
+        with self.lock:
+            self.counters = {'requests': 0, 'bytes_sent': 0, 'errors_injected': 0, 'not_modified': 0,
+                             'rate_limited': 0}
+            self.window_start = time.time()
+            self.window_used = 0
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def ratelimit_headers(self):
+        """Count an API request against the budget and return its X-Ratelimit headers"""
+        with self.lock:
+            now = time.time()
+            if now >= self.window_start + self.ratelimit_window:
+                self.window_start = now
+                self.window_used = 0
+            self.window_used += 1
+            reset = max(1, int(self.window_start + self.ratelimit_window - now))
+            return {'X-Ratelimit-Used': str(self.window_used),
+                    'X-Ratelimit-Remaining': str(max(0, self.ratelimit - self.window_used)),
+                    'X-Ratelimit-Reset': str(reset)}, self.window_used > self.ratelimit
+
+    def should_fail(self):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def listing_page(self, query):
+        """Return the listing JSON bytes for a request, chaining fixture pages via after"""
+        posts = [child for listing in self.listings for child in listing['data']['children']]
+        limit = int(query.get('limit', ['25'])[0])
+        after = query.get('after', [None])[0]
+        page = int(after.rsplit('_p', 1)[1]) if after and '_p' in after else 0
+
+        children = []
+        for i in range(limit):
+            child = json.loads(json.dumps(posts[(page * limit + i) % len(posts)]))
+            if page:
+                # Distinct ids and image URLs per page so caches see new content
+                data = child['data']
+                data['id'] = f"{data['id']}p{page}"
+                for field in ('url', 'thumbnail'):
+                    data[field] = page_variant(data.get(field) or '', page)
+            children.append(child)
+
+        listing = {'kind': 'Listing', 'data': {'after': f't3_bench_p{page + 1}', 'before': None,
+                                               'dist': len(children), 'children': children}}
+        return json.dumps(listing).encode('utf-8')
+
+    def comment_thread(self):
+        """Return the comment fixture, multiplied into a bigger thread if configured"""
+        multiplier = self.comment_multiplier
+        with self.lock:
+            if multiplier in self.comment_cache:
+                return self.comment_cache[multiplier]
+
+        data = json.loads(json.dumps(self.comments))
+        top = data[1]['data']['children']
+        extra = []
+        for copy in range(1, multiplier):
+            clone = json.loads(json.dumps(top).replace('"c0', f'"m{copy}c0').replace('t1_c0', f't1_m{copy}c0'))
+            extra.extend(child for child in clone if child['kind'] == 't1')
+        data[1]['data']['children'] = extra + top
+        body = json.dumps(data).encode('utf-8')
+        with self.lock:
+            self.comment_cache[multiplier] = body
+        return body
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'RedditStandIn/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        state = self.server.state
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        path = parsed.path
+
+        if path == '/_standin/counters':
+            with state.lock:
+                counters = dict(state.counters)
+            self.send_body(200, json.dumps(counters).encode('utf-8'), 'application/json')
+            return
+
+        state.count('requests')
+        if state.latency:
+            time.sleep(state.latency)
+
+        if state.should_fail():
+            state.count('errors_injected')
+            self.send_body(503, b'{"error": 503}', 'application/json')
+            return
+
+        is_api = path.startswith('/api/') or '/comments/' in path or (path.startswith('/r/') and path.endswith('.json'))
+        headers = {}
+        if is_api and state.ratelimit:
+            headers, over_budget = state.ratelimit_headers()
+            if over_budget:
+                state.count('rate_limited')
+                self.send_body(429, b'{"message": "Too Many Requests", "error": 429}', 'application/json',
+                               extra_headers=dict(headers, **{'Retry-After': headers['X-Ratelimit-Reset']}))
+                return
+
+        if path.endswith('/DASHPlaylist.mpd'):
+            self.send_body(200, dash_manifest(), 'application/dash+xml')
+        elif path.startswith('/api/morechildren'):
+            self.send_json(state.more_children(query), headers)
+        elif '/comments/' in path:
+            self.send_json(state.comment_thread(), headers)
+        elif is_api:
+            self.send_json(state.listing_page(query), headers)
+        else:
+            self.send_body(200, synthetic_image(os.path.basename(path) or 'image.jpg', state.image_size),
+                           'image/jpeg', ranged=True)
+
+    def do_POST(self):
+        if self.path != '/_standin/conditions':
+            self.send_body(404, b'{}', 'application/json')
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        self.server.state.apply(json.loads(self.rfile.read(length) or b'{}'))
+        self.send_body(200, b'{"ok": true}', 'application/json')
+
+    def send_json(self, body, extra_headers=None):
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.server.state.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            for name, value in (extra_headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+        extra_headers = dict(extra_headers or {}, ETag=etag)
+        if self.server.state.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, 6)
+            extra_headers['Content-Encoding'] = 'gzip'
+        self.send_body(200, body, 'application/json; charset=UTF-8', extra_headers=extra_headers)
+
+    def send_body(self, status, body, content_type, ranged=False, extra_headers=None):
+        start = 0
+        if ranged and self.headers.get('Range', '').startswith('bytes='):
+            start = int(self.headers['Range'][6:].split('-')[0] or 0)
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        payload = body[start:]
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.write_throttled(payload)
+
+    def write_throttled(self, payload):
+        if self.command != 'GET' or self.path.startswith('/_standin/'):
+            self.wfile.write(payload)
+            return
+        bandwidth = self.server.state.bandwidth
+        chunk_size = max(1024, bandwidth // 20) if bandwidth else len(payload) or 1
+        for offset in range(0, len(payload), chunk_size):
+            chunk = payload[offset:offset + chunk_size]
+            self.wfile.write(chunk)
+            self.server.state.count('bytes_sent', len(chunk))
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, **options):
+        super().__init__(('127.0.0.1', port), StandInHandler)
+        self.state = StandInState(**options)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def main():
+    port = 8800
+    options = {}
+    args = sys.argv[1:]
+    while args:
+        option = args.pop(0)
+        if option == '--port' and args:
+            port = int(args.pop(0))
+        elif option == '--latency' and args:
+            options['latency'] = float(args.pop(0))
+        elif option == '--bandwidth' and args:
+            options['bandwidth'] = int(args.pop(0))
+        elif option == '--error-rate' and args:
+            options['error_rate'] = float(args.pop(0))
+        elif option == '--comment-multiplier' and args:
+            options['comment_multiplier'] = int(args.pop(0))
+        elif option == '--ratelimit' and args:
+            options['ratelimit'] = int(args.pop(0))
+        elif option == '--ratelimit-window' and args:
+            options['ratelimit_window'] = float(args.pop(0))
+        elif option == '--no-compress':
+            options['compress'] = False
+
+    server = StandInServer(port, **options)
+    print(server.url, flush=True)
+    print(f"Stand-in server on {server.url} (REDDIT_VIEWER_UPSTREAM={server.url})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,765 @@
 
 import sys
 import json
-import urllib.request
-import urllib.error
 from urllib.parse import urlencode, urlparse
 import re
 import os
-import hashlib
 import time
+import io
+import threading
+import functools
+
+# urllib.request, urllib.error (which pulls in tempfile), http.client (email,
+# ssl), hashlib and random are imported inside the functions that use them, so
+# commands answered from local caches never pay for loading the network stack.
+# Functions that catch urllib.error exceptions import it first, so an except
+# clause is never evaluated before the module is loaded.
+
+# Per-phase timing spans (DNS, connect/TLS, time to first byte, body, JSON
+# decode, extraction, cache I/O, thumbnails). Off unless one of these is set:
+#   REDDIT_VIEWER_TIMINGS=1      add a "timings" summary to each JSON result
+#   REDDIT_VIEWER_TRACE=PATH     append every command's spans to PATH as one JSON line
+# When both are unset span() returns a shared no-op object and nothing is recorded.
+TIMINGS_IN_RESULT = os.environ.get('REDDIT_VIEWER_TIMINGS', '') not in ('', '0')
+TIMINGS_TRACE_FILE = os.environ.get('REDDIT_VIEWER_TRACE') or None
+TIMINGS_ENABLED = TIMINGS_IN_RESULT or TIMINGS_TRACE_FILE is not None
+TIMING_STATE = threading.local()
+TRACE_FILE_LOCK = threading.Lock()
+
+class TimingTrace:
+    """Spans recorded for one command, shared by every thread working on it"""
+
+    def __init__(self, command):
+        self.command = command
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.spans = []
+
+    def add(self, name, start, duration, attrs=None):
+        record = {
+            'name': name,
+            'start_ms': round((start - self.started) * 1000, 2),
+            'ms': round(duration * 1000, 2),
+            'thread': threading.current_thread().name,
+        }
+        if attrs:
+            record.update(attrs)
+        with self.lock:
+            self.spans.append(record)
+
+    def summary(self):
+        """Totals per phase; phases run on several threads are summed across them"""
+        phases = {}
+        with self.lock:
+            spans = list(self.spans)
+        for record in spans:
+            phase = phases.setdefault(record['name'], {'count': 0, 'ms': 0.0, 'max_ms': 0.0})
+            phase['count'] += 1
+            phase['ms'] += record['ms']
+            phase['max_ms'] = max(phase['max_ms'], record['ms'])
+        for phase in phases.values():
+            phase['ms'] = round(phase['ms'], 2)
+        return {'total_ms': round((time.perf_counter() - self.started) * 1000, 2), 'phases': phases}
+
+class TimingSpan:
+    """Context manager that records one span into a trace when it exits"""
+
+    __slots__ = ('trace', 'name', 'attrs', 'start')
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.trace.add(self.name, self.start, time.perf_counter() - self.start, self.attrs)
+        return False
+
+class NullSpan:
+    """Stand-in for TimingSpan when timings are off"""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = NullSpan()
+
+def current_trace():
+    return getattr(TIMING_STATE, 'trace', None) if TIMINGS_ENABLED else None
+
+def span(name, **attrs):
+    """Time a phase of the current command: with span('json.decode', bytes=n): ..."""
+    trace = current_trace()
+    if trace is None:
+        return NULL_SPAN
+    return TimingSpan(trace, name, attrs)
+
+def bind_trace(function):
+    """Wrap function so spans it records on a worker thread land in the caller's trace"""
+    trace = current_trace()
+    if trace is None:
+        return function
+
+    def run(*args, **kwargs):
+        previous = getattr(TIMING_STATE, 'trace', None)
+        TIMING_STATE.trace = trace
+        try:
+            return function(*args, **kwargs)
+        finally:
+            TIMING_STATE.trace = previous
+    return run
+
+def begin_trace(command):
+    """Start collecting spans for command on this thread (None when timings are off)"""
+    if not TIMINGS_ENABLED:
+        return None
+    trace = TimingTrace(command)
+    TIMING_STATE.trace = trace
+    return trace
+
+def finish_trace(trace, result=None):
+    """Stop collecting, write the trace file line and return result with its timings added"""
+    if trace is None:
+        return result
+    TIMING_STATE.trace = None
+    summary = trace.summary()
+
+    if TIMINGS_TRACE_FILE:
+        with trace.lock:
+            spans = list(trace.spans)
+        line = json.dumps({'command': trace.command, 'started_at': round(trace.started_at, 3),
+                           'total_ms': summary['total_ms'], 'phases': summary['phases'], 'spans': spans},
+                          separators=(',', ':'))
+        try:
+            with TRACE_FILE_LOCK, open(TIMINGS_TRACE_FILE, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            print(f"DEBUG: Could not write trace file {TIMINGS_TRACE_FILE}: {e}", file=sys.stderr)
+
+    if TIMINGS_IN_RESULT and isinstance(result, dict):
+        result = dict(result, timings=summary)
+    return result
+
+# Keep-alive HTTP client shared by every fetch path. Opening a new TLS
+# connection per request is the most expensive thing we do on PowerPC, so
+# connections are kept per host and reused until they sit idle too long.
+HTTP_IDLE_TIMEOUT = 30.0
+HTTP_MAX_IDLE_PER_HOST = 4
+HTTP_MAX_REDIRECTS = 5
+DNS_CACHE_TTL = 300.0
+
+class PooledResponse:
+    """Wraps an http.client response and hands its connection back to the pool on close"""
+
+    def __init__(self, pool, key, conn, response, url):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        # Body read time and size, recorded as one http.body span on close
+        self.trace = current_trace()
+        self.read_time = 0.0
+        self.read_bytes = 0
+        self.read_started = None
+
+    def read(self, amt=None):
+        if self.trace is None:
+            return self.response.read(amt)
+        start = time.perf_counter()
+        if self.read_started is None:
+            self.read_started = start
+        data = self.response.read(amt)
+        self.read_time += time.perf_counter() - start
+        self.read_bytes += len(data)
+        return data
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        if self.trace is not None and self.read_started is not None:
+            self.trace.add('http.body', self.read_started, self.read_time,
+                           {'host': self.key[1], 'bytes': self.read_bytes})
+        # Only a fully read body leaves the socket ready for the next request
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.release(self.key, conn)
+        else:
+            self.response.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+# Compressed bodies are read and inflated this many wire bytes at a time
+DECODE_CHUNK = 64 * 1024
+
+class DecodedResponse:
+    """Wraps a gzip or deflate encoded response and inflates the body as it is read.
+
+    Each chunk is decompressed as it arrives off the socket, so the whole
+    compressed body is never held in memory. Wire and decoded sizes are added
+    to the pool's counters on close (HTTPPool.record_compressed_body).
+    """
+
+    def __init__(self, response, encoding):
+        import zlib
+
+        self.response = response
+        self.encoding = encoding
+        self.status = response.status
+        self.reason = getattr(response, 'reason', '')
+        self.headers = response.headers
+        # Window bits 31 expects a gzip header, 15 a zlib one ("deflate" per the HTTP spec)
+        self.decoder = zlib.decompressobj(31 if encoding == 'gzip' else 15)
+        self.pending = b''
+        self.finished = False
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self.recorded = False
+
+    def _inflate(self, size):
+        """Read up to size wire bytes and return what they decompress to"""
+        import zlib
+
+        chunk = self.response.read(size)
+        if not chunk:
+            self.finished = True
+            return self.decoder.flush()
+        self.wire_bytes += len(chunk)
+        try:
+            data = self.decoder.decompress(chunk)
+        except zlib.error:
+            if self.encoding != 'deflate' or self.decoded_bytes or self.pending or self.wire_bytes != len(chunk):
+                raise
+            # Some servers send raw deflate without the zlib wrapper
+            self.decoder = zlib.decompressobj(-15)
+            data = self.decoder.decompress(chunk)
+        if self.decoder.eof:
+            # Drain anything after the compressed stream so the connection can be reused
+            self.response.read()
+            self.finished = True
+        return data
+
+    def read(self, amt=None):
+        if amt is None or amt < 0:
+            parts = [self.pending]
+            while not self.finished:
+                parts.append(self._inflate(DECODE_CHUNK))
+            data = b''.join(parts)
+            self.pending = b''
+        else:
+            while len(self.pending) < amt and not self.finished:
+                self.pending += self._inflate(max(amt, DECODE_CHUNK))
+            data, self.pending = self.pending[:amt], self.pending[amt:]
+        self.decoded_bytes += len(data)
+        return data
+
+    def geturl(self):
+        return self.response.geturl()
+
+    def close(self):
+        if not self.recorded:
+            self.recorded = True
+            HTTP_POOL.record_compressed_body(self.wire_bytes, self.decoded_bytes)
+            print(f"DEBUG: {self.encoding} body: {self.wire_bytes} bytes on the wire, "
+                  f"{self.decoded_bytes} decoded", file=sys.stderr)
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class HTTPPool:
+    """Per-host pool of persistent HTTP/1.1 connections with a DNS cache"""
+
+    def __init__(self, idle_timeout=HTTP_IDLE_TIMEOUT, max_idle_per_host=HTTP_MAX_IDLE_PER_HOST,
+                 dns_ttl=DNS_CACHE_TTL):
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.dns_ttl = dns_ttl
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.dns_cache = {}
+        self.counters = {
+            'requests': 0,
+            'connections_opened': 0,
+            'connections_reused': 0,
+            'connections_evicted': 0,
+            'stale_retries': 0,
+            'dns_lookups': 0,
+            'dns_hits': 0,
+            'compressed_bytes': 0,
+            'uncompressed_bytes': 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def record_compressed_body(self, wire_bytes, decoded_bytes):
+        """Add a compressed response body to the compressed_bytes/uncompressed_bytes counters"""
+        with self.lock:
+            self.counters['compressed_bytes'] += wire_bytes
+            self.counters['uncompressed_bytes'] += decoded_bytes
+
+    def resolve(self, host, port):
+        """Return cached getaddrinfo results for host:port"""
+        import socket
+
+        now = time.time()
+        with self.lock:
+            cached = self.dns_cache.get((host, port))
+            if cached and now - cached[0] < self.dns_ttl:
+                self.counters['dns_hits'] += 1
+                return cached[1]
+
+        with span('dns', host=host):
+            addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        with self.lock:
+            self.counters['dns_lookups'] += 1
+            self.dns_cache[(host, port)] = (now, addresses)
+        return addresses
+
+    def _create_connection(self, address, timeout, source_address=None):
+        import socket
+
+        host, port = address
+        last_error = None
+        for family, socktype, proto, _, sockaddr in self.resolve(host, port):
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except OSError as e:
+                last_error = e
+                if sock is not None:
+                    sock.close()
+        if last_error is not None:
+            raise last_error
+        raise OSError(f'getaddrinfo returned no addresses for {host}')
+
+    def _new_connection(self, key, timeout):
+        import http.client
+
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        conn._create_connection = self._create_connection
+        self._count('connections_opened')
+        return conn
+
+    def acquire(self, key, timeout):
+        """Return (connection, reused) for key, evicting idle connections that expired"""
+        now = time.time()
+        expired = []
+        conn = None
+        with self.lock:
+            entries = self.idle.get(key, [])
+            while entries:
+                candidate, last_used = entries.pop()
+                if now - last_used > self.idle_timeout:
+                    expired.append(candidate)
+                    continue
+                conn = candidate
+                break
+            self.counters['connections_evicted'] += len(expired)
+        for stale in expired:
+            stale.close()
+
+        if conn is None:
+            return self._new_connection(key, timeout), False
+
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        self._count('connections_reused')
+        return conn, True
+
+    def release(self, key, conn):
+        with self.lock:
+            entries = self.idle.setdefault(key, [])
+            if len(entries) < self.max_idle_per_host:
+                entries.append((conn, time.time()))
+                return
+        conn.close()
+
+    def close_idle(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for entries in idle.values():
+            for conn, _ in entries:
+                conn.close()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['idle_connections'] = sum(len(entries) for entries in self.idle.values())
+        opened = stats['connections_opened']
+        reused = stats['connections_reused']
+        stats['reuse_ratio'] = round(reused / (opened + reused), 3) if opened + reused else 0.0
+        stats['bytes_saved'] = stats['uncompressed_bytes'] - stats['compressed_bytes']
+        return stats
+
+    def _exchange(self, conn, key, method, target, headers):
+        """Send one request on conn and wait for the response headers"""
+        if conn.sock is None:
+            # Connect explicitly so TCP + TLS setup is timed apart from the server's response time
+            with span('http.connect', host=key[1]):
+                conn.connect()
+        with span('http.ttfb', host=key[1]):
+            conn.request(method, target, headers=headers)
+            return conn.getresponse()
+
+    def _send(self, key, method, target, headers, timeout):
+        conn, reused = self.acquire(key, timeout)
+        try:
+            return conn, self._exchange(conn, key, method, target, headers)
+        except Exception as e:
+            conn.close()
+            # A pooled connection the server already dropped - retry once on a fresh one
+            if reused and isinstance(e, (ConnectionError, OSError)) and not isinstance(e, TimeoutError):
+                self._count('stale_retries')
+                conn = self._new_connection(key, timeout)
+                try:
+                    return conn, self._exchange(conn, key, method, target, headers)
+                except Exception:
+                    conn.close()
+                    raise
+            raise
+
+    def open(self, url, headers=None, timeout=15, method='GET'):
+        """Issue a request and return a PooledResponse, following redirects.
+
+        Raises urllib.error.HTTPError for 4xx/5xx and urllib.error.URLError for
+        connection failures, matching what urllib.request.urlopen did.
+        """
+        import urllib.error
+        from urllib.parse import urljoin
+
+        for _ in range(HTTP_MAX_REDIRECTS + 1):
+            parsed = urlparse(url)
+            scheme = parsed.scheme.lower()
+            if scheme not in ('http', 'https') or not parsed.hostname:
+                raise urllib.error.URLError(f'unsupported URL: {url}')
+            port = parsed.port or (443 if scheme == 'https' else 80)
+            key = (scheme, parsed.hostname.lower(), port)
+            target = parsed.path or '/'
+            if parsed.query:
+                target += '?' + parsed.query
+
+            request_headers = {'Connection': 'keep-alive'}
+            request_headers.update(headers or {})
+
+            self._count('requests')
+            try:
+                conn, response = self._send(key, method, target, request_headers, timeout)
+            except (TimeoutError, urllib.error.URLError):
+                raise
+            except OSError as e:
+                raise urllib.error.URLError(e)
+
+            pooled = PooledResponse(self, key, conn, response, url)
+            location = response.getheader('Location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                # Drain the small redirect body so the connection can be reused
+                response.read()
+                pooled.close()
+                url = urljoin(url, location)
+                continue
+
+            if response.status >= 400:
+                body = response.read()
+                pooled.close()
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+
+            return pooled
+
+        raise urllib.error.URLError(f'too many redirects for {url}')
+
+HTTP_POOL = HTTPPool()
+
+# Requests to Reddit itself (not its image hosts) share one token bucket across
+# every reddit_fetcher process, since each action runs in its own NSTask. The
+# bucket lives in ratelimit.json in the cache dir, locked with flock while it
+# is read and updated. Reddit advertises its budget in X-Ratelimit-Remaining
+# and X-Ratelimit-Reset; the bucket spreads the remaining requests over the
+# time left in that window. Until those headers are seen it allows
+# RATE_LIMIT_DEFAULT requests per RATE_LIMIT_WINDOW seconds.
+RATE_LIMIT_HOSTS = ('reddit.com',)
+RATE_LIMIT_STATE_FILE = 'ratelimit.json'
+RATE_LIMIT_DEFAULT = 60
+RATE_LIMIT_WINDOW = 60.0
+RATE_LIMIT_BURST = 10
+# Waits longer than this return a retry_after hint instead of blocking the UI
+RATE_LIMIT_MAX_WAIT = float(os.environ.get('REDDIT_VIEWER_RATE_LIMIT_MAX_WAIT', '10'))
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF = 1.0
+RATE_LIMIT_BACKOFF_MAX = 30.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class RetryLater(Exception):
+    """A request was refused (or not sent) because of rate limits or server errors.
+
+    retry_after is the number of seconds after which trying again should succeed.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def header_seconds(headers, name):
+    """Read a numeric header (X-Ratelimit-*, Retry-After in seconds), or None"""
+    value = headers.get(name) if headers is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+class RateLimiter:
+    """Token bucket for Reddit requests, shared between processes through a locked state file"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        # Used when the state file cannot be opened, so the process still limits itself
+        self.local_state = {}
+
+    def _transact(self, change):
+        """Call change(state, now) with the shared state locked, save the state and return the result"""
+        import fcntl
+
+        path = self.path or os.path.join(get_cache_dir(), RATE_LIMIT_STATE_FILE)
+        with self.lock:
+            try:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            except OSError as e:
+                print(f"DEBUG: Rate limit state unavailable ({e}), limiting this process only", file=sys.stderr)
+                return change(self.local_state, time.time())
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                raw = os.read(fd, 4096)
+                try:
+                    state = json.loads(raw) if raw else {}
+                except ValueError:
+                    state = {}
+                if not isinstance(state, dict):
+                    state = {}
+                result = change(state, time.time())
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, json.dumps(state, separators=(',', ':')).encode('utf-8'))
+                return result
+            finally:
+                # Closing the descriptor releases the lock
+                os.close(fd)
+
+    @staticmethod
+    def _refill(state, now):
+        """Top up the bucket for the time since it was last updated"""
+        rate = RATE_LIMIT_DEFAULT / RATE_LIMIT_WINDOW
+        capacity = RATE_LIMIT_BURST
+        if state.get('reset_at', 0) > now:
+            # The advertised budget still applies
+            rate = state.get('rate', rate)
+            capacity = state.get('capacity', capacity)
+        tokens = state.get('tokens', capacity) + max(0.0, now - state.get('updated', now)) * rate
+        state['tokens'] = min(capacity, tokens)
+        state['updated'] = now
+        return rate
+
+    def acquire(self, url):
+        """Take a token for a request to url, sleeping until the bucket allows it.
+
+        Raises RetryLater when the wait would exceed RATE_LIMIT_MAX_WAIT.
+        """
+        def take(state, now):
+            rate = self._refill(state, now)
+            wait = max(0.0, state.get('blocked_until', 0) - now, (1 - state['tokens']) / rate)
+            if wait <= RATE_LIMIT_MAX_WAIT:
+                # Reserve the token now so other processes queue behind this request
+                state['tokens'] -= 1
+            return wait
+
+        wait = self._transact(take)
+        if wait > RATE_LIMIT_MAX_WAIT:
+            raise RetryLater(f'Rate limited by {urlparse(url).netloc}, retry in {wait:.0f}s', wait)
+        if wait > 0:
+            print(f"DEBUG: Rate limit: waiting {wait:.2f}s before {url}", file=sys.stderr)
+            with span('ratelimit.wait'):
+                time.sleep(wait)
+
+    def observe(self, headers):
+        """Adopt the budget a response advertises in its X-Ratelimit headers"""
+        remaining = header_seconds(headers, 'X-Ratelimit-Remaining')
+        reset = header_seconds(headers, 'X-Ratelimit-Reset')
+        if remaining is None or reset is None:
+            return
+
+        def update(state, now):
+            self._refill(state, now)
+            reset_in = max(reset, 1.0)
+            state['rate'] = max(remaining, 1.0) / reset_in
+            state['capacity'] = max(1.0, min(RATE_LIMIT_BURST, remaining))
+            state['reset_at'] = now + reset_in
+            state['tokens'] = min(state['tokens'], remaining)
+            if remaining < 1:
+                state['blocked_until'] = max(state.get('blocked_until', 0), now + reset_in)
+
+        self._transact(update)
+
+    def pause(self, seconds):
+        """Hold back every process's requests for the next seconds"""
+        def update(state, now):
+            state['blocked_until'] = max(state.get('blocked_until', 0), now + seconds)
+
+        self._transact(update)
+
+RATE_LIMITER = RateLimiter()
+
+def retry_delay(error, attempt):
+    """Seconds to wait before retrying a 429/5xx response: the server's hint, else jittered backoff"""
+    import random
+
+    retry_after = header_seconds(error.headers, 'Retry-After')
+    if retry_after is None and error.code == 429:
+        retry_after = header_seconds(error.headers, 'X-Ratelimit-Reset')
+    if retry_after is not None:
+        return retry_after
+    backoff = min(RATE_LIMIT_BACKOFF * 2 ** (attempt - 1), RATE_LIMIT_BACKOFF_MAX)
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+def is_rate_limited_host(url):
+    host = urlparse(url).netloc.lower().split(':')[0]
+    return any(host == limited or host.endswith('.' + limited) for limited in RATE_LIMIT_HOSTS)
+
+def rate_limited_open(url, headers=None, timeout=15):
+    """Open a Reddit URL within the shared request budget.
+
+    429 and 5xx responses are retried after the server's Retry-After or a
+    jittered exponential backoff, which every process honours. Raises
+    RetryLater (with retry_after) once the retries are used up or the wait
+    is too long to block on.
+    """
+    import urllib.error
+
+    attempt = 0
+    while True:
+        RATE_LIMITER.acquire(url)
+        try:
+            response = open_url(url, headers, timeout)
+        except urllib.error.HTTPError as e:
+            RATE_LIMITER.observe(e.headers)
+            if e.code not in RETRY_STATUSES:
+                raise
+            attempt += 1
+            delay = retry_delay(e, attempt)
+            if attempt > RATE_LIMIT_RETRIES or delay > RATE_LIMIT_MAX_WAIT:
+                raise RetryLater(f'HTTP {e.code}: {e.reason}', delay) from e
+            print(f"DEBUG: HTTP {e.code} from {urlparse(url).netloc}, retrying in {delay:.2f}s "
+                  f"(attempt {attempt}/{RATE_LIMIT_RETRIES})", file=sys.stderr)
+            RATE_LIMITER.pause(delay)
+            continue
+        RATE_LIMITER.observe(response.headers)
+        return response
+
+# Send every request to this server instead of the real hosts, with the
+# original host in X-Original-Host (used by the offline benchmarks in bench/)
+UPSTREAM_OVERRIDE = os.environ.get('REDDIT_VIEWER_UPSTREAM')
+
+def http_open(url, headers=None, timeout=15, compress=False):
+    """Open url, keeping requests to Reddit itself within the shared rate limit budget.
+
+    With compress=True (JSON and other text) the server may gzip or deflate
+    the body, and the returned response inflates it as it is read.
+    """
+    if compress:
+        headers = dict(headers or {})
+        headers['Accept-Encoding'] = 'gzip, deflate'
+    if is_rate_limited_host(url):
+        response = rate_limited_open(url, headers, timeout)
+    else:
+        response = open_url(url, headers, timeout)
+    if compress:
+        encoding = (response.headers.get('Content-Encoding') or '').strip().lower()
+        if encoding in ('gzip', 'x-gzip', 'deflate'):
+            return DecodedResponse(response, 'deflate' if encoding == 'deflate' else 'gzip')
+    return response
+
+def open_url(url, headers=None, timeout=15):
+    """Open url through the shared keep-alive pool (or urllib when a proxy is configured)"""
+    if UPSTREAM_OVERRIDE:
+        parsed = urlparse(url)
+        headers = dict(headers or {})
+        headers['X-Original-Host'] = parsed.netloc
+        url = UPSTREAM_OVERRIDE.rstrip('/') + (parsed.path or '/') + (f'?{parsed.query}' if parsed.query else '')
+        return HTTP_POOL.open(url, headers, timeout)
+
+    import urllib.request
+
+    scheme = urlparse(url).scheme.lower()
+    if scheme in urllib.request.getproxies():
+        request = urllib.request.Request(url, headers=headers or {})
+        return urllib.request.urlopen(request, timeout=timeout)
+    return HTTP_POOL.open(url, headers, timeout)
+
+# URL classification tables, compiled once at import. Host lists are matched
+# as substrings (like the original per-host loops) via one regex per list.
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.webm', '.mov', '.avi', '.mkv', '.m4v')
+IMAGE_HOSTS = ['i.redd.it', 'i.imgur.com', 'imgur.com', 'i.postimg.cc']
+# Video hosts (including NSFW)
+VIDEO_HOSTS = [
+    'v.redd.it', 'v.reddit.com', 'youtube.com', 'youtu.be',
+    'streamable.com', 'gfycat.com', 'redgifs.com', 'imgur.com/a/',
+    'clips.twitch.tv', 'vimeo.com'
+]
+# Common article/news domains
+ARTICLE_INDICATORS = [
+    '.com', '.org', '.net', '.edu', '.gov', '.co.uk', '.io',
+    'news', 'blog', 'article', 'medium.com', 'substack.com'
+]
+
+IMAGE_HOST_PATTERN = re.compile('|'.join(re.escape(host) for host in IMAGE_HOSTS))
+VIDEO_HOST_PATTERN = re.compile('|'.join(re.escape(host) for host in VIDEO_HOSTS))
+ARTICLE_PATTERN = re.compile('|'.join(re.escape(indicator) for indicator in ARTICLE_INDICATORS))
+CLEAN_IMAGE_URL_PATTERN = re.compile(r'\.(jpe?g|png|gif|webp|bmp)(?=[\?&]|$)', re.IGNORECASE)
+IGNORED_THUMBNAILS = ('self', 'default', 'spoiler', 'nsfw')
 
 def clean_image_url(url):
     """Properly clean image URLs by removing query parameters after file extension"""
@@ -16,8 +768,7 @@ def clean_image_url(url):
         return url
 
     # Find the last occurrence of image extensions
-    pattern = r'\.(jpe?g|png|gif|webp|bmp)(?=[\?&]|$)'
-    match = re.search(pattern, url, re.IGNORECASE)
+    match = CLEAN_IMAGE_URL_PATTERN.search(url)
 
     if match:
         # Return URL up to and including the file extension
@@ -26,108 +777,142 @@ def clean_image_url(url):
 
     return url
 
-def is_image_url(url):
-    """Check if URL points to an image"""
-    if not url:
-        return False
-    # Direct image extensions
-    image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp']
-    parsed = urlparse(url.lower())
-    for ext in image_extensions:
-        if parsed.path.endswith(ext):
-            return True
-    # Common image hosts
-    image_hosts = ['i.redd.it', 'i.imgur.com', 'imgur.com', 'i.postimg.cc']
-    if any(host in parsed.netloc for host in image_hosts):
-        return True
-    return False
+# The same image is linked through several hosts and query strings; these map
+# each spelling onto one URL (see canonical_image_url)
+PREVIEW_MEDIA_PATTERN = re.compile(r'^/(?:.*-v0-)?([A-Za-z0-9]+)\.(jpe?g|png|gif|webp)$', re.IGNORECASE)
+IMGUR_IMAGE_HOSTS = ('imgur.com', 'www.imgur.com', 'm.imgur.com')
 
-def is_video_url(url):
-    """Check if URL points to a video"""
-    if not url:
-        return False
+def canonical_image_url(url):
+    """Return the one spelling of an image URL that the caches and downloads use.
 
-    # Video extensions
-    video_extensions = ['.mp4', '.webm', '.mov', '.avi', '.mkv', '.m4v']
-    parsed = urlparse(url.lower())
-    for ext in video_extensions:
-        if parsed.path.endswith(ext):
-            return True
+    The query after an image extension is dropped (as clean_image_url does),
+    the scheme and host are lowercased, preview.redd.it copies of Reddit
+    uploads become i.redd.it URLs as in extract_gallery_images, and imgur
+    page hosts become i.imgur.com. Any other query is kept with its
+    parameters sorted.
+    """
+    if not url or not url[:4].lower() == 'http':
+        return url
 
-    # Video hosts (including NSFW)
-    video_hosts = [
-        'v.redd.it', 'v.reddit.com', 'youtube.com', 'youtu.be',
-        'streamable.com', 'gfycat.com', 'redgifs.com', 'imgur.com/a/',
-        'clips.twitch.tv', 'vimeo.com'
-    ]
-    return any(host in url.lower() for host in video_hosts)
+    from urllib.parse import parse_qsl, urlencode
 
-def is_article_url(url):
-    """Check if URL points to an article/external link"""
+    parsed = urlparse(clean_image_url(url.strip()))
+    host = (parsed.hostname or '').rstrip('.')
+    if parsed.port and parsed.port not in (80, 443):
+        host = f'{host}:{parsed.port}'
+    scheme = parsed.scheme.lower()
+    path = parsed.path or '/'
+
+    if host == 'preview.redd.it':
+        match = PREVIEW_MEDIA_PATTERN.match(path)
+        if match:
+            host, path = 'i.redd.it', f'/{match.group(1)}.{match.group(2).lower()}'
+    elif host in IMGUR_IMAGE_HOSTS and path.lower().endswith(IMAGE_EXTENSIONS):
+        host = 'i.imgur.com'
+    if host.endswith(('redd.it', 'redditmedia.com', 'imgur.com')):
+        scheme = 'https'
+
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True))) if parsed.query else ''
+    return f"{scheme}://{host}{path}" + (f"?{query}" if query else '')
+
+EMPTY_URL_CLASS = {'content_type': 'link', 'is_image': False, 'is_video': False, 'cleaned_url': '', 'thumbnail': None}
+YOUTUBE_ID_PATTERN = re.compile(r'(?:youtube\.com\/watch\?v=|youtu\.be\/)([a-zA-Z0-9_-]{11})')
+
+def video_thumbnail_from_url(url):
+    """Derive a thumbnail URL from a video URL alone (redgifs, YouTube)"""
+    # Redgifs thumbnail pattern: https://redgifs.com/watch/something -> https://thumbs2.redgifs.com/something-mobile.jpg
+    if 'redgifs.com' in url and '/watch/' in url:
+        video_id = url.split('/watch/')[-1].split('?')[0]
+        return f"https://thumbs2.redgifs.com/{video_id}-mobile.jpg"
+
+    # For YouTube, extract video ID and get thumbnail
+    if 'youtube.com' in url or 'youtu.be' in url:
+        match = YOUTUBE_ID_PATTERN.search(url)
+        if match:
+            return f"https://img.youtube.com/vi/{match.group(1)}/mqdefault.jpg"
+
+    return None
+
+@functools.lru_cache(maxsize=4096)
+def classify_url(url):
+    """Classify a post URL in one pass.
+
+    Returns a dict with content_type ('video', 'image', 'article' or 'link' -
+    self posts are decided by the caller), is_image, is_video, cleaned_url and
+    thumbnail, the best thumbnail candidate derivable from the URL itself.
+    Results are memoized per URL and must not be modified.
+    """
     if not url:
-        return False
+        return EMPTY_URL_CLASS
 
-    # Skip Reddit internal links
-    if 'reddit.com' in url or 'redd.it' in url:
-        return False
+    lower = url.lower()
+    parsed = urlparse(lower)
+    path = parsed.path
 
-    # Skip direct media
-    if is_image_url(url) or is_video_url(url):
-        return False
+    is_video = path.endswith(VIDEO_EXTENSIONS) or VIDEO_HOST_PATTERN.search(lower) is not None
+    is_image = path.endswith(IMAGE_EXTENSIONS) or IMAGE_HOST_PATTERN.search(parsed.netloc) is not None
+
+    if is_video:
+        content_type = 'video'
+    elif is_image:
+        content_type = 'image'
+    elif 'reddit.com' in url or 'redd.it' in url:
+        # Reddit internal links are never articles
+        content_type = 'link'
+    elif ARTICLE_PATTERN.search(lower):
+        content_type = 'article'
+    else:
+        content_type = 'link'  # Generic link
+
+    cleaned_url = clean_image_url(url)
+    if is_video:
+        thumbnail = video_thumbnail_from_url(url)
+    elif is_image:
+        thumbnail = cleaned_url
+    else:
+        thumbnail = None
+
+    return {
+        'content_type': content_type,
+        'is_image': is_image,
+        'is_video': is_video,
+        'cleaned_url': cleaned_url,
+        'thumbnail': thumbnail
+    }
+
+def is_image_url(url):
+    """Check if URL points to an image"""
+    return classify_url(url)['is_image']
 
-    # Common article/news domains
-    article_indicators = [
-        '.com', '.org', '.net', '.edu', '.gov', '.co.uk', '.io',
-        'news', 'blog', 'article', 'medium.com', 'substack.com'
-    ]
+def is_video_url(url):
+    """Check if URL points to a video"""
+    return classify_url(url)['is_video']
 
-    return any(indicator in url.lower() for indicator in article_indicators)
+def is_article_url(url):
+    """Check if URL points to an article/external link"""
+    return classify_url(url)['content_type'] == 'article'
 
 def get_content_type(post_data):
     """Determine the content type of a post"""
-    url = post_data.get('url', '')
-    is_self = post_data.get('is_self', False)
-
-    if is_self:
+    if post_data.get('is_self', False):
         return 'self'  # Text post
-    elif is_video_url(url):
-        return 'video'
-    elif is_image_url(url):
-        return 'image'
-    elif is_article_url(url):
-        return 'article'
-    else:
-        return 'link'  # Generic link
+    return classify_url(post_data.get('url', ''))['content_type']
+
+def reddit_thumbnail(post_data):
+    """Return Reddit's own thumbnail URL for a post, or None if it is a placeholder"""
+    thumbnail = post_data.get('thumbnail', '')
+    if thumbnail and thumbnail.startswith('http') and thumbnail not in IGNORED_THUMBNAILS:
+        return thumbnail
+    return None
 
 def extract_video_thumbnail(post_data, url):
     """Try to extract video thumbnail"""
     # Reddit often provides thumbnails for videos
-    thumbnail = post_data.get('thumbnail', '')
-    if thumbnail and thumbnail.startswith('http') and thumbnail not in ['self', 'default', 'spoiler', 'nsfw']:
+    thumbnail = reddit_thumbnail(post_data)
+    if thumbnail:
         return thumbnail
 
-    # For redgifs, try to get thumbnail
-    if 'redgifs.com' in url:
-        try:
-            # Redgifs thumbnail pattern: https://redgifs.com/watch/something -> https://thumbs2.redgifs.com/something-mobile.jpg
-            if '/watch/' in url:
-                video_id = url.split('/watch/')[-1].split('?')[0]
-                return f"https://thumbs2.redgifs.com/{video_id}-mobile.jpg"
-        except:
-            pass
-
-    # For YouTube, extract video ID and get thumbnail
-    if 'youtube.com' in url or 'youtu.be' in url:
-        try:
-            youtube_regex = r'(?:youtube\.com\/watch\?v=|youtu\.be\/)([a-zA-Z0-9_-]{11})'
-            match = re.search(youtube_regex, url)
-            if match:
-                video_id = match.group(1)
-                return f"https://img.youtube.com/vi/{video_id}/mqdefault.jpg"
-        except:
-            pass
-
-    return None
+    return classify_url(url)['thumbnail']
 
 def extract_article_thumbnail(url):
     """Try to extract article thumbnail"""
@@ -147,16 +932,11 @@ def extract_gallery_images(post_data):
                 # Get the full resolution image URL
                 img_url = media_info['s']['u'].replace('&amp;', '&')
                 # Convert preview URL to direct i.redd.it URL
-                if 'preview.redd.it' in img_url:
-                    # Extract the media ID and extension
-                    if 'm' in media_info:
-                        ext = media_info['m'].split('/')[-1]  # Gets 'jpg', 'png', etc.
-                        direct_url = f"https://i.redd.it/{media_id}.{ext}"
-                        images.append(direct_url)
-                    else:
-                        images.append(img_url)
-                else:
-                    images.append(img_url)
+                if 'preview.redd.it' in img_url and 'm' in media_info:
+                    # The mime type gives the extension ('jpg', 'png', etc.)
+                    ext = media_info['m'].split('/')[-1]
+                    img_url = f"https://i.redd.it/{media_id}.{ext}"
+                images.append(canonical_image_url(img_url))
 
     return images
 
@@ -177,7 +957,8 @@ def extract_image_info(post_data):
     }
 
     url = post_data.get('url', '')
-    content_type = get_content_type(post_data)
+    url_class = classify_url(url)
+    content_type = 'self' if post_data.get('is_self', False) else url_class['content_type']
     image_info['content_type'] = content_type
 
     # Handle different content types
@@ -206,8 +987,8 @@ def extract_image_info(post_data):
             image_info['has_image'] = True
         else:
             # Use Reddit's thumbnail if available
-            thumbnail = post_data.get('thumbnail', '')
-            if thumbnail and thumbnail.startswith('http') and thumbnail not in ['self', 'default', 'spoiler', 'nsfw']:
+            thumbnail = reddit_thumbnail(post_data)
+            if thumbnail:
                 image_info['thumbnail'] = thumbnail
                 image_info['has_image'] = True
 
@@ -223,25 +1004,17 @@ def extract_image_info(post_data):
             image_info['image_type'] = 'gallery'
 
             # Use Reddit's thumbnail if available
-            thumbnail = post_data.get('thumbnail', '')
-            if thumbnail and thumbnail.startswith('http') and thumbnail not in ['self', 'default', 'spoiler', 'nsfw']:
-                image_info['thumbnail'] = thumbnail
-            else:
-                image_info['thumbnail'] = gallery_images[0]
+            image_info['thumbnail'] = reddit_thumbnail(post_data) or gallery_images[0]
 
             return image_info
 
     # Check if it's a direct image post
-    if is_image_url(url):
+    if url_class['is_image']:
         image_info['has_image'] = True
-        image_info['image_url'] = clean_image_url(url)
+        image_info['image_url'] = url_class['cleaned_url']
         image_info['image_type'] = 'direct'
         # Use Reddit's thumbnail if available, otherwise use the image itself
-        thumbnail = post_data.get('thumbnail', '')
-        if thumbnail and thumbnail.startswith('http') and thumbnail not in ['self', 'default', 'spoiler', 'nsfw']:
-            image_info['thumbnail'] = thumbnail
-        else:
-            image_info['thumbnail'] = clean_image_url(url)
+        image_info['thumbnail'] = reddit_thumbnail(post_data) or url_class['thumbnail']
 
     # Check for preview images (Reddit's image processing)
     elif 'preview' in post_data and 'images' in post_data['preview']:
@@ -269,18 +1042,143 @@ def extract_image_info(post_data):
                     image_info['thumbnail'] = image_info['image_url']
 
     # Fallback to Reddit's thumbnail
-    elif post_data.get('thumbnail', '') and post_data['thumbnail'].startswith('http'):
-        thumbnail = post_data['thumbnail']
-        if thumbnail not in ['self', 'default', 'spoiler', 'nsfw']:
-            image_info['has_image'] = True
-            image_info['thumbnail'] = thumbnail
-            image_info['image_url'] = thumbnail
-            image_info['image_type'] = 'thumbnail'
+    elif reddit_thumbnail(post_data):
+        thumbnail = reddit_thumbnail(post_data)
+        image_info['has_image'] = True
+        image_info['thumbnail'] = thumbnail
+        image_info['image_url'] = thumbnail
+        image_info['image_type'] = 'thumbnail'
 
     return image_info
 
-def download_gallery_to_desktop(gallery_images, post_title):
-    """Download all images from a gallery to desktop"""
+# Download engine for full-size images and galleries. Reads start at
+# DOWNLOAD_MIN_CHUNK and grow while the link keeps up; interrupted transfers
+# are kept as .part files and resumed with an HTTP Range request.
+DOWNLOAD_MIN_CHUNK = 16 * 1024
+DOWNLOAD_MAX_CHUNK = 256 * 1024
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_PROGRESS_INTERVAL = 0.5
+GALLERY_WORKERS = 4
+
+class DownloadCancelled(Exception):
+    """Raised inside a download when its scheduler job is cancelled or preempted"""
+
+def download_file(url, filepath, headers=None, timeout=30, emit=None, retries=DOWNLOAD_RETRIES, cancel=None):
+    """Download url to filepath through a resumable .part file.
+
+    emit, if given, receives progress events for this file. Returns the number
+    of bytes in the finished file; raises on failure after the last retry.
+    Setting the cancel event stops the download between chunks with
+    DownloadCancelled, leaving the .part file to resume from later.
+    """
+    import urllib.error
+
+    part_path = filepath + '.part'
+    filename = os.path.basename(filepath)
+    attempt = 0
+
+    while True:
+        try:
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        except OSError:
+            offset = 0
+
+        request_headers = dict(headers or {})
+        if offset:
+            request_headers['Range'] = f'bytes={offset}-'
+
+        try:
+            try:
+                response = http_open(url, request_headers, timeout=timeout)
+            except urllib.error.HTTPError as e:
+                if e.code == 416 and offset:
+                    # Nothing left to send - the .part file already holds everything
+                    os.replace(part_path, filepath)
+                    return offset
+                raise
+
+            with response:
+                if offset and response.status != 206:
+                    # Server ignored the Range header - start over
+                    print(f"DEBUG: No range support for {filename}, restarting", file=sys.stderr)
+                    offset = 0
+                mode = 'ab' if offset else 'wb'
+
+                total = None
+                content_length = response.headers.get('Content-Length')
+                if content_length and content_length.isdigit():
+                    total = offset + int(content_length)
+
+                received = offset
+                chunk_size = DOWNLOAD_MIN_CHUNK
+                last_progress = 0.0
+                if emit:
+                    emit({'event': 'progress', 'file': filename, 'bytes': received, 'total': total})
+
+                with open(part_path, mode) as f:
+                    while True:
+                        if cancel is not None and cancel.is_set():
+                            raise DownloadCancelled(filename)
+                        started = time.time()
+                        chunk = response.read(chunk_size)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        received += len(chunk)
+
+                        # Grow the buffer while reads fill it quickly, shrink on a slow link
+                        elapsed = time.time() - started
+                        if len(chunk) == chunk_size and elapsed < 0.05:
+                            chunk_size = min(chunk_size * 2, DOWNLOAD_MAX_CHUNK)
+                        elif elapsed > 1.0:
+                            chunk_size = max(chunk_size // 2, DOWNLOAD_MIN_CHUNK)
+
+                        if emit and time.time() - last_progress >= DOWNLOAD_PROGRESS_INTERVAL:
+                            last_progress = time.time()
+                            emit({'event': 'progress', 'file': filename, 'bytes': received, 'total': total})
+
+                if total is not None and received < total:
+                    raise IOError(f'connection closed after {received} of {total} bytes')
+
+            os.replace(part_path, filepath)
+            if emit:
+                emit({'event': 'progress', 'file': filename, 'bytes': received, 'total': received, 'complete': True})
+            return received
+
+        except (urllib.error.HTTPError, DownloadCancelled):
+            raise
+        except Exception as e:
+            attempt += 1
+            if attempt > retries:
+                raise
+            print(f"DEBUG: Download of {filename} interrupted ({e}), resuming (attempt {attempt}/{retries})", file=sys.stderr)
+            sys.stderr.flush()
+            with span('download.retry_wait', file=filename):
+                time.sleep(min(2 ** attempt * 0.25, 4.0))
+
+def read_download_manifest(source):
+    """Read a gallery manifest from a file path or '-' for stdin.
+
+    Accepts {"title": ..., "urls": [...]}, a JSON list of URLs, or one URL per
+    line. Returns (urls, title) where title may be None.
+    """
+    if source == '-':
+        text = sys.stdin.read()
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            text = f.read()
+
+    text = text.strip()
+    if text.startswith('{') or text.startswith('['):
+        manifest = json.loads(text)
+        if isinstance(manifest, list):
+            return [str(url) for url in manifest], None
+        return [str(url) for url in manifest.get('urls', [])], manifest.get('title')
+
+    return [line.strip() for line in text.splitlines() if line.strip()], None
+
+def download_gallery_to_desktop(gallery_images, post_title, emit=None, max_workers=None):
+    """Download all images from a gallery to desktop, several at a time"""
     if not gallery_images:
         return {'success': False, 'message': 'No gallery images found'}
 
@@ -290,47 +1188,66 @@ def download_gallery_to_desktop(gallery_images, post_title):
     safe_title = re.sub(r'[^\w\s-]', '', post_title[:50]).strip().replace(' ', '_')
     gallery_folder = os.path.join(desktop_path, f"reddit_gallery_{safe_title}")
 
+    # Reuse a folder left behind by an interrupted download so it can resume
     counter = 1
-    while os.path.exists(gallery_folder):
+    while os.path.exists(gallery_folder) and not any(
+            name.endswith('.part') for name in os.listdir(gallery_folder)):
         gallery_folder = os.path.join(desktop_path, f"reddit_gallery_{safe_title}_{counter}")
         counter += 1
 
     try:
-        os.makedirs(gallery_folder)
+        os.makedirs(gallery_folder, exist_ok=True)
     except Exception as e:
         return {'success': False, 'message': f'Could not create folder: {e}'}
 
-    downloaded_files = []
     headers = {
         'User-Agent': 'Mozilla/5.0 (Macintosh; PPC Mac OS X 10_4) Reddit Viewer 1.0'
     }
 
+    jobs = []
+    used_names = set()
     for i, img_url in enumerate(gallery_images, 1):
-        try:
-            cleaned_url = clean_image_url(img_url)
-            parsed = urlparse(cleaned_url)
-            filename = os.path.basename(parsed.path)
-
-            if not filename or '.' not in filename:
-                filename = f"image_{i}.jpg"
+        cleaned_url = canonical_image_url(img_url.strip())
+        parsed = urlparse(cleaned_url)
+        filename = os.path.basename(parsed.path)
 
-            filepath = os.path.join(gallery_folder, filename)
+        if not filename or '.' not in filename:
+            filename = f"image_{i}.jpg"
+        if filename in used_names:
+            base_name, ext = os.path.splitext(filename)
+            filename = f"{base_name}_{i}{ext}"
+        used_names.add(filename)
+        jobs.append((i, cleaned_url, filename))
 
-            request = urllib.request.Request(cleaned_url, headers=headers)
-            with urllib.request.urlopen(request, timeout=30) as response:
-                with open(filepath, 'wb') as f:
-                    while True:
-                        chunk = response.read(8192)
-                        if not chunk:
-                            break
-                        f.write(chunk)
+    from concurrent.futures import ThreadPoolExecutor
 
-            downloaded_files.append(filename)
+    throttle = HostThrottle()
 
+    def download_job(job):
+        i, cleaned_url, filename = job
+        filepath = os.path.join(gallery_folder, filename)
+        if os.path.exists(filepath):
+            # Already downloaded by an earlier run: no request, so no turn in the throttle
+            return filename
+        host = urlparse(cleaned_url).netloc.lower()
+        with span('throttle.wait', host=host):
+            throttle.acquire(host)
+        try:
+            download_file(cleaned_url, filepath, headers, timeout=30, emit=emit)
+            return filename
         except Exception as e:
             print(f"DEBUG: Failed to download gallery image {i}: {e}", file=sys.stderr)
-            continue
+            if emit:
+                emit({'event': 'failed', 'file': filename, 'error': str(e)})
+            return None
+        finally:
+            throttle.release(host)
+
+    workers = min(max_workers or GALLERY_WORKERS, len(jobs))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(bind_trace(download_job), jobs))
 
+    downloaded_files = [filename for filename in results if filename]
     return {
         'success': True,
         'folder': gallery_folder,
@@ -338,15 +1255,15 @@ def download_gallery_to_desktop(gallery_images, post_title):
         'count': len(downloaded_files)
     }
 
-def download_full_image_to_desktop(image_url, post_title=None):
-    """Download full-sized image to desktop"""
+def download_full_image_to_desktop(image_url, post_title=None, emit=None, cancel=None):
+    """Download full-sized image to desktop, resuming an earlier partial download"""
     if not image_url or not image_url.startswith('http'):
         return {'success': False, 'path': ''}
 
     desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
 
     # Clean URL and get filename
-    cleaned_url = clean_image_url(image_url)
+    cleaned_url = canonical_image_url(image_url)
     parsed = urlparse(cleaned_url)
     filename = os.path.basename(parsed.path)
 
@@ -356,6 +1273,7 @@ def download_full_image_to_desktop(image_url, post_title=None):
             safe_title = re.sub(r'[^\w\s-]', '', post_title[:30]).strip().replace(' ', '_')
             filename = f"reddit_{safe_title}.jpg"
         else:
+            import hashlib
             url_hash = hashlib.md5(cleaned_url.encode()).hexdigest()[:8]
             filename = f"reddit_image_{url_hash}.jpg"
 
@@ -374,47 +1292,745 @@ def download_full_image_to_desktop(image_url, post_title=None):
             'User-Agent': 'Mozilla/5.0 (Macintosh; PPC Mac OS X 10_4) Reddit Viewer 1.0'
         }
 
-        request = urllib.request.Request(cleaned_url, headers=headers)
-        with urllib.request.urlopen(request, timeout=30) as response:
-            with open(filepath, 'wb') as f:
-                while True:
-                    chunk = response.read(8192)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-
-        return {'success': True, 'path': filepath, 'filename': filename}
+        size = download_file(cleaned_url, filepath, headers, timeout=30, emit=emit, cancel=cancel)
+        return {'success': True, 'path': filepath, 'filename': filename, 'bytes': size}
 
+    except DownloadCancelled:
+        raise
     except Exception as e:
         print(f"DEBUG: Failed to download full image: {e}", file=sys.stderr)
         return {'success': False, 'path': '', 'error': str(e)}
 
-def fetch_comments(permalink):
-    """Fetch comments for a Reddit post - return raw Reddit API response"""
-    # Clean up the permalink
-    if not permalink.startswith('/'):
-        permalink = '/' + permalink
+# Reddit-hosted video (v.redd.it) is fetched natively from its DASH manifest:
+# one video and one audio rendition, downloaded in parallel and muxed with
+# ffmpeg stream copy. Other hosts are left to yt-dlp.
+VIDEO_DEFAULT_MAX_HEIGHT = 480
+VIDEO_WORKERS = 4
+FFMPEG_SEARCH_PATH = ['/usr/local/bin', '/opt/local/bin', '/usr/bin']
+FFMPEG_TIMEOUT = 300
+ISO_DURATION_PATTERN = re.compile(r'P(?:(\d+(?:\.\d+)?)D)?(?:T(?:(\d+(?:\.\d+)?)H)?(?:(\d+(?:\.\d+)?)M)?(?:(\d+(?:\.\d+)?)S)?)?$')
+REDDIT_VIDEO_ID_PATTERN = re.compile(r'^https?://v\.redd\.it/([A-Za-z0-9]+)')
 
-    # Build the full URL
-    url = f"https://reddit.com{permalink}"
-    if not url.endswith('.json'):
-        url += '.json'
+def parse_iso_duration(text):
+    """Seconds in an ISO 8601 duration such as PT1M2.5S (0.0 if unparseable)"""
+    match = ISO_DURATION_PATTERN.match((text or '').strip())
+    if not match:
+        return 0.0
+    days, hours, minutes, seconds = (float(part) if part else 0.0 for part in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Macintosh; PPC Mac OS X 10_4) Reddit Viewer 1.0'
-    }
+def parse_dash_manifest(body, manifest_url):
+    """Read the renditions out of a DASH MPD.
 
-    try:
-        print(f"DEBUG: Fetching comments from: {url}", file=sys.stderr)
-        sys.stderr.flush()
+    Returns {"duration": seconds, "video": [...], "audio": [...]} where each
+    rendition is {"id", "bandwidth", "height", "width", "urls"}; urls is the
+    single BaseURL file or the initialization and media segments of a
+    SegmentList, in order, resolved against the manifest URL.
+    """
+    import xml.etree.ElementTree as ElementTree
+    from urllib.parse import urljoin
 
-        request = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(request, timeout=20) as response:
+    root = ElementTree.fromstring(body)
+    namespace = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+
+    def child(element, name):
+        return element.find(namespace + name)
+
+    def children(element, name):
+        return element.findall(namespace + name)
+
+    def base_url(element, parent_url):
+        base = child(element, 'BaseURL')
+        return urljoin(parent_url, base.text.strip()) if base is not None and base.text else parent_url
+
+    manifest = {'duration': parse_iso_duration(root.get('mediaPresentationDuration')), 'video': [], 'audio': []}
+    root_url = base_url(root, manifest_url)
+    for period in children(root, 'Period'):
+        period_url = base_url(period, root_url)
+        for adaptation in children(period, 'AdaptationSet'):
+            set_url = base_url(adaptation, period_url)
+            for representation in children(adaptation, 'Representation'):
+                kind = (adaptation.get('contentType') or representation.get('mimeType')
+                        or adaptation.get('mimeType') or '').split('/')[0]
+                if kind not in ('video', 'audio'):
+                    continue
+                rendition_url = base_url(representation, set_url)
+                urls = [rendition_url]
+                segment_list = child(representation, 'SegmentList')
+                if segment_list is not None:
+                    initialization = child(segment_list, 'Initialization')
+                    urls = [urljoin(rendition_url, initialization.get('sourceURL'))] if (
+                        initialization is not None and initialization.get('sourceURL')) else []
+                    urls += [urljoin(rendition_url, segment.get('media'))
+                             for segment in children(segment_list, 'SegmentURL') if segment.get('media')]
+                manifest[kind].append({
+                    'id': representation.get('id') or os.path.basename(urlparse(rendition_url).path),
+                    'bandwidth': int(representation.get('bandwidth') or 0),
+                    'height': int(representation.get('height') or 0),
+                    'width': int(representation.get('width') or 0),
+                    'urls': urls
+                })
+    return manifest
+
+def choose_renditions(manifest, max_height=None, max_bytes=None):
+    """Pick (video, audio) renditions for a target height or an estimated size budget.
+
+    The tallest video no taller than max_height, or with max_bytes the best
+    one whose estimated size (bandwidth x duration, plus the audio) fits;
+    the smallest when nothing fits. Audio is the best track, or the smallest
+    when a byte budget is set. Either may be None.
+    """
+    videos = sorted(manifest['video'], key=lambda rendition: (rendition['height'], rendition['bandwidth']))
+    audios = sorted(manifest['audio'], key=lambda rendition: rendition['bandwidth'])
+    audio = (audios[0] if max_bytes else audios[-1]) if audios else None
+
+    if max_bytes:
+        duration = manifest['duration']
+        audio_bytes = audio['bandwidth'] * duration / 8 if audio else 0
+        fitting = [video for video in videos if video['bandwidth'] * duration / 8 + audio_bytes <= max_bytes]
+    else:
+        height = max_height or VIDEO_DEFAULT_MAX_HEIGHT
+        fitting = [video for video in videos if video['height'] <= height]
+    video = (fitting or videos[:1] or [None])[-1]
+    return video, audio
+
+def reddit_video_manifest(video_url, headers):
+    """Return (video id, DASH manifest URL) for a Reddit-hosted video, or None for other hosts.
+
+    Accepts v.redd.it links and reddit.com post permalinks, whose post JSON
+    names the video (through the original post for crossposts).
+    """
+    match = REDDIT_VIDEO_ID_PATTERN.match(video_url)
+    if match:
+        return match.group(1), f"https://v.redd.it/{match.group(1)}/DASHPlaylist.mpd"
+    if not is_rate_limited_host(video_url) or '/comments/' not in video_url:
+        return None
+
+    post_url = video_url.split('?')[0].rstrip('/') + '.json'
+    with http_open(post_url, headers, timeout=15, compress=True) as response:
+        data = json.loads(response.read().decode('utf-8'))
+    post = data[0]['data']['children'][0]['data']
+    for candidate in [post] + (post.get('crosspost_parent_list') or []):
+        media = candidate.get('secure_media') or candidate.get('media') or {}
+        dash_url = (media.get('reddit_video') or {}).get('dash_url')
+        if dash_url:
+            video_id = REDDIT_VIDEO_ID_PATTERN.match(dash_url)
+            return (video_id.group(1) if video_id else post.get('id', 'video')), dash_url.split('?')[0]
+        if REDDIT_VIDEO_ID_PATTERN.match(candidate.get('url') or ''):
+            return reddit_video_manifest(candidate['url'], headers)
+    return None
+
+def find_ffmpeg():
+    """Path of an ffmpeg executable on PATH or in the usual Tiger install locations, or None"""
+    import shutil
+
+    search_path = os.pathsep.join([os.environ.get('PATH', '')] + FFMPEG_SEARCH_PATH)
+    return shutil.which('ffmpeg', path=search_path)
+
+def mux_video(ffmpeg, video_path, audio_path, output_path):
+    """Combine a video and an audio track into output_path without re-encoding; returns an error or None"""
+    import subprocess
+
+    command = [ffmpeg, '-y', '-loglevel', 'error', '-i', video_path, '-i', audio_path,
+               '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', output_path]
+    try:
+        with span('video.mux'):
+            process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                     timeout=FFMPEG_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return str(e)
+    if process.returncode != 0:
+        return process.stderr.decode('utf-8', 'replace').strip()[-500:] or f'ffmpeg exited with {process.returncode}'
+    return None
+
+def download_video(video_url, post_title=None, max_height=None, max_bytes=None, emit=None, max_workers=None):
+    """Download a Reddit-hosted video to the Desktop from its DASH manifest.
+
+    Picks a rendition with choose_renditions, downloads the video and audio
+    (and their segments, if the manifest lists them) in parallel through
+    resumable .part files, and muxes them with ffmpeg stream copy. Without
+    ffmpeg, or if muxing fails, the audio is left next to the video as
+    audio_path and muxed is false. Hosts other than Reddit return
+    {"success": false, "unsupported": true} so the caller can use yt-dlp.
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; PPC Mac OS X 10_4) Reddit Viewer 1.0'
+    }
+    if not video_url or not video_url.startswith('http'):
+        return {'success': False, 'path': '', 'error': 'No video URL'}
+
+    try:
+        found = reddit_video_manifest(video_url, headers)
+        if found is None:
+            return {'success': False, 'path': '', 'unsupported': True,
+                    'error': f'Not a Reddit-hosted video: {urlparse(video_url).netloc}'}
+        video_id, manifest_url = found
+
+        print(f"DEBUG: Fetching DASH manifest {manifest_url}", file=sys.stderr)
+        with http_open(manifest_url, headers, timeout=15, compress=True) as response:
+            manifest = parse_dash_manifest(response.read(), manifest_url)
+        video, audio = choose_renditions(manifest, max_height, max_bytes)
+        if video is None:
+            return {'success': False, 'path': '', 'error': 'No video rendition in the manifest'}
+        print(f"DEBUG: Chose video {video['id']} ({video['height']}p, {video['bandwidth']} b/s), "
+              f"audio {audio['id'] if audio else 'none'}", file=sys.stderr)
+    except Exception as e:
+        print(f"DEBUG: Could not read the video manifest: {e}", file=sys.stderr)
+        return {'success': False, 'path': '', 'error': str(e)}
+
+    # Parts live in the cache so an interrupted download resumes on the next attempt
+    work_dir = os.path.join(get_cache_dir(), 'video', video_id)
+    os.makedirs(work_dir, exist_ok=True)
+    tracks = [('video', video)] + ([('audio', audio)] if audio else [])
+    jobs = []
+    for kind, rendition in tracks:
+        safe_id = re.sub(r'[^\w.-]', '_', rendition['id'])
+        for index, url in enumerate(rendition['urls']):
+            jobs.append((kind, index, url, os.path.join(work_dir, f"{kind}_{safe_id}.{index}.seg")))
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def download_job(job):
+        kind, index, url, path = job
+        if not os.path.exists(path):
+            download_file(url, path, headers, timeout=30, emit=emit)
+        return path
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers or VIDEO_WORKERS, len(jobs))) as executor:
+            segment_paths = list(executor.map(bind_trace(download_job), jobs))
+    except Exception as e:
+        print(f"DEBUG: Video download failed: {e}", file=sys.stderr)
+        return {'success': False, 'path': '', 'error': str(e)}
+
+    # Join each track's segments in manifest order
+    track_paths = {}
+    for kind, rendition in tracks:
+        paths = [path for job, path in zip(jobs, segment_paths) if job[0] == kind]
+        track_path = os.path.join(work_dir, f"{kind}.mp4")
+        if len(paths) == 1:
+            os.replace(paths[0], track_path)
+        else:
+            with open(track_path, 'wb') as out:
+                for path in paths:
+                    with open(path, 'rb') as segment:
+                        while True:
+                            data = segment.read(DOWNLOAD_MAX_CHUNK)
+                            if not data:
+                                break
+                            out.write(data)
+            for path in paths:
+                os.remove(path)
+        track_paths[kind] = track_path
+
+    desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
+    safe_title = re.sub(r'[^\w\s-]', '', (post_title or video_id)[:50]).strip().replace(' ', '_') or video_id
+    base_name = f"reddit_{safe_title}"
+    filepath = os.path.join(desktop_path, f"{base_name}.mp4")
+    counter = 1
+    while os.path.exists(filepath):
+        filepath = os.path.join(desktop_path, f"{base_name}_{counter}.mp4")
+        counter += 1
+
+    result = {'success': True, 'path': filepath, 'filename': os.path.basename(filepath),
+              'height': video['height'], 'muxed': False}
+    if 'audio' not in track_paths:
+        # Reddit videos without sound have no audio track at all
+        os.replace(track_paths['video'], filepath)
+    else:
+        ffmpeg = find_ffmpeg()
+        mux_error = mux_video(ffmpeg, track_paths['video'], track_paths['audio'], filepath) if ffmpeg \
+            else 'ffmpeg not found'
+        if mux_error is None:
+            result['muxed'] = True
+            os.remove(track_paths['video'])
+            os.remove(track_paths['audio'])
+        else:
+            print(f"DEBUG: Could not mux video: {mux_error}", file=sys.stderr)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            audio_path = os.path.splitext(filepath)[0] + '_audio.mp4'
+            counter = 1
+            while os.path.exists(audio_path):
+                audio_path = os.path.splitext(filepath)[0] + f'_audio_{counter}.mp4'
+                counter += 1
+            os.replace(track_paths['video'], filepath)
+            os.replace(track_paths['audio'], audio_path)
+            result.update(audio_path=audio_path, mux_error=mux_error)
+
+    try:
+        os.rmdir(work_dir)
+    except OSError:
+        pass
+    result['bytes'] = os.path.getsize(filepath)
+    return result
+
+
+# Fields emitted per comment by the flattened comments format
+COMMENT_FIELDS = ['id', 'parent', 'depth', 'author', 'score', 'created_utc', 'body']
+
+def comment_record(comment, depth, fields):
+    """Build a compact comment record holding only the requested fields"""
+    record = {}
+    for field in fields:
+        if field == 'depth':
+            record['depth'] = depth
+        elif field == 'parent':
+            # Top-level comments point at the post (t3_); report those as no parent
+            parent_id = comment.get('parent_id') or ''
+            record['parent'] = parent_id[3:] if parent_id.startswith('t1_') else None
+        elif field == 'author':
+            record['author'] = comment.get('author', '[deleted]')
+        elif field == 'score':
+            record['score'] = comment.get('score', 0)
+        elif field == 'body':
+            record['body'] = comment.get('body', '')
+        else:
+            record[field] = comment.get(field)
+    return record
+
+def iter_comment_records(children, max_depth=None, max_comments=None, fields=None, tally=None):
+    """Yield compact comment records in display (depth-first) order.
+
+    children can be any iterable of top-level things, including one still
+    being parsed off the network; each subtree is released once walked.
+    tally, if given, is a dict that ends up holding "count", "more" (comments
+    left behind "load more" stubs or cut off by the limits) and "truncated".
+    """
+    fields = fields or COMMENT_FIELDS
+    tally = {} if tally is None else tally
+    tally.update(count=0, more=0, truncated=False)
+
+    for top in children or ():
+        # Explicit stack instead of recursion: mega-threads nest deep enough to matter
+        stack = [(top, 0)]
+        while stack:
+            child, depth = stack.pop()
+            kind = child.get('kind')
+            data = child.get('data') or {}
+
+            if kind == 'more':
+                tally['more'] += data.get('count', len(data.get('children', [])))
+                continue
+            if kind != 't1':
+                continue
+
+            if max_comments is not None and tally['count'] >= max_comments:
+                tally['truncated'] = True
+                tally['more'] += 1
+                continue
+
+            tally['count'] += 1
+            yield comment_record(data, depth, fields)
+
+            replies = data.get('replies')
+            if isinstance(replies, dict):
+                reply_children = replies.get('data', {}).get('children', [])
+                if max_depth is not None and depth + 1 > max_depth:
+                    if reply_children:
+                        tally['truncated'] = True
+                    continue
+                for reply in reversed(reply_children):
+                    stack.append((reply, depth + 1))
+
+def flatten_comment_tree(children, max_depth=None, max_comments=None, fields=None):
+    """Flatten a Reddit comment listing into records in display (depth-first) order.
+
+    Returns (records, more_count, truncated) where more_count is the number of
+    comments left behind "load more" stubs or cut off by the limits.
+    """
+    tally = {}
+    records = list(iter_comment_records(children, max_depth, max_comments, fields, tally))
+    return records, tally['more'], tally['truncated']
+
+def post_summary(post_listing):
+    """The post fields included with flattened comments, from the response's first listing"""
+    post_children = (post_listing or {}).get('data', {}).get('children', [])
+    if not post_children:
+        return {}
+    post_data = post_children[0].get('data', {})
+    return {
+        'id': post_data.get('id'),
+        'title': post_data.get('title', ''),
+        'author': post_data.get('author', '[deleted]'),
+        'score': post_data.get('score', 0),
+        'num_comments': post_data.get('num_comments', 0)
+    }
+
+def flatten_comments_response(data, max_depth=None, max_comments=None, fields=None):
+    """Turn the raw [post listing, comment listing] response into the compact format"""
+    post = post_summary(data[0] if data else None)
+    comment_children = data[1].get('data', {}).get('children', []) if len(data) > 1 else []
+    records, more_count, truncated = flatten_comment_tree(comment_children, max_depth, max_comments, fields)
+    return {
+        'success': True,
+        'post': post,
+        'comments': records,
+        'count': len(records),
+        'more': more_count,
+        'truncated': truncated
+    }
+
+# Text is pulled off the response this many bytes at a time by JSONStream
+JSON_STREAM_CHUNK = 64 * 1024
+
+class JSONStream:
+    """Incremental reader for one large JSON document arriving in chunks.
+
+    Walks objects and arrays as text arrives and decodes only the values the
+    caller asks for (read_value), skipping the rest, so memory is bounded by
+    the largest value read instead of the whole document. Malformed or
+    truncated input raises json.JSONDecodeError.
+    """
+
+    STRUCTURE = re.compile(r'["{}\[\]]')
+    STRING_END = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+    SCALAR_END = re.compile(r'[,\]}\s]')
+    WHITESPACE = re.compile(r'\s*')
+
+    def __init__(self, read, chunk_size=JSON_STREAM_CHUNK):
+        import codecs
+
+        self.read = read
+        self.chunk_size = chunk_size
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Append the next chunk of text; False once the input is exhausted"""
+        if self.eof:
+            return False
+        chunk = self.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            self.buffer += self.text_decoder.decode(b'', final=True)
+            return False
+        self.buffer += self.text_decoder.decode(chunk)
+        return True
+
+    def _fail(self, message):
+        raise json.JSONDecodeError(message, self.buffer, min(self.pos, len(self.buffer)))
+
+    def _string_end(self, index):
+        """Index just past the closing quote of a string whose body starts at index"""
+        while True:
+            match = self.STRING_END.match(self.buffer, index)
+            if match:
+                return match.end()
+            if not self._fill():
+                self._fail('Unterminated string')
+
+    def _value_end(self):
+        """Index just past the value starting at self.pos, reading more input as needed"""
+        first = self.peek()
+        if not first:
+            self._fail('Expecting value')
+        if first == '"':
+            return self._string_end(self.pos + 1)
+        if first not in '{[':
+            # Number, true, false or null: runs up to the next delimiter
+            while True:
+                match = self.SCALAR_END.search(self.buffer, self.pos)
+                if match:
+                    return match.start()
+                if not self._fill():
+                    return len(self.buffer)
+
+        depth = 0
+        index = self.pos
+        while True:
+            match = self.STRUCTURE.search(self.buffer, index)
+            if match is None:
+                index = len(self.buffer)
+                if not self._fill():
+                    self._fail('Unexpected end of document')
+                continue
+            char = match.group()
+            if char == '"':
+                index = self._string_end(match.end())
+                continue
+            depth += 1 if char in '{[' else -1
+            index = match.end()
+            if depth == 0:
+                return index
+
+    def peek(self):
+        """Skip whitespace and return the next character ('' at the end of input)"""
+        if self.pos > self.chunk_size:
+            # Drop text already consumed; no value is being scanned between tokens
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        while True:
+            self.pos = self.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            self._fail(f'Expecting {char!r}')
+        self.pos += 1
+
+    def read_value(self):
+        """Decode and return the next value"""
+        first = self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+                # A number ending right at the buffer's end may continue in the next chunk
+                if end < len(self.buffer) or self.eof or first in '{["tfn':
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # The value runs past the text read so far: at least double what is
+            # buffered before decoding again, so a large value is re-parsed only
+            # a logarithmic number of times
+            wanted = 2 * (len(self.buffer) - self.pos)
+            while len(self.buffer) - self.pos < wanted and self._fill():
+                pass
+
+    def skip_value(self):
+        """Step over the next value without decoding it"""
+        self.pos = self._value_end()
+
+    def items(self):
+        """Enter an array; yields once per element, which the caller must read or skip"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            char = self.peek()
+            if not char:
+                self._fail('Unexpected end of document')
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                self.pos -= 1
+                self._fail("Expecting ',' delimiter")
+
+    def keys(self):
+        """Enter an object; yields each key, whose value the caller must read or skip"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                self._fail('Expecting property name enclosed in double quotes')
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            if not char:
+                self._fail('Unexpected end of document')
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                self.pos -= 1
+                self._fail("Expecting ',' delimiter")
+
+def iter_comments_stream(stream, on_post=None):
+    """Yield the top-level comment things of a [post listing, comment listing] response.
+
+    The post listing comes first in Reddit's response and is passed to on_post
+    as soon as it is parsed; each top-level comment is decoded (with its
+    replies) only when reached, and the rest of the document is skipped.
+    """
+    elements = stream.items()
+    if next(elements, False) is False:
+        return
+    post_listing = stream.read_value()
+    if on_post:
+        on_post(post_listing)
+    if next(elements, False) is False:
+        return
+    for key in stream.keys():
+        if key != 'data':
+            stream.skip_value()
+            continue
+        for data_key in stream.keys():
+            if data_key != 'children':
+                stream.skip_value()
+                continue
+            for _ in stream.items():
+                yield stream.read_value()
+    for _ in elements:
+        stream.skip_value()
+
+# Expanding "load more" stubs: /api/morechildren takes at most 100 ids per
+# call; a few calls run at once, within a comment count and a time budget
+MORECHILDREN_BATCH = 100
+MORECHILDREN_WORKERS = 3
+MORECHILDREN_MAX_COMMENTS = 500
+MORECHILDREN_TIME_BUDGET = 8.0
+
+def fetch_more_children(link_id, ids, headers, timeout):
+    """Fetch one batch of hidden comments; returns their things as a flat list"""
+    url = 'https://www.reddit.com/api/morechildren.json?' + urlencode({
+        'api_type': 'json', 'link_id': link_id, 'children': ','.join(ids),
+        'limit_children': 'false', 'raw_json': 1
+    })
+    with http_open(url, headers, timeout=timeout, compress=True) as response:
+        raw_data = response.read()
+    with span('json.decode', bytes=len(raw_data)):
+        data = json.loads(raw_data.decode('utf-8'))
+    return ((data.get('json') or {}).get('data') or {}).get('things') or []
+
+def expand_more_comments(data, headers, max_comments=None, time_budget=None, max_workers=None):
+    """Resolve "more" stubs in a raw comments response in place, in batched rounds.
+
+    Fetched comments are spliced where their stub was (or under their parent
+    comment), stubs nested in what was fetched are expanded in later rounds,
+    and ids left over when a budget runs out stay behind in a smaller stub.
+    Returns the number of comments added.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    max_comments = MORECHILDREN_MAX_COMMENTS if max_comments is None else max_comments
+    deadline = time.time() + (MORECHILDREN_TIME_BUDGET if time_budget is None else time_budget)
+    post_children = data[0].get('data', {}).get('children', []) if data else []
+    if len(data) < 2 or not post_children:
+        return 0
+    link_id = post_children[0].get('data', {}).get('name') or 't3_' + post_children[0].get('data', {}).get('id', '')
+    added = 0
+    failed_ids = set()
+
+    def replies_of(comment_data):
+        replies = comment_data.get('replies')
+        if not isinstance(replies, dict):
+            replies = {'kind': 'Listing', 'data': {'children': []}}
+            comment_data['replies'] = replies
+        return replies.setdefault('data', {}).setdefault('children', [])
+
+    with ThreadPoolExecutor(max_workers=max_workers or MORECHILDREN_WORKERS) as executor:
+        while added < max_comments and time.time() < deadline:
+            # Index the current tree: comments by fullname, stubs with the list holding them
+            comments = {}
+            stubs = []
+            stack = [data[1].get('data', {}).get('children', [])]
+            while stack:
+                container = stack.pop()
+                for child in container:
+                    child_data = child.get('data') or {}
+                    if child.get('kind') == 't1':
+                        comments[child_data.get('name') or 't1_' + child_data.get('id', '')] = child_data
+                        if isinstance(child_data.get('replies'), dict):
+                            stack.append(child_data['replies'].get('data', {}).get('children', []))
+                    elif child.get('kind') == 'more' and child_data.get('children'):
+                        stubs.append((container, child))
+            if not stubs:
+                break
+
+            # Take ids stub by stub (in tree order) up to the remaining budget
+            wanted = []
+            owner = {}
+            for stub in stubs:
+                pending = [comment_id for comment_id in stub[1]['data']['children'] if comment_id not in failed_ids]
+                for comment_id in pending[:max_comments - added - len(wanted)]:
+                    wanted.append(comment_id)
+                    owner[comment_id] = stub
+            if not wanted:
+                break
+            batches = [wanted[i:i + MORECHILDREN_BATCH] for i in range(0, len(wanted), MORECHILDREN_BATCH)]
+
+            def fetch_batch(batch):
+                timeout = max(1.0, deadline - time.time())
+                try:
+                    return batch, fetch_more_children(link_id, batch, headers, timeout)
+                except Exception as e:
+                    print(f"DEBUG: morechildren batch of {len(batch)} failed: {e}", file=sys.stderr)
+                    return batch, None
+
+            things = []
+            fetched_ids = set()
+            with span('comments.morechildren', ids=len(wanted), batches=len(batches)):
+                for batch, batch_things in executor.map(bind_trace(fetch_batch), batches):
+                    if batch_things is None:
+                        # Not retried in later rounds; the ids stay in their stub
+                        failed_ids.update(batch)
+                        continue
+                    fetched_ids.update(batch)
+                    things.extend(batch_things)
+            if not fetched_ids:
+                break
+
+            # Splice: under a fetched or existing parent comment, else where the stub was
+            fetched = {}
+            for thing in things:
+                if thing.get('kind') == 't1':
+                    thing_data = thing.get('data') or {}
+                    fetched[thing_data.get('name') or 't1_' + thing_data.get('id', '')] = thing_data
+            spliced = {}
+            for thing in things:
+                thing_data = thing.get('data') or {}
+                if thing.get('kind') not in ('t1', 'more'):
+                    continue
+                parent_id = thing_data.get('parent_id')
+                stub = owner.get(thing_data.get('id'))
+                if parent_id in fetched:
+                    replies_of(fetched[parent_id]).append(thing)
+                elif stub is not None and parent_id == stub[1]['data'].get('parent_id'):
+                    spliced.setdefault(id(stub[1]), []).append(thing)
+                elif parent_id in comments:
+                    replies_of(comments[parent_id]).append(thing)
+                elif stub is not None:
+                    spliced.setdefault(id(stub[1]), []).append(thing)
+                else:
+                    continue
+                if thing.get('kind') == 't1':
+                    added += 1
+
+            for container, stub in stubs:
+                left = [comment_id for comment_id in stub['data']['children'] if comment_id not in fetched_ids]
+                if len(left) == len(stub['data']['children']) and id(stub) not in spliced:
+                    continue
+                replacement = spliced.get(id(stub), [])
+                if left:
+                    stub['data']['children'] = left
+                    stub['data']['count'] = len(left)
+                    replacement = replacement + [stub]
+                for index, child in enumerate(container):
+                    if child is stub:
+                        container[index:index + 1] = replacement
+                        break
+
+    print(f"DEBUG: Expanded {added} hidden comments", file=sys.stderr)
+    return added
+
+def fetch_comments(permalink, flat=False, max_depth=None, max_comments=None, fields=None, sort=None,
+                   expand_more=False, more_limit=None, more_time=None):
+    """Fetch comments for a Reddit post.
+
+    Returns the raw Reddit API response, or with flat=True a compact list of
+    comment records pruned to max_depth/max_comments and the given fields.
+    sort asks Reddit for a comment order ("new", "top", ...). expand_more
+    resolves "load more" stubs through /api/morechildren, up to more_limit
+    extra comments and more_time seconds.
+    """
+    url = comments_url(permalink, flat, max_depth, max_comments, sort)
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; PPC Mac OS X 10_4) Reddit Viewer 1.0'
+    }
+
+    try:
+        print(f"DEBUG: Fetching comments from: {url}", file=sys.stderr)
+        sys.stderr.flush()
+
+        with http_open(url, headers, timeout=20, compress=True) as response:
             raw_data = response.read().decode('utf-8')
             print(f"DEBUG: Raw response length: {len(raw_data)}", file=sys.stderr)
 
             # Parse to validate it's proper JSON
-            data = json.loads(raw_data)
+            with span('json.decode', bytes=len(raw_data)):
+                data = json.loads(raw_data)
 
             print(f"DEBUG: Parsed data type: {type(data)}", file=sys.stderr)
             if isinstance(data, list):
@@ -422,29 +2038,460 @@ def fetch_comments(permalink):
                 if len(data) >= 2:
                     print(f"DEBUG: Second element (comments) type: {type(data[1])}", file=sys.stderr)
 
-            # Return the raw Reddit API response directly
             sys.stderr.flush()
+            if expand_more and isinstance(data, list):
+                expand_more_comments(data, headers, more_limit, more_time)
+            if flat:
+                with span('comments.flatten'):
+                    return flatten_comments_response(data, max_depth, max_comments, fields)
+
+            # Return the raw Reddit API response directly
             return data
 
-    except urllib.error.HTTPError as e:
+    except Exception as e:
+        return comments_error_result(e)
+
+def comments_url(permalink, flat=False, max_depth=None, max_comments=None, sort=None):
+    """Build the .json URL for a thread; for the flat format Reddit prunes it first"""
+    # Clean up the permalink
+    if not permalink.startswith('/'):
+        permalink = '/' + permalink
+
+    # Build the full URL
+    url = f"https://reddit.com{permalink}"
+    if not url.endswith('.json'):
+        url += '.json'
+
+    if flat:
+        # Let Reddit do the first round of pruning so less comes over the wire
+        query = {'raw_json': 1}
+        if max_depth is not None:
+            query['depth'] = max_depth + 1
+        if max_comments is not None:
+            query['limit'] = max_comments
+        if sort:
+            query['sort'] = sort
+        url += '?' + urlencode(query)
+    elif sort:
+        url += '?' + urlencode({'sort': sort})
+    return url
+
+def comments_error_result(e):
+    """Log a failed comments fetch and return its JSON error result"""
+    import urllib.error
+
+    if isinstance(e, RetryLater):
+        print(f"DEBUG: {e}", file=sys.stderr)
+        result = {'success': False, 'error': str(e), 'retry_after': round(e.retry_after, 1)}
+    elif isinstance(e, urllib.error.HTTPError):
         print(f"DEBUG: HTTP Error {e.code}: {e.reason}", file=sys.stderr)
-        sys.stderr.flush()
-        return {'success': False, 'error': f'HTTP {e.code}: {e.reason}'}
-    except urllib.error.URLError as e:
+        result = {'success': False, 'error': f'HTTP {e.code}: {e.reason}'}
+    elif isinstance(e, urllib.error.URLError):
         print(f"DEBUG: URL Error: {e.reason}", file=sys.stderr)
-        sys.stderr.flush()
-        return {'success': False, 'error': f'Network error: {e.reason}'}
-    except json.JSONDecodeError as e:
+        result = {'success': False, 'error': f'Network error: {e.reason}'}
+    elif isinstance(e, json.JSONDecodeError):
         print(f"DEBUG: JSON decode error: {e}", file=sys.stderr)
+        result = {'success': False, 'error': f'Invalid JSON response'}
+    else:
+        print(f"DEBUG: Unexpected error: {e}", file=sys.stderr)
+        result = {'success': False, 'error': str(e)}
+    sys.stderr.flush()
+    return result
+
+def write_comments_stream(permalink, out=None, flat=False, max_depth=None, max_comments=None, fields=None,
+                          sort=None):
+    """Fetch a thread and write it to out as it downloads, never holding the whole response.
+
+    The raw format is copied through as it arrives. The flat format is parsed
+    with JSONStream, and each top-level comment is pruned and written as soon
+    as it has been read, as {"post", "comments", "count", "more", "truncated",
+    "success"}. success comes last, so a failure part-way still closes the
+    document, with "success": false and an "error". Peak memory follows the
+    largest single top-level comment subtree, not the size of the thread.
+
+    Returns None once the output is written, or an error result (with nothing
+    written) for the caller to print.
+    """
+    out = out or sys.stdout
+    url = comments_url(permalink, flat, max_depth, max_comments, sort)
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; PPC Mac OS X 10_4) Reddit Viewer 1.0'
+    }
+    print(f"DEBUG: Streaming comments from: {url}", file=sys.stderr)
+    sys.stderr.flush()
+
+    try:
+        response = http_open(url, headers, timeout=20, compress=True)
+    except Exception as e:
+        return comments_error_result(e)
+
+    with response:
+        if not flat:
+            return copy_comments_response(response, out)
+
+        written = False
+
+        def write_head(post_listing):
+            nonlocal written
+            out.write('{"post":' + json.dumps(post_summary(post_listing), separators=(',', ':')) + ',"comments":[')
+            written = True
+
+        tally = {}
+        status = {'success': True}
+        try:
+            with span('comments.stream'):
+                separator = ''
+                records = iter_comment_records(iter_comments_stream(JSONStream(response.read), write_head),
+                                               max_depth, max_comments, fields, tally)
+                for record in records:
+                    out.write(separator + json.dumps(record, separators=(',', ':')))
+                    separator = ','
+            if not written:
+                write_head(None)
+        except Exception as e:
+            status = comments_error_result(e)
+            if not written:
+                return status
+
+    tail = {'count': tally.get('count', 0), 'more': tally.get('more', 0), 'truncated': tally.get('truncated', False)}
+    tail.update(status)
+    tail = finish_trace(current_trace(), tail)
+    # The tail's members close the document: ],"count":...,"success":true}
+    out.write('],' + json.dumps(tail, separators=(',', ':'))[1:] + '\n')
+    print(f"DEBUG: Streamed {tail['count']} comments", file=sys.stderr)
+    return None
+
+def copy_comments_response(response, out):
+    """Copy a raw comments response to out chunk by chunk (see write_comments_stream)"""
+    import codecs
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    total = 0
+    started = False
+    try:
+        while True:
+            chunk = response.read(JSON_STREAM_CHUNK)
+            text = decoder.decode(chunk, final=not chunk)
+            if not started and text.strip():
+                if text.lstrip()[0] not in '[{':
+                    raise json.JSONDecodeError('Expecting value', text, 0)
+                started = True
+            if text:
+                out.write(text)
+                total += len(text)
+            if not chunk:
+                break
+    except Exception as e:
+        if not started:
+            return comments_error_result(e)
+        # Part of the document is already out; the reader will see it is incomplete
+        print(f"DEBUG: Comments stream broke off after {total} characters: {e}", file=sys.stderr)
+        return None
+    if not started:
+        return comments_error_result(json.JSONDecodeError('Expecting value', '', 0))
+    out.write('\n')
+    finish_trace(current_trace())
+    print(f"DEBUG: Streamed {total} characters of comments", file=sys.stderr)
+    return None
+
+# The file to launch for detached helpers. When running from the precompiled
+# bundle (make bundle-python), __file__ points inside the .pyz archive.
+SCRIPT_PATH = os.path.abspath(__file__)
+if not os.path.isfile(SCRIPT_PATH) and os.path.isfile(os.path.dirname(SCRIPT_PATH)):
+    SCRIPT_PATH = os.path.dirname(SCRIPT_PATH)
+
+CACHE_DIR = None
+
+def get_cache_dir():
+    """Return the writable cache directory, creating it on first use"""
+    global CACHE_DIR
+    if CACHE_DIR is not None:
+        return CACHE_DIR
+
+    # Set up cache directory - try to use a writable location
+    script_dir = os.path.dirname(SCRIPT_PATH)
+    if os.environ.get('REDDIT_VIEWER_CACHE_DIR'):
+        # Explicit override (used by the offline benchmarks for a fresh cache per run)
+        cache_dir = os.environ['REDDIT_VIEWER_CACHE_DIR']
+    elif 'Contents/Resources' in script_dir:
+        # In an app bundle Resources folder, use the user's cache directory instead
+        home_dir = os.path.expanduser("~")
+        cache_dir = os.path.join(home_dir, ".reddit_viewer_cache")
+    else:
+        # Use local directory for development
+        cache_dir = os.path.join(script_dir, "image_cache")
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        print(f"DEBUG: Using cache directory: {cache_dir}", file=sys.stderr)
         sys.stderr.flush()
-        return {'success': False, 'error': f'Invalid JSON response'}
     except Exception as e:
-        print(f"DEBUG: Unexpected error: {e}", file=sys.stderr)
+        print(f"DEBUG: Could not create cache dir {cache_dir}: {e}", file=sys.stderr)
+        # Fallback to temp directory
+        import tempfile
+        cache_dir = tempfile.gettempdir()
+        print(f"DEBUG: Using temp directory: {cache_dir}", file=sys.stderr)
         sys.stderr.flush()
-        return {'success': False, 'error': str(e)}
 
-def fetch_reddit_data_with_pagination(subreddit="all", sort="hot", limit=25, after=None, before=None):
-    """Fetch Reddit data with pagination support and enhanced content detection"""
+    CACHE_DIR = cache_dir
+    return cache_dir
+
+# Listing cache: extracted post dicts stored per (subreddit, sort, limit, after, before).
+# Entries younger than the TTL are served without touching the network; with
+# stale-while-revalidate, older entries are served immediately and refreshed
+# in the background using the stored ETag/Last-Modified validators.
+LISTING_CACHE_TTL = float(os.environ.get('REDDIT_VIEWER_LISTING_TTL', '60'))
+LISTING_STALE_WHILE_REVALIDATE = os.environ.get('REDDIT_VIEWER_LISTING_SWR', '0') == '1'
+LISTING_CACHE_MAX_STALE = 24 * 60 * 60
+
+def listing_cache_path(subreddit, sort, limit, after=None, before=None):
+    """Return the cache file path for a listing request"""
+    import hashlib
+
+    key = json.dumps([subreddit.lower(), sort, min(limit, 100), after, before])
+    key_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(get_cache_dir(), 'listings', f"{key_hash}.json")
+
+def read_listing_cache(path):
+    """Load a listing cache entry, or None if missing or unreadable"""
+    try:
+        with span('listing_cache.read'), open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or 'posts' not in entry:
+        return None
+    return entry
+
+def write_json_atomic(path, data):
+    """Write data as JSON through a temp file, so readers never see a partial file; raises OSError"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+def remove_files_older_than(directory, max_age):
+    """Delete the files in directory last written more than max_age seconds ago; returns how many"""
+    now = time.time()
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+def write_listing_cache(path, entry):
+    """Atomically write a listing cache entry"""
+    try:
+        with span('listing_cache.write'):
+            write_json_atomic(path, entry)
+    except OSError as e:
+        print(f"DEBUG: Could not write listing cache {path}: {e}", file=sys.stderr)
+
+def mark_listing_cache(path, field):
+    """Stamp a listing cache entry with field = now (synced_at, prefetched_at)"""
+    entry = read_listing_cache(path)
+    if entry is not None:
+        entry[field] = time.time()
+        write_listing_cache(path, entry)
+
+def prune_listing_cache(max_age=LISTING_CACHE_MAX_STALE):
+    """Remove listing cache entries too old to be served even as stale data"""
+    return remove_files_older_than(os.path.join(get_cache_dir(), 'listings'), max_age)
+
+def listing_from_cache(entry, age, stale=False, revalidated=False):
+    """Build a listing result from a cache entry"""
+    return {
+        'success': True,
+        'posts': entry['posts'],
+        'pagination': entry.get('pagination', {'after': None, 'before': None}),
+        'cache': {
+            'hit': True,
+            'age': round(max(age, 0.0), 1),
+            'stale': stale,
+            'revalidated': revalidated
+        }
+    }
+
+# Background work: in server mode it runs on a thread of the resident process;
+# one-shot commands hand it to a detached helper process so the caller, which
+# waits for us to exit, isn't held up.
+BACKGROUND_EXECUTOR = None
+BACKGROUND_PENDING = set()
+BACKGROUND_LOCK = threading.Lock()
+
+# Incremental comment refresh: the last tree seen for each thread is kept under
+# threads/, and a refresh asks only for the newest comments (sort=new, bounded)
+COMMENT_REFRESH_LIMIT = 100
+THREAD_SNAPSHOT_MAX_AGE = 24 * 60 * 60
+
+def thread_cache_path(permalink):
+    """Return the snapshot path for a thread, whatever form the permalink was given in"""
+    import hashlib
+
+    path = urlparse(permalink).path if '://' in permalink else permalink.split('?')[0]
+    if path.endswith('.json'):
+        path = path[:-len('.json')]
+    key = '/' + path.strip('/').lower()
+    return os.path.join(get_cache_dir(), 'threads', hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+def read_thread_snapshot(path):
+    """Load a thread snapshot, or None if missing or unreadable"""
+    try:
+        with span('thread_snapshot.read'), open(path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or not isinstance(snapshot.get('comments'), dict):
+        return None
+    return snapshot
+
+def write_thread_snapshot(path, snapshot):
+    """Atomically write a thread snapshot"""
+    try:
+        with span('thread_snapshot.write'):
+            write_json_atomic(path, snapshot)
+    except OSError as e:
+        print(f"DEBUG: Could not write thread snapshot {path}: {e}", file=sys.stderr)
+
+def prune_thread_snapshots(max_age=THREAD_SNAPSHOT_MAX_AGE):
+    """Remove snapshots of threads not refreshed for max_age seconds"""
+    return remove_files_older_than(os.path.join(get_cache_dir(), 'threads'), max_age)
+
+def refresh_comments(permalink, limit=None, fields=None):
+    """Merge a thread's newest comments into its cached tree and return only the changes.
+
+    The first call (or one whose cached tree is missing) fetches the whole
+    thread. Later calls fetch the newest limit comments and return
+    {"new": records not seen before, in display order, "scores": {id: score}
+    for known comments whose score changed}. If every comment in that window
+    is new, some may have been missed, so the whole thread is fetched instead
+    ("full": true).
+    """
+    limit = limit or COMMENT_REFRESH_LIMIT
+    path = thread_cache_path(permalink)
+    snapshot = read_thread_snapshot(path)
+
+    full = snapshot is None
+    if not full:
+        result = fetch_comments(permalink, flat=True, max_comments=limit, sort='new')
+        if not result.get('success'):
+            return result
+        top_level = [record for record in result['comments'] if record.get('parent') is None]
+        window_full = result['truncated'] or result['more'] or len(result['comments']) >= limit
+        if window_full and top_level and all(record['id'] not in snapshot['comments'] for record in top_level):
+            print(f"DEBUG: Refresh window saturated for {permalink}, fetching the whole thread", file=sys.stderr)
+            full = True
+    if full:
+        result = fetch_comments(permalink, flat=True)
+        if not result.get('success'):
+            return result
+
+    known = snapshot['comments'] if snapshot else {}
+    new_records = []
+    scores = {}
+    for record in result['comments']:
+        previous = known.get(record['id'])
+        if previous is None:
+            new_records.append(record)
+            known[record['id']] = record
+        elif previous.get('score') != record.get('score'):
+            scores[record['id']] = record.get('score')
+            previous['score'] = record.get('score')
+
+    write_thread_snapshot(path, {
+        'stored_at': time.time(),
+        'permalink': permalink,
+        'post': result.get('post') or (snapshot or {}).get('post', {}),
+        'comments': known
+    })
+    import random
+    if random.random() < 0.05:
+        prune_thread_snapshots()
+
+    print(f"DEBUG: Comment refresh: {len(new_records)} new, {len(scores)} score changes, {len(known)} cached", file=sys.stderr)
+    if fields:
+        new_records = [{field: record.get(field) for field in fields} for record in new_records]
+    return {
+        'success': True,
+        'post': result.get('post', {}),
+        'new': new_records,
+        'scores': scores,
+        'count': len(known),
+        'full': full
+    }
+
+def run_background_command(command, params):
+    """Run one background command, logging rather than raising on failure"""
+    handler = BACKGROUND_COMMANDS.get(command)
+    if handler is None:
+        print(f"DEBUG: Unknown background command: {command}", file=sys.stderr)
+        return
+    trace = begin_trace(f'background:{command}')
+    try:
+        handler(**params)
+    except Exception as e:
+        print(f"DEBUG: Background {command} failed: {e}", file=sys.stderr)
+        sys.stderr.flush()
+    finally:
+        finish_trace(trace)
+
+def schedule_background(command, params):
+    """Queue command to run after the current request, deduplicating identical work"""
+    job_key = json.dumps([command, params], sort_keys=True)
+    with BACKGROUND_LOCK:
+        if job_key in BACKGROUND_PENDING:
+            return
+        BACKGROUND_PENDING.add(job_key)
+
+    if BACKGROUND_EXECUTOR is not None:
+        def run_job():
+            try:
+                run_background_command(command, params)
+            finally:
+                with BACKGROUND_LOCK:
+                    BACKGROUND_PENDING.discard(job_key)
+        BACKGROUND_EXECUTOR.submit(run_job)
+        return
+
+    import subprocess
+    try:
+        subprocess.Popen(
+            [sys.executable, SCRIPT_PATH, 'background', json.dumps({'command': command, 'params': params})],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            close_fds=True, start_new_session=True
+        )
+    except OSError as e:
+        print(f"DEBUG: Could not start background {command}: {e}", file=sys.stderr)
+
+def emit_cached_listing(emit, result):
+    """Send the pagination and post events for a listing served from cache"""
+    if emit:
+        emit({'event': 'pagination', **result['pagination']})
+        for index, post in enumerate(result['posts']):
+            emit({'event': 'post', 'index': index, 'post': post})
+    return result
+
+def fetch_reddit_data_with_pagination(subreddit="all", sort="hot", limit=25, after=None, before=None,
+                                      cache_ttl=None, stale_while_revalidate=None, emit=None):
+    """Fetch Reddit data with pagination support and enhanced content detection.
+
+    Results are cached on disk; pass cache_ttl=0 to force a (conditional) refresh.
+    If emit is given it is called with a pagination event and then one post
+    event per post as soon as each is extracted.
+    """
+    if cache_ttl is None:
+        cache_ttl = LISTING_CACHE_TTL
+
     base_url = f"https://old.reddit.com/r/{subreddit}/.json"
 
     if sort in ['new', 'top', 'rising']:
@@ -466,11 +2513,60 @@ def fetch_reddit_data_with_pagination(subreddit="all", sort="hot", limit=25, aft
         'User-Agent': 'Mozilla/5.0 (Macintosh; PPC Mac OS X 10_4) Reddit Viewer 1.0'
     }
 
+    cache_path = listing_cache_path(subreddit, sort, limit, after, before)
+    cached = read_listing_cache(cache_path)
+    cache_age = time.time() - cached.get('stored_at', 0) if cached else None
+    if stale_while_revalidate is None:
+        # Listings sync or prefetch stored lately are served at once and refreshed behind the caller
+        synced_at = (cached.get('synced_at') or 0) if cached else 0
+        prefetched_at = (cached.get('prefetched_at') or 0) if cached else 0
+        stale_while_revalidate = (LISTING_STALE_WHILE_REVALIDATE or time.time() - synced_at <= SYNC_INTERVAL or
+                                  time.time() - prefetched_at <= PREFETCH_TTL)
+
+    if cached and cache_age <= cache_ttl:
+        print(f"DEBUG: Listing cache hit ({cache_age:.0f}s old) for {url}", file=sys.stderr)
+        return emit_cached_listing(emit, listing_from_cache(cached, cache_age))
+
+    if cached and stale_while_revalidate and cache_age <= LISTING_CACHE_MAX_STALE:
+        print(f"DEBUG: Serving stale listing ({cache_age:.0f}s old), revalidating {url}", file=sys.stderr)
+        schedule_background('revalidate_listing', {
+            'subreddit': subreddit, 'sort': sort, 'limit': limit, 'after': after, 'before': before
+        })
+        return emit_cached_listing(emit, listing_from_cache(cached, cache_age, stale=True))
+
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    # Only now that the cache could not answer is the network stack needed
+    import urllib.error
+
     try:
         print(f"DEBUG: Fetching {url}", file=sys.stderr)
-        request = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(request, timeout=15) as response:
-            data = json.loads(response.read().decode('utf-8'))
+        try:
+            with http_open(url, headers, timeout=15, compress=True) as response:
+                status = response.status
+                validators = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified')
+                }
+                raw_data = response.read()
+        except urllib.error.HTTPError as e:
+            # urllib reports 304 Not Modified as an error
+            if e.code != 304 or not cached:
+                raise
+            status = 304
+
+        if status == 304 and cached:
+            print(f"DEBUG: Listing not modified, refreshing cache entry", file=sys.stderr)
+            cached['stored_at'] = time.time()
+            write_listing_cache(cache_path, cached)
+            return emit_cached_listing(emit, listing_from_cache(cached, 0.0, revalidated=True))
+
+        with span('json.decode', bytes=len(raw_data)):
+            data = json.loads(raw_data.decode('utf-8'))
 
         posts = []
         pagination_info = {
@@ -478,9 +2574,13 @@ def fetch_reddit_data_with_pagination(subreddit="all", sort="hot", limit=25, aft
             'before': data['data'].get('before')
         }
 
+        if emit:
+            emit({'event': 'pagination', **pagination_info})
+
         for child in data['data']['children']:
             post = child['data']
-            image_info = extract_image_info(post)
+            with span('extract_image_info'):
+                image_info = extract_image_info(post)
 
             post_data = {
                 # Existing fields
@@ -507,119 +2607,932 @@ def fetch_reddit_data_with_pagination(subreddit="all", sort="hot", limit=25, aft
                 'video_url': image_info['video_url'],
                 'is_article': image_info['is_article'],
                 'article_url': image_info['article_url'],
-                'is_nsfw': image_info['is_nsfw']
+                'is_nsfw': image_info['is_nsfw'],
+
+                # Identity, used to drop duplicates and crossposts from merged feeds
+                'id': post.get('id', ''),
+                'crosspost_parent': post.get('crosspost_parent')
             }
+            if emit:
+                emit({'event': 'post', 'index': len(posts), 'post': post_data})
             posts.append(post_data)
 
+        write_listing_cache(cache_path, {
+            'stored_at': time.time(),
+            'url': url,
+            'etag': validators['etag'],
+            'last_modified': validators['last_modified'],
+            'posts': posts,
+            'pagination': pagination_info,
+            'synced_at': cached.get('synced_at') if cached else None,
+            'prefetched_at': cached.get('prefetched_at') if cached else None
+        })
+        import random
+        if random.random() < 0.05:
+            prune_listing_cache()
+
         return {
             'success': True,
             'posts': posts,
-            'pagination': pagination_info
+            'pagination': pagination_info,
+            'cache': {'hit': False, 'age': 0.0, 'stale': False, 'revalidated': False}
         }
 
     except Exception as e:
         print(f"DEBUG: Error fetching Reddit data: {e}", file=sys.stderr)
-        return {
+        if cached and cache_age <= LISTING_CACHE_MAX_STALE:
+            # Better to show slightly old posts than an empty table
+            print(f"DEBUG: Falling back to cached listing ({cache_age:.0f}s old)", file=sys.stderr)
+            return emit_cached_listing(emit, listing_from_cache(cached, cache_age, stale=True))
+        result = {
             'success': False,
             'error': str(e),
             'posts': [],
             'pagination': {'after': None, 'before': None}
         }
+        if isinstance(e, RetryLater):
+            result['retry_after'] = round(e.retry_after, 1)
+        return result
 
-def download_single_image(url):
-    """Download a single image and return local path"""
-    if not url or not url.startswith('http'):
-        return ""
+# Image cache limits. Eviction drops entries down to IMAGE_CACHE_LOW_WATER of
+# each limit so we don't evict on every single download once the cache is full.
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('REDDIT_VIEWER_CACHE_MAX_BYTES', str(100 * 1024 * 1024)))
+IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get('REDDIT_VIEWER_CACHE_MAX_ENTRIES', '5000'))
+IMAGE_CACHE_POLICY = os.environ.get('REDDIT_VIEWER_CACHE_POLICY', 'lru')
+IMAGE_CACHE_LOW_WATER = 0.9
+IMAGE_CACHE_INDEX = 'cache_index.json'
 
-    # Set up cache directory - try to use a writable location
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    # If we're in an app bundle Resources folder, use a better cache location
-    if 'Contents/Resources' in script_dir:
-        # Use the user's cache directory instead
-        home_dir = os.path.expanduser("~")
-        cache_dir = os.path.join(home_dir, ".reddit_viewer_cache")
-    else:
-        # Use local directory for development
-        cache_dir = os.path.join(script_dir, "image_cache")
+class ImageCache:
+    """Index of cached image files with size-bounded LRU/LFU eviction.
 
-    try:
-        os.makedirs(cache_dir, exist_ok=True)
-        print(f"DEBUG: Using cache directory: {cache_dir}", file=sys.stderr)
-        sys.stderr.flush()
-    except Exception as e:
-        print(f"DEBUG: Could not create cache dir {cache_dir}: {e}", file=sys.stderr)
-        # Fallback to temp directory
-        import tempfile
-        cache_dir = tempfile.gettempdir()
-        print(f"DEBUG: Using temp directory: {cache_dir}", file=sys.stderr)
-        sys.stderr.flush()
+    Files are named after a hash of their content (image_cache_filename), so
+    the same image reached through different URLs is stored once. The index
+    holds "files", mapping filename -> [url, size, last_access, hits], and
+    "urls", mapping the full-length key of each canonical URL
+    (image_url_key) -> filename. It is loaded once per process, so a cache
+    hit is a dict lookup instead of a stat on a large flat directory.
+    """
+
+    def __init__(self, cache_dir, max_bytes=IMAGE_CACHE_MAX_BYTES, max_entries=IMAGE_CACHE_MAX_ENTRIES,
+                 policy=IMAGE_CACHE_POLICY):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, IMAGE_CACHE_INDEX)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.policy = policy if policy in ('lru', 'lfu') else 'lru'
+        self.lock = threading.RLock()
+        self.entries = None
+        self.urls = None
+        self.total_bytes = 0
+        self.dirty = False
+        self.index_stamp = None # (inode, mtime, size) of the index file as last read or written
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'evicted_bytes': 0,
+                         'duplicates': 0, 'duplicate_bytes': 0}
+
+    def load(self):
+        """Load the index, rebuilding it from the directory if it is missing or damaged"""
+        with self.lock:
+            if self.entries is not None:
+                return
+            try:
+                with span('image_cache.load'):
+                    entries, urls = self.read_index()
+            except (OSError, ValueError):
+                entries, urls = self.scan(), {}
+                self.dirty = True
+            self.entries = entries
+            self.urls = urls
+            self.total_bytes = sum(entry[1] for entry in entries.values())
+
+    def read_index(self):
+        """Return (entries, urls) from the index file; raises OSError or ValueError if it is unusable"""
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            self.index_stamp = self.file_stamp(os.fstat(f.fileno()))
+            index = json.load(f)
+        if not isinstance(index, dict):
+            raise ValueError('index is not an object')
+        if isinstance(index.get('files'), dict):
+            return index['files'], index.get('urls') or {}
+        # Index from before content addressing: filename -> entry, one file per URL
+        urls = {image_url_key(entry[0]): name for name, entry in index.items() if entry[0]}
+        self.dirty = True
+        return index, urls
+
+    @staticmethod
+    def file_stamp(st):
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def scan(self):
+        """Build index entries from the image files on disk"""
+        entries = {}
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.startswith('reddit_') or name.endswith('.tmp'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries[name] = ['', st.st_size, st.st_mtime, 0]
+        return entries
+
+    def lookup(self, filename):
+        """Return True if filename is cached, recording the access"""
+        self.load()
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None:
+                # Another process may have downloaded it since we loaded the index
+                try:
+                    size = os.path.getsize(os.path.join(self.cache_dir, filename))
+                except OSError:
+                    self.counters['misses'] += 1
+                    return False
+                entry = ['', size, 0, 0]
+                self.entries[filename] = entry
+                self.total_bytes += size
+            entry[2] = time.time()
+            entry[3] += 1
+            self.dirty = True
+            self.counters['hits'] += 1
+            return True
+
+    def lookup_url(self, url_key):
+        """Return the cached filename for a URL key, or None, recording the access"""
+        self.load()
+        with self.lock:
+            filename = self.urls.get(url_key)
+            if filename is None:
+                self.counters['misses'] += 1
+                return None
+            if self.lookup(filename):
+                return filename
+            # The file was evicted or removed; forget the stale mapping
+            del self.urls[url_key]
+            self.dirty = True
+            return None
+
+    def link(self, url_key, filename):
+        """Point url_key at an already cached file with the same content.
+
+        Returns False if that file is not on disk after all.
+        """
+        self.load()
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None:
+                try:
+                    size = os.path.getsize(os.path.join(self.cache_dir, filename))
+                except OSError:
+                    return False
+                entry = ['', size, 0, 0]
+                self.entries[filename] = entry
+                self.total_bytes += size
+            entry[2] = time.time()
+            entry[3] += 1
+            self.urls[url_key] = filename
+            self.counters['duplicates'] += 1
+            self.counters['duplicate_bytes'] += entry[1]
+            self.dirty = True
+            return True
+
+    def add(self, filename, url, size, url_key=None):
+        """Record a newly written file (reached through url_key) and evict if over the limits"""
+        self.load()
+        with self.lock:
+            old = self.entries.get(filename)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self.entries[filename] = [url, size, time.time(), 1]
+            if url_key:
+                self.urls[url_key] = filename
+            self.total_bytes += size
+            self.dirty = True
+            if self.total_bytes > self.max_bytes or len(self.entries) > self.max_entries:
+                self.evict(int(self.max_bytes * IMAGE_CACHE_LOW_WATER),
+                           int(self.max_entries * IMAGE_CACHE_LOW_WATER))
+
+    def remove(self, filename):
+        """Forget filename and delete it from disk"""
+        self.load()
+        with self.lock:
+            entry = self.entries.pop(filename, None)
+            if entry is not None:
+                self.total_bytes -= entry[1]
+                self.dirty = True
+        try:
+            os.remove(os.path.join(self.cache_dir, filename))
+        except OSError:
+            pass
+
+    def evict(self, target_bytes, target_entries):
+        """Remove least recently (or frequently) used files until under both targets"""
+        self.load()
+        with self.lock:
+            if self.policy == 'lfu':
+                order = sorted(self.entries.items(), key=lambda item: (item[1][3], item[1][2]))
+            else:
+                order = sorted(self.entries.items(), key=lambda item: item[1][2])
+
+            removed = 0
+            removed_bytes = 0
+            for filename, entry in order:
+                if self.total_bytes <= target_bytes and len(self.entries) <= target_entries:
+                    break
+                self.remove(filename)
+                removed += 1
+                removed_bytes += entry[1]
+
+            self.counters['evictions'] += removed
+            self.counters['evicted_bytes'] += removed_bytes
+            if removed:
+                print(f"DEBUG: Evicted {removed} cached images ({removed_bytes} bytes)", file=sys.stderr)
+            return removed, removed_bytes
+
+    def save(self):
+        """Write the index back to disk if it changed.
+
+        Several fetcher processes share the cache, so the index is rewritten
+        under an exclusive lock on a sidecar file, after merging in whatever
+        the others saved since this process loaded it (see merge_saved). If
+        nobody else has saved, nothing is read back.
+        """
+        import fcntl
+
+        with self.lock:
+            if not self.dirty or self.entries is None:
+                return
+            try:
+                fd = os.open(self.index_path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            except OSError as e:
+                print(f"DEBUG: Cache index lock unavailable ({e}), saving without merging", file=sys.stderr)
+                self.write_index()
+                return
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    changed = self.file_stamp(os.stat(self.index_path)) != self.index_stamp
+                except OSError:
+                    changed = False
+                if changed:
+                    self.merge_saved()
+                if self.total_bytes > self.max_bytes or len(self.entries) > self.max_entries:
+                    self.evict(int(self.max_bytes * IMAGE_CACHE_LOW_WATER),
+                               int(self.max_entries * IMAGE_CACHE_LOW_WATER))
+                self.write_index()
+            finally:
+                # Closing the descriptor releases the lock
+                os.close(fd)
+
+    def merge_saved(self):
+        """Fold the index another process saved since this one loaded into this process's index.
+
+        Files known to both keep the later access and the higher hit count.
+        A file only one side knows is kept if it is still on disk, so files
+        the other process downloaded are picked up and files either side
+        evicted stay gone. Only those differing names are checked on disk;
+        files no index lists are picked up by prune and cache_verify instead.
+        Call with the index lock held.
+        """
+        try:
+            saved_entries, saved_urls = self.read_index()
+        except (OSError, ValueError):
+            return
+
+        entries = {}
+        for name in set(self.entries) | set(saved_entries):
+            ours = self.entries.get(name)
+            theirs = saved_entries.get(name)
+            if ours is not None and theirs is not None:
+                ours[2] = max(ours[2], theirs[2])
+                ours[3] = max(ours[3], theirs[3])
+                entries[name] = ours
+            elif os.path.exists(os.path.join(self.cache_dir, name)):
+                entries[name] = ours if ours is not None else theirs
+
+        urls = {key: name for key, name in saved_urls.items() if name in entries}
+        urls.update((key, name) for key, name in self.urls.items() if name in entries)
+        self.entries = entries
+        self.urls = urls
+        self.total_bytes = sum(entry[1] for entry in entries.values())
+
+    def write_index(self):
+        """Atomically replace the index file with this process's index"""
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        urls = {key: name for key, name in self.urls.items() if name in self.entries}
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'files': self.entries, 'urls': urls}, f, separators=(',', ':'))
+            os.replace(tmp_path, self.index_path)
+            self.index_stamp = self.file_stamp(os.stat(self.index_path))
+            self.dirty = False
+        except OSError as e:
+            print(f"DEBUG: Could not save cache index: {e}", file=sys.stderr)
+
+    def prune(self, max_bytes=None, max_entries=None):
+        """Drop index entries whose files are gone, then evict down to the limits"""
+        with self.lock:
+            self.reconcile()
+            removed, removed_bytes = self.evict(
+                self.max_bytes if max_bytes is None else max_bytes,
+                self.max_entries if max_entries is None else max_entries
+            )
+            self.save()
+            return {'removed': removed, 'removed_bytes': removed_bytes}
+
+    def reconcile(self):
+        """Make the index match the directory: forget missing files and add files no index lists"""
+        with self.lock:
+            self.entries = self.scan_merge()
+            self.total_bytes = sum(entry[1] for entry in self.entries.values())
+            self.dirty = True
+
+    def scan_merge(self):
+        """Rescan the directory, keeping the recorded URL and access data of known files"""
+        self.load()
+        scanned = self.scan()
+        for filename, entry in scanned.items():
+            known = self.entries.get(filename)
+            if known is not None:
+                entry[0], entry[2], entry[3] = known[0], known[2], known[3]
+        return scanned
+
+    def stats(self):
+        self.load()
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update({
+                'cache_dir': self.cache_dir,
+                'entries': len(self.entries),
+                'urls': len(self.urls),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'policy': self.policy
+            })
+            return stats
+
+IMAGE_CACHE = None
+IMAGE_CACHE_LOCK = threading.Lock()
+
+def get_image_cache():
+    """Return the process-wide ImageCache, saving its index at exit"""
+    global IMAGE_CACHE
+    with IMAGE_CACHE_LOCK:
+        if IMAGE_CACHE is None:
+            import atexit
+            IMAGE_CACHE = ImageCache(get_cache_dir())
+            atexit.register(IMAGE_CACHE.save)
+    return IMAGE_CACHE
+
+def cache_stats():
+    """Report image cache size and hit/eviction counters"""
+    return {'success': True, 'stats': get_image_cache().stats()}
+
+def cache_prune(max_bytes=None, max_entries=None):
+    """Evict cached images down to the given (or configured) limits"""
+    cache = get_image_cache()
+    result = cache.prune(max_bytes, max_entries)
+    result['listings_removed'] = prune_listing_cache()
+    return {'success': True, 'pruned': result, 'stats': cache.stats()}
+
+THUMBNAIL_MAX_BYTES = 200 * 1024 # Reduced to 200KB limit
+
+def image_integrity_problem(data):
+    """Return why data is not a complete image, or None if it looks intact.
+
+    Checks the magic bytes of the formats we cache and, where the format has
+    one, the trailer or embedded length, which catches truncated bodies.
+    """
+    if len(data) < 12:
+        return 'too short to be an image'
+
+    if data[:3] == b'\xff\xd8\xff':
+        # JPEG: the end-of-image marker may be followed by a little padding
+        if b'\xff\xd9' not in data[-64:]:
+            return 'JPEG missing end-of-image marker'
+        return None
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        if b'IEND' not in data[-16:]:
+            return 'PNG missing IEND chunk'
+        return None
+    if data[:4] == b'GIF8':
+        if data.rstrip(b'\x00')[-1:] != b'\x3b':
+            return 'GIF missing trailer'
+        return None
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        declared = int.from_bytes(data[4:8], 'little') + 8
+        if len(data) < declared:
+            return f'WebP truncated ({len(data)} of {declared} bytes)'
+        return None
+    if data[:2] == b'BM':
+        declared = int.from_bytes(data[2:6], 'little')
+        if declared and len(data) < declared:
+            return f'BMP truncated ({len(data)} of {declared} bytes)'
+        return None
+
+    return 'unrecognized image format'
+
+IMAGE_MAGIC_EXTENSIONS = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG', 'png'),
+    (b'GIF8', 'gif'),
+    (b'BM', 'bmp'),
+)
+
+def image_url_key(url):
+    """Return the full-length cache key for an image URL, after canonicalizing it"""
+    import hashlib
+
+    return hashlib.sha1(canonical_image_url(url).encode('utf-8')).hexdigest()
+
+def image_cache_filename(data):
+    """Return the content-addressed cache filename for a downloaded image body"""
+    import hashlib
 
-    # Create filename
-    cleaned_url = clean_image_url(url)
-    url_hash = hashlib.md5(cleaned_url.encode()).hexdigest()[:8]
-    # Determine extension
-    parsed = urlparse(cleaned_url.lower())
-    path_parts = parsed.path.split('.')
     extension = 'jpg'
-    if len(path_parts) > 1 and path_parts[-1] in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-        extension = path_parts[-1]
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        extension = 'webp'
+    else:
+        for magic, name in IMAGE_MAGIC_EXTENSIONS:
+            if data.startswith(magic):
+                extension = name
+                break
+
+    return f"reddit_{hashlib.sha1(data).hexdigest()}.{extension}"
 
-    filename = f"reddit_{url_hash}.{extension}"
-    filepath = os.path.join(cache_dir, filename)
+def download_single_image(url, cancel=None, throttle=None):
+    """Download a single image and return local path.
+
+    Raises DownloadCancelled if the cancel event is set before the body is in.
+    A HostThrottle, if given, is acquired only when the image has to be fetched.
+    """
+    if not url or not url.startswith('http'):
+        return ""
+
+    cache_dir = get_cache_dir()
+    cleaned_url = canonical_image_url(url)
+    url_key = image_url_key(cleaned_url)
 
     # Return existing file if cached
-    if os.path.exists(filepath):
-        return filepath
+    image_cache = get_image_cache()
+    filename = image_cache.lookup_url(url_key)
+    if filename:
+        return os.path.join(cache_dir, filename)
 
     # Download
+    tmp_path = None
     try:
         headers = {
             'User-Agent': 'Mozilla/5.0 (Macintosh; PPC Mac OS X 10_4) Reddit Viewer 1.0'
         }
 
-        request = urllib.request.Request(cleaned_url, headers=headers)
-        with urllib.request.urlopen(request, timeout=5) as response: # Reduced timeout
-            # Check size
-            content_length = response.headers.get('Content-Length')
-            if content_length and int(content_length) > 200 * 1024: # Reduced to 200KB limit
-                print(f"DEBUG: Skipping large image ({content_length} bytes)", file=sys.stderr)
-                return ""
-
-            # Download
-            with open(filepath, 'wb') as f:
-                downloaded = 0
-                max_download = 200 * 1024 # Reduced limit
-                while downloaded < max_download:
+        # Only the network fetch counts against the per-host limits, never a cache hit
+        host = urlparse(cleaned_url).netloc.lower()
+        if throttle is not None:
+            with span('throttle.wait', host=host):
+                throttle.acquire(host)
+        try:
+            with http_open(cleaned_url, headers, timeout=5) as response: # Reduced timeout
+                # Check size
+                content_length = response.headers.get('Content-Length')
+                if content_length and int(content_length) > THUMBNAIL_MAX_BYTES:
+                    print(f"DEBUG: Skipping large image ({content_length} bytes)", file=sys.stderr)
+                    return ""
+
+                # Download into memory; one byte past the limit tells us the body was cut off
+                body = bytearray()
+                while len(body) <= THUMBNAIL_MAX_BYTES:
+                    if cancel is not None and cancel.is_set():
+                        raise DownloadCancelled(url)
                     chunk = response.read(4096) # Smaller chunks
                     if not chunk:
                         break
-                    f.write(chunk)
-                    downloaded += len(chunk)
+                    body.extend(chunk)
+        finally:
+            if throttle is not None:
+                throttle.release(host)
 
-            if downloaded > 0:
-                print(f"DEBUG: Downloaded {downloaded} bytes to {filename}", file=sys.stderr)
-                sys.stderr.flush()
-                return filepath
-            else:
-                return ""
+        if len(body) > THUMBNAIL_MAX_BYTES:
+            print(f"DEBUG: Skipping large image (over {THUMBNAIL_MAX_BYTES} bytes, no Content-Length)", file=sys.stderr)
+            return ""
+        if content_length and len(body) != int(content_length):
+            print(f"DEBUG: Truncated image {url}: got {len(body)} of {content_length} bytes", file=sys.stderr)
+            return ""
+        problem = image_integrity_problem(body)
+        if problem:
+            print(f"DEBUG: Rejecting {url}: {problem}", file=sys.stderr)
+            return ""
 
+        filename = image_cache_filename(bytes(body))
+        filepath = os.path.join(cache_dir, filename)
+        if image_cache.link(url_key, filename):
+            print(f"DEBUG: {cleaned_url} has the same content as cached {filename}", file=sys.stderr)
+            return filepath
+
+        # Write to a temp file and rename so a reader never sees a partial image
+        tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, filepath)
+
+        print(f"DEBUG: Downloaded {len(body)} bytes to {filename}", file=sys.stderr)
+        sys.stderr.flush()
+        image_cache.add(filename, cleaned_url, len(body), url_key)
+        return filepath
+
+    except DownloadCancelled:
+        raise
     except Exception as e:
         print(f"DEBUG: Failed to download {url}: {e}", file=sys.stderr)
         sys.stderr.flush()
-        if os.path.exists(filepath):
+        if tmp_path and os.path.exists(tmp_path):
             try:
-                os.remove(filepath)
+                os.remove(tmp_path)
             except:
                 pass
         return ""
 
-def download_thumbnails_for_posts(posts_data):
-    """Download thumbnails for all posts and update their paths"""
+def cache_verify(remove=True):
+    """Check every cached image for truncation or corruption, removing bad entries"""
+    image_cache = get_image_cache()
+    cache_dir = image_cache.cache_dir
+    checked = 0
+    corrupt = []
+    stale_tmp = 0
+
+    try:
+        names = os.listdir(cache_dir)
+    except OSError as e:
+        return {'success': False, 'error': str(e)}
+
+    now = time.time()
+    for name in names:
+        if not name.startswith('reddit_'):
+            continue
+        path = os.path.join(cache_dir, name)
+        if name.endswith('.tmp'):
+            # Left behind by a process that died mid-write
+            try:
+                if now - os.path.getmtime(path) > 3600:
+                    os.remove(path)
+                    stale_tmp += 1
+            except OSError:
+                pass
+            continue
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        checked += 1
+        problem = image_integrity_problem(data)
+        if problem:
+            corrupt.append({'file': name, 'problem': problem})
+            if remove:
+                image_cache.remove(name)
+
+    # Files from a process that exited before saving its index come back here
+    image_cache.reconcile()
+    image_cache.save()
+    print(f"DEBUG: Verified {checked} cached images, {len(corrupt)} corrupt", file=sys.stderr)
+    return {
+        'success': True,
+        'checked': checked,
+        'corrupt': len(corrupt),
+        'removed': len(corrupt) if remove else 0,
+        'stale_tmp_removed': stale_tmp,
+        'files': corrupt
+    }
+
+# Downloads share one scheduler so the image the user is looking at does not wait
+# behind thumbnails for rows already scrolled past. Jobs run in priority order
+# (visible, prefetch, background); the lower classes may only fill part of the
+# workers, and a visible job that is not delayed interrupts the newest running
+# lower-priority job, which is queued again and resumes later. A short delay on
+# queued thumbnails lets a client cancel them before they start while scrolling.
+# A cancel is remembered for DOWNLOAD_CANCEL_TTL seconds, so it also stops jobs
+# whose request was still waiting for a server worker when it arrived; requests
+# received after the cancel are never affected.
+DOWNLOAD_PRIORITIES = ('visible', 'prefetch', 'background')
+DOWNLOAD_WORKERS = 6
+DOWNLOAD_CLASS_LIMITS = {'visible': 6, 'prefetch': 4, 'background': 2}
+DOWNLOAD_DEBOUNCE = float(os.environ.get('REDDIT_VIEWER_DOWNLOAD_DEBOUNCE', '0.15'))
+DOWNLOAD_CANCEL_TTL = 30.0
+
+# When the server request being handled on this thread was read, so a cancel
+# only reaches the work asked for before it (see handle_server_request)
+REQUEST_STATE = threading.local()
+
+def request_received_at():
+    """Return when the current server request was read, or now outside one"""
+    return getattr(REQUEST_STATE, 'received_at', None) or time.time()
+
+class DownloadJob:
+    """One scheduled download and its outcome"""
+
+    def __init__(self, function, args, priority, post_id, batch_id, ready_at, sequence, on_done=None):
+        self.function = function
+        self.args = args
+        self.priority = priority
+        self.rank = DOWNLOAD_PRIORITIES.index(priority)
+        self.post_id = post_id
+        self.batch_id = batch_id
+        self.ready_at = ready_at
+        self.sequence = sequence
+        self.on_done = on_done
+        self.state = 'queued'
+        self.started_at = None
+        self.preempted = False
+        self.cancel_requested = False
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def sort_key(self):
+        return (self.rank, self.ready_at, self.sequence)
+
+    def wait(self, timeout=None):
+        """Block until the job finishes or is cancelled; returns its result"""
+        self.done_event.wait(timeout)
+        return self.result
+
+class DownloadScheduler:
+    """Priority queue of download jobs run on a small pool of worker threads"""
+
+    def __init__(self, workers=DOWNLOAD_WORKERS, class_limits=None):
+        self.workers = max(1, workers)
+        self.class_limits = dict(DOWNLOAD_CLASS_LIMITS if class_limits is None else class_limits)
+        self.condition = threading.Condition()
+        self.queue = []
+        self.running = []
+        self.threads = []
+        self.sequence = 0
+        self.tombstones = [] # (post_ids, batch_id, cancelled_at, expires_at) of recent cancels
+        self.counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'preempted': 0}
+
+    def submit(self, function, args=(), priority='visible', post_id=None, batch_id=None, delay=0.0, on_done=None):
+        """Queue function(*args, cancel=event) and return its DownloadJob.
+
+        The job starts no sooner than delay seconds from now. on_done(job) is
+        called once it has finished, failed or been cancelled; a job whose
+        post or batch was cancelled after its request was received is
+        cancelled straight away.
+        """
+        if priority not in DOWNLOAD_PRIORITIES:
+            raise ValueError(f'Unknown download priority: {priority}')
+
+        with self.condition:
+            self.sequence += 1
+            job = DownloadJob(function, args, priority, post_id, batch_id,
+                              time.time() + max(0.0, delay or 0.0), self.sequence, on_done)
+            self.counters['submitted'] += 1
+            cancelled = self._tombstoned(post_id, batch_id, request_received_at())
+            if cancelled:
+                job.state = 'cancelled'
+                self.counters['cancelled'] += 1
+            else:
+                self.queue.append(job)
+                if not delay:
+                    self._preempt_for(job)
+                if len(self.threads) < self.workers:
+                    thread = threading.Thread(target=self._work, name=f'download-{len(self.threads)}', daemon=True)
+                    self.threads.append(thread)
+                    thread.start()
+                self.condition.notify_all()
+        if cancelled:
+            self._notify(job)
+        return job
+
+    def run(self, function, args=(), priority='visible', post_id=None, batch_id=None):
+        """Submit a job and wait for it; raises DownloadCancelled if it was cancelled"""
+        job = self.submit(function, args, priority, post_id, batch_id)
+        job.wait()
+        if job.state == 'cancelled':
+            raise DownloadCancelled(post_id or batch_id or '')
+        if job.state == 'failed':
+            raise RuntimeError(job.error)
+        return job.result
+
+    def cancel(self, post_ids=None, batch_id=None):
+        """Cancel the queued and running jobs of the given posts and/or batch; returns how many.
+
+        Jobs for them submitted later, within DOWNLOAD_CANCEL_TTL seconds, are
+        cancelled too if their request was received before this cancel.
+        """
+        if not post_ids and batch_id is None:
+            return 0
+        post_ids = frozenset(post_ids or ())
+        now = time.time()
+        with self.condition:
+            self.tombstones.append((post_ids, batch_id, now, now + DOWNLOAD_CANCEL_TTL))
+        return self._cancel_where(lambda job: (not post_ids or job.post_id in post_ids) and
+                                              (batch_id is None or job.batch_id == batch_id))
+
+    def cancelled(self, post_id=None, batch_id=None):
+        """Return True if a cancel received after the current request covers this post and/or batch"""
+        with self.condition:
+            return self._tombstoned(post_id, batch_id, request_received_at())
+
+    def supersede(self, priority, batch_id):
+        """Drop queued jobs of priority from batches other than batch_id; returns how many"""
+        return self._cancel_where(lambda job: job.priority == priority and job.batch_id != batch_id,
+                                  queued_only=True)
+
+    def stats(self):
+        with self.condition:
+            return dict(self.counters,
+                        queued={priority: sum(1 for job in self.queue if job.priority == priority)
+                                for priority in DOWNLOAD_PRIORITIES},
+                        running={priority: sum(1 for job in self.running if job.priority == priority)
+                                 for priority in DOWNLOAD_PRIORITIES},
+                        workers=self.workers)
+
+    def _tombstoned(self, post_id, batch_id, requested_at):
+        now = time.time()
+        self.tombstones = [tombstone for tombstone in self.tombstones if tombstone[3] > now]
+        return any(requested_at <= cancelled_at and
+                   (not post_ids or post_id in post_ids) and (cancelled_batch is None or batch_id == cancelled_batch)
+                   for post_ids, cancelled_batch, cancelled_at, _ in self.tombstones)
+
+    def _cancel_where(self, matches, queued_only=False):
+        with self.condition:
+            dropped = [job for job in self.queue if matches(job)]
+            for job in dropped:
+                self.queue.remove(job)
+                job.state = 'cancelled'
+            interrupted = [] if queued_only else [job for job in self.running if matches(job)]
+            for job in interrupted:
+                job.cancel_requested = True
+                job.cancel_event.set()
+            self.counters['cancelled'] += len(dropped)
+
+        for job in dropped:
+            self._notify(job)
+        if dropped or interrupted:
+            print(f"DEBUG: Cancelled {len(dropped)} queued and {len(interrupted)} running downloads", file=sys.stderr)
+        return len(dropped) + len(interrupted)
+
+    def _preempt_for(self, job):
+        """Interrupt the newest lower-priority running job when every worker is busy"""
+        if len(self.running) < self.workers:
+            return
+        victims = [running for running in self.running
+                   if running.rank > job.rank and not running.cancel_event.is_set()]
+        if not victims:
+            return
+        victim = max(victims, key=lambda running: (running.rank, running.started_at))
+        victim.preempted = True
+        victim.cancel_event.set()
+        self.counters['preempted'] += 1
+        print(f"DEBUG: Preempting {victim.priority} download for a {job.priority} one", file=sys.stderr)
+
+    def _next_job(self):
+        """Take the most urgent ready job whose class has a free worker; returns (job, seconds to wait)"""
+        now = time.time()
+        running = {}
+        for job in self.running:
+            running[job.priority] = running.get(job.priority, 0) + 1
+
+        wait = None
+        for job in sorted(self.queue, key=DownloadJob.sort_key):
+            if job.ready_at > now:
+                wait = job.ready_at - now if wait is None else min(wait, job.ready_at - now)
+            elif running.get(job.priority, 0) < self.class_limits.get(job.priority, self.workers):
+                self.queue.remove(job)
+                return job, None
+        return None, wait
+
+    def _work(self):
+        while True:
+            with self.condition:
+                job, wait = self._next_job()
+                while job is None:
+                    self.condition.wait(wait)
+                    job, wait = self._next_job()
+                job.state = 'running'
+                job.started_at = time.time()
+                self.running.append(job)
+
+            result = error = None
+            cancelled = False
+            try:
+                result = job.function(*job.args, cancel=job.cancel_event)
+            except DownloadCancelled:
+                cancelled = True
+            except Exception as e:
+                error = str(e)
+
+            with self.condition:
+                self.running.remove(job)
+                if cancelled and job.preempted and not job.cancel_requested:
+                    # Interrupted to make room, not cancelled: run it again when a worker frees up
+                    job.preempted = False
+                    job.cancel_event.clear()
+                    job.state = 'queued'
+                    self.queue.append(job)
+                    self.condition.notify_all()
+                    continue
+                if cancelled:
+                    job.state = 'cancelled'
+                    self.counters['cancelled'] += 1
+                elif error is not None:
+                    job.state = 'failed'
+                    job.error = error
+                    self.counters['failed'] += 1
+                else:
+                    job.state = 'done'
+                    job.result = result
+                    self.counters['completed'] += 1
+                self.condition.notify_all()
+            self._notify(job)
+
+    def _notify(self, job):
+        job.done_event.set()
+        if job.on_done:
+            try:
+                job.on_done(job)
+            except Exception as e:
+                print(f"DEBUG: Download callback failed: {e}", file=sys.stderr)
+
+DOWNLOAD_SCHEDULER = None
+DOWNLOAD_SCHEDULER_LOCK = threading.Lock()
+
+def get_download_scheduler():
+    """Return the process-wide DownloadScheduler"""
+    global DOWNLOAD_SCHEDULER
+    with DOWNLOAD_SCHEDULER_LOCK:
+        if DOWNLOAD_SCHEDULER is None:
+            DOWNLOAD_SCHEDULER = DownloadScheduler()
+    return DOWNLOAD_SCHEDULER
+
+# Thumbnail download tuning: simultaneous requests per image host, and a per-host
+# request rate that replaces the old fixed sleep between posts
+THUMBNAIL_HOST_LIMITS = {
+    'i.redd.it': 4,
+    'preview.redd.it': 4,
+    'external-preview.redd.it': 2,
+    'external.redd.it': 2,
+    'i.imgur.com': 2,
+}
+THUMBNAIL_DEFAULT_HOST_LIMIT = 2
+THUMBNAIL_REQUESTS_PER_SECOND = 8.0
+
+class HostThrottle:
+    """Caps concurrent requests per host and spaces out request starts"""
+
+    def __init__(self, host_limits=None, default_limit=THUMBNAIL_DEFAULT_HOST_LIMIT,
+                 requests_per_second=THUMBNAIL_REQUESTS_PER_SECOND):
+        self.host_limits = dict(THUMBNAIL_HOST_LIMITS if host_limits is None else host_limits)
+        self.default_limit = max(1, default_limit)
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.lock = threading.Lock()
+        self.semaphores = {}
+        self.next_start = {}
+
+    def _semaphore(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                limit = max(1, self.host_limits.get(host, self.default_limit))
+                self.semaphores[host] = threading.BoundedSemaphore(limit)
+            return self.semaphores[host]
+
+    def acquire(self, host):
+        self._semaphore(host).acquire()
+        if self.interval:
+            with self.lock:
+                now = time.time()
+                start_at = max(now, self.next_start.get(host, 0.0))
+                self.next_start[host] = start_at + self.interval
+            if start_at > now:
+                time.sleep(start_at - now)
+
+    def release(self, host):
+        self._semaphore(host).release()
+
+def download_thumbnails_for_posts(posts_data, host_limits=None, requests_per_second=None, on_thumbnail=None,
+                                  priority='visible', batch_id=None, delay=0.0):
+    """Download thumbnails for all posts through the download scheduler and update their paths.
+
+    on_thumbnail(index, post, local_path) is called as each download finishes,
+    in completion order; local_path is "" when the download failed or was
+    cancelled (by post id or batch_id, see DownloadScheduler.cancel).
+    """
     if not posts_data.get('success') or not posts_data.get('posts'):
         return posts_data
 
-    posts_with_images = [post for post in posts_data['posts'] if post.get('has_image') and post.get('thumbnail')]
-    total_images = len(posts_with_images)
+    jobs = []
+    for index, post in enumerate(posts_data['posts']):
+        thumb_url = post.get('thumbnail')
+        if post.get('has_image') and thumb_url and thumb_url.startswith('http'):
+            jobs.append((index, thumb_url))
+
+    total_images = len(jobs)
     print(f"DEBUG: Starting thumbnail downloads for {total_images} posts with images (out of {len(posts_data['posts'])} total posts)", file=sys.stderr)
     sys.stderr.flush()
 
@@ -628,30 +3541,935 @@ def download_thumbnails_for_posts(posts_data):
         sys.stderr.flush()
         return posts_data
 
+    import queue
+
+    scheduler = get_download_scheduler()
+    if batch_id is not None and scheduler.cancelled(batch_id=batch_id):
+        # Cancelled while this request was still waiting for a server worker
+        print(f"DEBUG: Thumbnail batch {batch_id} was cancelled before it started", file=sys.stderr)
+        if on_thumbnail:
+            for index, _ in jobs:
+                on_thumbnail(index, posts_data['posts'][index], "")
+        return posts_data
+
+    throttle = HostThrottle(
+        host_limits,
+        requests_per_second=THUMBNAIL_REQUESTS_PER_SECOND if requests_per_second is None else requests_per_second
+    )
+
+    def download_job(thumb_url, cancel=None):
+        return download_single_image(thumb_url, cancel=cancel, throttle=throttle)
+
+    finished = queue.Queue()
     downloaded_count = 0
-    for i, post in enumerate(posts_data['posts']):
-        if post.get('has_image') and post.get('thumbnail'):
-            thumb_url = post['thumbnail']
-            if thumb_url and thumb_url.startswith('http'):
-                print(f"DEBUG: Downloading thumbnail {downloaded_count+1}/{total_images}: {thumb_url[:60]}...", file=sys.stderr)
-                sys.stderr.flush()
-                local_path = download_single_image(thumb_url)
-                if local_path and os.path.exists(local_path):
-                    post['thumbnail'] = local_path # Replace URL with local path
-                    print(f"DEBUG: Success - saved as {os.path.basename(local_path)}", file=sys.stderr)
-                    sys.stderr.flush()
-                else:
-                    print(f"DEBUG: Failed to download thumbnail {downloaded_count+1}/{total_images}", file=sys.stderr)
-                    sys.stderr.flush()
+    cancelled_count = 0
+    with span('thumbnails', count=total_images, workers=scheduler.workers, priority=priority):
+        indexes = {}
+        for index, thumb_url in jobs:
+            job = scheduler.submit(bind_trace(download_job), (thumb_url,), priority,
+                                   post_id=posts_data['posts'][index].get('id'), batch_id=batch_id,
+                                   delay=delay, on_done=finished.put)
+            indexes[job] = index
+
+        for _ in range(total_images):
+            job = finished.get()
+            index = indexes[job]
+            post = posts_data['posts'][index]
+            local_path = job.result or ""
+            if local_path and os.path.exists(local_path):
+                post['thumbnail'] = local_path # Replace URL with local path
                 downloaded_count += 1
-                # Add a small delay to be nice to servers
-                if downloaded_count < total_images:
-                    time.sleep(0.1)
+            else:
+                if job.state == 'cancelled':
+                    cancelled_count += 1
+                else:
+                    print(f"DEBUG: Failed to download thumbnail for post {index+1}", file=sys.stderr)
+                local_path = ""
+            if on_thumbnail:
+                on_thumbnail(index, post, local_path)
 
-    print(f"DEBUG: Thumbnail downloads completed ({downloaded_count}/{total_images} attempted)", file=sys.stderr)
+    print(f"DEBUG: Thumbnail downloads completed ({downloaded_count}/{total_images} succeeded, "
+          f"{cancelled_count} cancelled, {priority} priority)", file=sys.stderr)
     sys.stderr.flush()
+    get_image_cache().save()
     return posts_data
 
+# Background prefetch of the pages after the one just served: how many pages
+# ahead to fetch (0 disables it) and how many bytes one prefetch run may use.
+# A prefetched page is stamped "prefetched_at" and, for PREFETCH_TTL seconds,
+# served from the cache at once and revalidated in the background, since the
+# reader may spend a while on the current page before pressing Next.
+PREFETCH_DEPTH = int(os.environ.get('REDDIT_VIEWER_PREFETCH_DEPTH', '0'))
+PREFETCH_MAX_BYTES = int(os.environ.get('REDDIT_VIEWER_PREFETCH_BYTES', str(2 * 1024 * 1024)))
+PREFETCH_TTL = float(os.environ.get('REDDIT_VIEWER_PREFETCH_TTL', '900'))
+
+def prefetch_listing(subreddit="all", sort="hot", limit=10, after=None, depth=None, max_bytes=None):
+    """Warm the listing and image caches for the next pages starting at the after cursor"""
+    depth = PREFETCH_DEPTH if depth is None else depth
+    max_bytes = PREFETCH_MAX_BYTES if max_bytes is None else max_bytes
+    image_cache = get_image_cache()
+    scheduler = get_download_scheduler()
+    used_bytes = 0
+    pages = 0
+    images = 0
+
+    while after and pages < depth and used_bytes < max_bytes:
+        path = listing_cache_path(subreddit, sort, limit, after)
+        result = fetch_reddit_data_with_pagination(subreddit, sort, limit, after)
+        if not result['success']:
+            break
+        pages += 1
+        mark_listing_cache(path, 'prefetched_at')
+        if not result.get('cache', {}).get('hit'):
+            try:
+                used_bytes += os.path.getsize(path)
+            except OSError:
+                pass
+
+        for post in result['posts']:
+            thumb_url = post.get('thumbnail')
+            if not (post.get('has_image') and thumb_url and thumb_url.startswith('http')):
+                continue
+            if used_bytes >= max_bytes:
+                break
+            if image_cache.lookup_url(image_url_key(thumb_url)):
+                continue
+            try:
+                local_path = scheduler.run(download_single_image, (thumb_url,), 'prefetch', post_id=post.get('id'))
+            except (DownloadCancelled, RuntimeError):
+                local_path = ""
+            if local_path:
+                images += 1
+                try:
+                    used_bytes += os.path.getsize(local_path)
+                except OSError:
+                    pass
+
+        after = result['pagination'].get('after')
+
+    image_cache.save()
+    print(f"DEBUG: Prefetched {pages} pages and {images} thumbnails of r/{subreddit} ({used_bytes} bytes)", file=sys.stderr)
+    sys.stderr.flush()
+    return {'success': True, 'pages': pages, 'images': images, 'bytes': used_bytes}
+
+def schedule_prefetch(result, subreddit, sort, limit, prefetch_depth=None):
+    """Queue a background prefetch of the pages following a served listing"""
+    depth = PREFETCH_DEPTH if prefetch_depth is None else prefetch_depth
+    next_after = result.get('pagination', {}).get('after') if result.get('success') else None
+    if depth > 0 and next_after:
+        schedule_background('prefetch_listing', {
+            'subreddit': subreddit, 'sort': sort, 'limit': limit, 'after': next_after, 'depth': depth
+        })
+
+# Cache warming for favorite subreddits, meant to be run by launchd or cron so
+# the app opens onto warm data. Listings it refreshes record when ("synced_at"),
+# and until SYNC_INTERVAL has passed since then they are served from the cache
+# at once and revalidated in the background; after that the normal TTL applies.
+SYNC_CONFIG_FILE = 'sync.json'
+SYNC_DEFAULT_LIMIT = 25 # the app's default page size (currentPostCount in RedditViewer.m)
+SYNC_MAX_BYTES = 5 * 1024 * 1024
+SYNC_MAX_SECONDS = 120.0
+SYNC_INTERVAL = float(os.environ.get('REDDIT_VIEWER_SYNC_INTERVAL', '3600'))
+SYNC_SUBREDDIT_PATTERN = re.compile(r'^[A-Za-z0-9_+]+$')
+
+def read_sync_config(source=None):
+    """Read the sync config from a file path or '-' for stdin.
+
+    The default is $REDDIT_VIEWER_SYNC_CONFIG, else sync.json in the cache
+    folder. Accepts {"subreddits": [...], "limit": N, "thumbnails": bool,
+    "max_bytes": N, "max_seconds": N}, a JSON list of subreddits, or one
+    "subreddit [sort] [limit]" per line. Subreddits are given as "pics",
+    "pics/new" or {"subreddit", "sort", "limit"}. Returns (targets, settings).
+    """
+    if source is None:
+        source = os.environ.get('REDDIT_VIEWER_SYNC_CONFIG') or os.path.join(get_cache_dir(), SYNC_CONFIG_FILE)
+    if source == '-':
+        text = sys.stdin.read()
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            text = f.read()
+
+    text = text.strip()
+    settings = {}
+    if text.startswith('{') or text.startswith('['):
+        config = json.loads(text)
+        if isinstance(config, dict):
+            settings = config
+            entries = config.get('subreddits') or []
+        else:
+            entries = config
+    else:
+        entries = [line.split() for line in text.splitlines() if line.strip() and not line.lstrip().startswith('#')]
+
+    default_limit = int(settings.get('limit', SYNC_DEFAULT_LIMIT))
+    targets = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            name, sort, limit = entry.get('subreddit', ''), entry.get('sort'), entry.get('limit')
+        elif isinstance(entry, list):
+            name, sort, limit = (list(entry) + [None, None])[:3]
+        else:
+            name, sort, limit = entry, None, None
+
+        name = str(name).strip().strip('/')
+        if name.startswith('r/'):
+            name = name[2:]
+        subreddit, _, path_sort = name.partition('/')
+        if not SYNC_SUBREDDIT_PATTERN.match(subreddit):
+            print(f"DEBUG: Skipping invalid sync entry: {entry!r}", file=sys.stderr)
+            continue
+        targets.append({'subreddit': subreddit, 'sort': (sort or path_sort or 'hot').lower(),
+                        'limit': int(limit or default_limit)})
+    return targets, settings
+
+def sync_thumbnails(posts, max_bytes, deadline, batch_id):
+    """Download the uncached thumbnails of posts at background priority.
+
+    Whatever is still queued or running is cancelled once max_bytes have been
+    downloaded or the deadline passes. Returns (count, bytes, stopped), where
+    stopped is None, 'bytes' or 'time'.
+    """
+    image_cache = get_image_cache()
+    jobs = []
+    for post in posts:
+        thumb_url = post.get('thumbnail')
+        if not (post.get('has_image') and thumb_url and thumb_url.startswith('http')):
+            continue
+        if image_cache.lookup_url(image_url_key(thumb_url)):
+            continue
+        jobs.append((post.get('id'), thumb_url))
+    if not jobs:
+        return 0, 0, None
+
+    import queue
+
+    scheduler = get_download_scheduler()
+    finished = queue.Queue()
+    for post_id, thumb_url in jobs:
+        scheduler.submit(bind_trace(download_single_image), (thumb_url,), 'background',
+                         post_id=post_id, batch_id=batch_id, on_done=finished.put)
+
+    count = 0
+    used_bytes = 0
+    stopped = None
+    for _ in jobs:
+        try:
+            job = finished.get(timeout=None if stopped else max(0.0, deadline - time.time()))
+        except queue.Empty:
+            stopped = 'time'
+            scheduler.cancel(batch_id=batch_id)
+            job = finished.get()
+        if job.result:
+            count += 1
+            try:
+                used_bytes += os.path.getsize(job.result)
+            except OSError:
+                pass
+        if used_bytes >= max_bytes and not stopped:
+            stopped = 'bytes'
+            scheduler.cancel(batch_id=batch_id)
+    return count, used_bytes, stopped
+
+def sync(config=None, max_bytes=None, max_seconds=None, thumbnails=None):
+    """Refresh the first page and thumbnails of each configured subreddit until a budget runs out.
+
+    Listings are fetched with a conditional request, so an unchanged page
+    costs a 304. max_bytes counts the listings stored and the thumbnails
+    downloaded; subreddits not reached before a budget ran out are
+    reported as skipped.
+    """
+    started = time.time()
+    try:
+        targets, settings = read_sync_config(config)
+    except (OSError, ValueError) as e:
+        return {'success': False, 'error': f'Could not read sync config: {e}'}
+    if not targets:
+        return {'success': False, 'error': 'No subreddits in sync config'}
+
+    max_bytes = int(settings.get('max_bytes', SYNC_MAX_BYTES)) if max_bytes is None else max_bytes
+    max_seconds = float(settings.get('max_seconds', SYNC_MAX_SECONDS)) if max_seconds is None else max_seconds
+    thumbnails = bool(settings.get('thumbnails', True)) if thumbnails is None else thumbnails
+    deadline = started + max_seconds
+
+    used_bytes = 0
+    stopped = None
+    statuses = []
+    skipped = []
+    for target in targets:
+        subreddit, sort, limit = target['subreddit'], target['sort'], target['limit']
+        if not stopped and used_bytes >= max_bytes:
+            stopped = 'bytes'
+        elif not stopped and time.time() >= deadline:
+            stopped = 'time'
+        if stopped:
+            skipped.append(f"{subreddit}/{sort}")
+            continue
+
+        path = listing_cache_path(subreddit, sort, limit)
+        with span('sync.listing', subreddit=subreddit, sort=sort):
+            result = fetch_reddit_data_with_pagination(subreddit, sort, limit, cache_ttl=0,
+                                                       stale_while_revalidate=False)
+        cache = result.get('cache') or {}
+        status = {'subreddit': subreddit, 'sort': sort, 'limit': limit}
+        if not result['success'] or cache.get('stale'):
+            # A stale result is the cached copy served after the refresh failed
+            status.update(success=False, error=result.get('error', 'Refresh failed, kept the cached copy'))
+            if 'retry_after' in result:
+                status['retry_after'] = result['retry_after']
+                stopped = 'rate_limited'
+            statuses.append(status)
+            continue
+
+        mark_listing_cache(path, 'synced_at')
+        if not cache.get('hit'):
+            try:
+                used_bytes += os.path.getsize(path)
+            except OSError:
+                pass
+
+        status.update(success=True, posts=len(result['posts']), changed=not cache.get('revalidated'))
+        if thumbnails and used_bytes >= max_bytes:
+            stopped = 'bytes'
+        elif thumbnails:
+            with span('sync.thumbnails', subreddit=subreddit):
+                count, size, thumbnails_stopped = sync_thumbnails(
+                    result['posts'], max_bytes - used_bytes, deadline, f"sync:{subreddit}/{sort}")
+            used_bytes += size
+            status['thumbnails'] = count
+            stopped = stopped or thumbnails_stopped
+        statuses.append(status)
+
+    get_image_cache().save()
+    elapsed = time.time() - started
+    synced = sum(1 for status in statuses if status['success'])
+    print(f"DEBUG: Synced {synced}/{len(targets)} listings, {used_bytes} bytes in {elapsed:.1f}s"
+          f"{f' (stopped: {stopped})' if stopped else ''}", file=sys.stderr)
+    sys.stderr.flush()
+    return {
+        'success': synced > 0,
+        'subreddits': statuses,
+        'skipped': skipped,
+        'bytes': used_bytes,
+        'seconds': round(elapsed, 1),
+        'stopped': stopped
+    }
+
+# Every field of a post dict, in the order fetch_reddit_data_with_pagination builds them
+POST_FIELDS = (
+    'title', 'author', 'subreddit', 'score', 'num_comments', 'url', 'permalink', 'is_self',
+    'selftext', 'created_utc', 'has_image', 'image_url', 'thumbnail', 'image_type',
+    'content_type', 'is_video', 'video_url', 'is_article', 'article_url', 'is_nsfw',
+    'id', 'crosspost_parent'
+)
+
+def project_post(post, fields=None, skip_defaults=False):
+    """Keep only the requested fields, and optionally drop null values, empty strings and empty lists.
+
+    0 and false are kept: a missing score or is_nsfw must not read as unknown.
+    """
+    fields = fields or POST_FIELDS
+    if skip_defaults:
+        return {field: post[field] for field in fields if post.get(field) not in (None, '', [], {})}
+    return {field: post.get(field) for field in fields}
+
+def unknown_fields_error(fields):
+    """Return an error message naming the requested fields that posts don't have, or None.
+
+    Listing commands check this before fetching anything, so a typo does not
+    cost a page load and its thumbnail downloads.
+    """
+    unknown = [field for field in fields or () if field not in POST_FIELDS]
+    if unknown:
+        return f"Unknown fields: {', '.join(unknown)}"
+    return None
+
+def project_listing(result, fields=None, skip_defaults=False, rows=False):
+    """Apply field projection to a listing result's posts.
+
+    With rows=True the posts become {"columns": [...], "rows": [[...], ...]},
+    one array per post in column order, which is much smaller to pipe and parse
+    than repeating every key per post. fields must already have passed
+    unknown_fields_error.
+    """
+    if not result.get('success') or not (fields or skip_defaults or rows):
+        return result
+
+    fields = list(fields or POST_FIELDS)
+    result = dict(result)
+    posts = result.pop('posts', [])
+    if rows:
+        result['columns'] = fields
+        result['rows'] = [[post.get(field) for field in fields] for post in posts]
+    else:
+        result['posts'] = [project_post(post, fields, skip_defaults) for post in posts]
+    return result
+
+def fetch_listing_with_thumbnails(subreddit="all", sort="hot", limit=10, after=None, before=None,
+                                  cache_ttl=None, stale_while_revalidate=None, prefetch_depth=None,
+                                  fields=None, skip_defaults=False, rows=False, priority='visible', batch_id=None):
+    """Fetch a subreddit listing and download its thumbnails (the default CLI command).
+
+    fields, skip_defaults and rows shape the returned posts (see project_listing).
+    The thumbnails are scheduled at priority under batch_id, which
+    cancel_downloads can use to drop them.
+    """
+    error = unknown_fields_error(fields)
+    if error:
+        return {'success': False, 'error': error, 'posts': [], 'pagination': {'after': None, 'before': None}}
+
+    result = fetch_reddit_data_with_pagination(subreddit, sort, limit, after, before,
+                                               cache_ttl, stale_while_revalidate)
+
+    # Download thumbnails if successful
+    if result['success'] and len(result['posts']) > 0:
+        result = download_thumbnails_for_posts(result, priority=priority, batch_id=batch_id)
+
+    schedule_prefetch(result, subreddit, sort, limit, prefetch_depth)
+    return project_listing(result, fields, skip_defaults, rows)
+
+# Merged multi-subreddit feeds: how many subreddits are fetched at once
+MULTI_WORKERS = 4
+MULTI_SEEN_KEYS = 500
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'ref_src', 'share_id')
+
+def canonical_post_url(url):
+    """Normalize a link so the same target posted twice compares equal"""
+    if not url or not url.startswith('http'):
+        return url or ''
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    for prefix in ('www.', 'old.', 'np.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    query = '&'.join(part for part in parsed.query.split('&')
+                     if part and not part.lower().startswith(TRACKING_PARAMS))
+    path = parsed.path.rstrip('/') or '/'
+    return f"{host}{path}" + (f"?{query}" if query else '')
+
+def post_dedup_keys(post):
+    """Keys under which a post counts as already shown: its (crosspost parent) id and its link"""
+    keys = []
+    parent = post.get('crosspost_parent') or ''
+    post_id = parent[3:] if parent.startswith('t3_') else post.get('id')
+    if post_id:
+        keys.append('id:' + post_id)
+    if not post.get('is_self') and post.get('url'):
+        keys.append('url:' + canonical_post_url(post['url']))
+    return keys
+
+def hot_rank(post):
+    """Reddit's hot ranking: log-scaled score plus a bonus for newer posts"""
+    import math
+
+    score = post.get('score', 0) or 0
+    order = math.log10(max(abs(score), 1))
+    sign = 1 if score > 0 else -1 if score < 0 else 0
+    return sign * order + ((post.get('created_utc') or 0) - 1134028003) / 45000
+
+MULTI_MERGE_KEYS = {
+    'hot': hot_rank,
+    'score': lambda post: post.get('score', 0) or 0,
+    'new': lambda post: post.get('created_utc', 0) or 0,
+    'created_utc': lambda post: post.get('created_utc', 0) or 0,
+}
+
+def encode_multi_cursor(state, seen):
+    import base64
+
+    payload = json.dumps({'subs': state, 'seen': seen[-MULTI_SEEN_KEYS:]}, separators=(',', ':'))
+    return 'multi:' + base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_multi_cursor(cursor):
+    """Return (per-subreddit state, seen key hashes) from a cursor made by encode_multi_cursor"""
+    import base64
+
+    if not cursor.startswith('multi:'):
+        raise ValueError('not a multi-subreddit cursor')
+    data = cursor[len('multi:'):]
+    payload = json.loads(base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)))
+    return payload['subs'], payload.get('seen', [])
+
+def fetch_multi_listing(subreddits, sort="hot", limit=25, after=None, merge="hot", per_subreddit=None,
+                        max_workers=None, thumbnails=True, fields=None, skip_defaults=False, rows=False):
+    """Fetch several subreddits concurrently and merge them into one feed.
+
+    subreddits is a list or a "+"/","-separated string. Posts are merged by
+    merge ("hot", "score", "new"/"created_utc") and duplicates - the same post
+    id, a crosspost of an already shown post, or the same link - are dropped.
+    pagination.after is a composite cursor holding each subreddit's own
+    position, so asking for the next page continues every subreddit where the
+    previous page stopped. fields, skip_defaults and rows work as for listings.
+    """
+    import hashlib
+    import heapq
+    from concurrent.futures import ThreadPoolExecutor
+
+    if isinstance(subreddits, str):
+        subreddits = re.split(r'[+,\s]+', subreddits)
+    subreddits = list(dict.fromkeys(sub.strip() for sub in subreddits if sub and sub.strip()))
+    if not subreddits:
+        return {'success': False, 'error': 'No subreddits given', 'posts': [], 'pagination': {'after': None, 'before': None}}
+    error = unknown_fields_error(fields)
+    if error:
+        return {'success': False, 'error': error, 'posts': [], 'pagination': {'after': None, 'before': None}}
+    rank = MULTI_MERGE_KEYS.get(merge)
+    if rank is None:
+        return {'success': False, 'error': f'Unknown merge key: {merge}', 'posts': [],
+                'pagination': {'after': None, 'before': None}}
+
+    # Per subreddit: [after, offset into that page] or None once it has run out
+    if after:
+        try:
+            state, seen = decode_multi_cursor(after)
+        except (ValueError, KeyError, TypeError) as e:
+            return {'success': False, 'error': f'Invalid cursor: {e}', 'posts': [],
+                    'pagination': {'after': None, 'before': None}}
+    else:
+        state, seen = {}, []
+    state = {sub: state.get(sub, [None, 0]) for sub in subreddits}
+    seen_set = set(seen)
+    per_subreddit = min(per_subreddit or limit, 100)
+
+    active = [sub for sub in subreddits if state[sub] is not None]
+    results = {}
+    heads = []
+    consumed = {}
+
+    def fetch_one(sub):
+        return sub, fetch_reddit_data_with_pagination(sub, sort, per_subreddit, state[sub][0])
+
+    def load(sub, result, order):
+        """Take a fetched page and queue its first unconsumed post for merging"""
+        results[sub] = result
+        if result.get('success'):
+            consumed[sub] = state[sub][1]
+            if consumed[sub] < len(result['posts']):
+                heapq.heappush(heads, (-rank(result['posts'][consumed[sub]]), order, sub))
+
+    if active:
+        with span('multi.fetch', subreddits=len(active)), \
+                ThreadPoolExecutor(max_workers=min(max_workers or MULTI_WORKERS, len(active))) as executor:
+            for order, (sub, result) in enumerate(executor.map(bind_trace(fetch_one), active)):
+                load(sub, result, order)
+
+    # k-way merge on the head of each subreddit's page, so every subreddit is
+    # consumed in its own order and the cursor only needs an offset per page
+    posts = []
+    duplicates = 0
+    with span('multi.merge'):
+        while heads and len(posts) < limit:
+            _, order, sub = heapq.heappop(heads)
+            page = results[sub]['posts']
+            post = page[consumed[sub]]
+            consumed[sub] += 1
+            if consumed[sub] < len(page):
+                heapq.heappush(heads, (-rank(page[consumed[sub]]), order, sub))
+            elif results[sub]['pagination'].get('after'):
+                # This subreddit's page ran out mid-merge - continue it on its next page
+                state[sub] = [results[sub]['pagination']['after'], 0]
+                load(*fetch_one(sub), order)
+
+            keys = [hashlib.md5(key.encode('utf-8')).hexdigest()[:10] for key in post_dedup_keys(post)]
+            if any(key in seen_set for key in keys):
+                duplicates += 1
+                continue
+            seen_set.update(keys)
+            seen.extend(keys)
+            posts.append(post)
+
+    for sub, offset in consumed.items():
+        result = results[sub]
+        if not result.get('success'):
+            continue
+        if offset < len(result['posts']):
+            state[sub] = [state[sub][0], offset]
+        elif result['pagination'].get('after'):
+            state[sub] = [result['pagination']['after'], 0]
+        else:
+            state[sub] = None
+
+    subreddit_status = {}
+    for sub in subreddits:
+        result = results.get(sub)
+        if result is None:
+            subreddit_status[sub] = {'success': True, 'exhausted': True}
+        elif result.get('success'):
+            subreddit_status[sub] = {'success': True, 'cache': result.get('cache'), 'exhausted': state[sub] is None}
+        else:
+            subreddit_status[sub] = {'success': False, 'error': result.get('error', 'Unknown error')}
+            if 'retry_after' in result:
+                subreddit_status[sub]['retry_after'] = result['retry_after']
+
+    more = any(position is not None for position in state.values())
+    retry_hints = [status['retry_after'] for status in subreddit_status.values() if 'retry_after' in status]
+    result = {
+        'success': any(status['success'] for status in subreddit_status.values()),
+        'posts': posts,
+        'pagination': {'after': encode_multi_cursor(state, seen) if more else None, 'before': None},
+        'subreddits': subreddit_status,
+        'merge': merge,
+        'duplicates': duplicates
+    }
+    if not result['success']:
+        result['error'] = 'All subreddits failed'
+        if retry_hints:
+            result['retry_after'] = max(retry_hints)
+
+    print(f"DEBUG: Merged {len(posts)} posts from {len(active)} subreddits ({duplicates} duplicates dropped)", file=sys.stderr)
+    if thumbnails and posts:
+        result = download_thumbnails_for_posts(result)
+    return project_listing(result, fields, skip_defaults, rows)
+
+def stream_listing(subreddit="all", sort="hot", limit=10, after=None, before=None,
+                   cache_ttl=None, stale_while_revalidate=None, prefetch_depth=None, emit=None,
+                   fields=None, skip_defaults=False, priority='visible', batch_id=None):
+    """Fetch a listing, emitting pagination, post and thumbnail_ready events as they happen.
+
+    Events are dicts passed to emit; the default writes each one as a line of
+    JSON on stdout. The last event is always "done" (or "error"). fields and
+    skip_defaults trim each post event as they do listing results; priority
+    and batch_id are passed to the thumbnail downloads.
+    """
+    if emit is None:
+        emit = write_event_line
+    if fields or skip_defaults:
+        error = unknown_fields_error(fields)
+        if error:
+            emit({'event': 'error', 'error': error})
+            return {'success': False, 'error': error}
+        send_event = emit
+
+        def emit(event):
+            if event.get('event') == 'post':
+                event = dict(event, post=project_post(event['post'], fields, skip_defaults))
+            send_event(event)
+
+    result = fetch_reddit_data_with_pagination(subreddit, sort, limit, after, before,
+                                               cache_ttl, stale_while_revalidate, emit=emit)
+    if not result['success']:
+        error = {'error': result.get('error', 'Unknown error')}
+        if 'retry_after' in result:
+            error['retry_after'] = result['retry_after']
+        emit({'event': 'error', **error})
+        return {'success': False, **error}
+
+    def thumbnail_ready(index, post, local_path):
+        emit({
+            'event': 'thumbnail_ready',
+            'index': index,
+            'success': bool(local_path),
+            'thumbnail': post.get('thumbnail')
+        })
+
+    if result['posts']:
+        download_thumbnails_for_posts(result, on_thumbnail=thumbnail_ready, priority=priority, batch_id=batch_id)
+
+    done = {'event': 'done', 'success': True, 'count': len(result['posts']), 'cache': result.get('cache')}
+    trace = current_trace()
+    if trace is not None and TIMINGS_IN_RESULT:
+        done['timings'] = trace.summary()
+    emit(done)
+    schedule_prefetch(result, subreddit, sort, limit, prefetch_depth)
+    return {'success': True, 'count': done['count'], 'cache': done['cache']}
+
+STDOUT_LOCK = threading.Lock()
+
+def write_event_line(event):
+    """Write one streaming event as a line of JSON on stdout"""
+    line = json.dumps(event, separators=(',', ':'))
+    with STDOUT_LOCK:
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+def revalidate_listing(subreddit="all", sort="hot", limit=25, after=None, before=None):
+    """Refresh a cached listing with a conditional request"""
+    return fetch_reddit_data_with_pagination(subreddit, sort, limit, after, before,
+                                             cache_ttl=0, stale_while_revalidate=False)
+
+def download_thumbnails(items, priority='visible', batch_id=None, delay=None, supersede=False, emit=None):
+    """Download the thumbnails of [{"post_id", "url"}] items, emitting thumbnail_ready as each finishes.
+
+    Jobs wait delay seconds (DOWNLOAD_DEBOUNCE by default) before they start,
+    so a batch for rows scrolled past can still be cancelled for free. With
+    supersede, queued jobs of the same priority from other batches are
+    dropped first.
+    """
+    if priority not in DOWNLOAD_PRIORITIES:
+        return {'success': False, 'error': f'Unknown download priority: {priority}'}
+    if supersede:
+        get_download_scheduler().supersede(priority, batch_id)
+
+    posts = [{'id': item.get('post_id'), 'thumbnail': item.get('url'), 'has_image': True} for item in items]
+    downloaded = []
+
+    def thumbnail_ready(index, post, local_path):
+        if local_path:
+            downloaded.append(post['id'])
+        if emit:
+            emit({'event': 'thumbnail_ready', 'post_id': post['id'], 'success': bool(local_path),
+                  'thumbnail': post.get('thumbnail')})
+
+    download_thumbnails_for_posts({'success': True, 'posts': posts}, on_thumbnail=thumbnail_ready,
+                                  priority=priority, batch_id=batch_id,
+                                  delay=DOWNLOAD_DEBOUNCE if delay is None else delay)
+    return {'success': True, 'batch_id': batch_id, 'count': len(posts), 'downloaded': len(downloaded)}
+
+def scheduled_full_image(image_url, post_title=None, emit=None, post_id=None, batch_id=None, priority='visible'):
+    """Download a full image to the Desktop as a scheduler job, ahead of queued thumbnails"""
+    if priority not in DOWNLOAD_PRIORITIES:
+        return {'success': False, 'path': '', 'error': f'Unknown download priority: {priority}'}
+    try:
+        return get_download_scheduler().run(bind_trace(download_full_image_to_desktop),
+                                            (image_url, post_title, emit), priority, post_id, batch_id)
+    except DownloadCancelled:
+        return {'success': False, 'path': '', 'cancelled': True, 'error': 'Download cancelled'}
+
+def cancel_downloads(post_ids=None, batch_id=None):
+    """Cancel the scheduled downloads of the given posts and/or batch"""
+    if not post_ids and batch_id is None:
+        return {'success': False, 'error': 'Give post_ids or batch_id'}
+    cancelled = get_download_scheduler().cancel(post_ids, batch_id)
+    return {'success': True, 'cancelled': cancelled}
+
+# Commands that may be scheduled with schedule_background
+BACKGROUND_COMMANDS = {
+    'revalidate_listing': revalidate_listing,
+    'prefetch_listing': prefetch_listing,
+}
+
+# Commands the persistent server understands, keyed by request "command"
+SERVER_COMMANDS = {
+    'listing': fetch_listing_with_thumbnails,
+    'multi': fetch_multi_listing,
+    'fetch_comments': fetch_comments,
+    'refresh_comments': refresh_comments,
+    'cache_stats': cache_stats,
+    'cache_prune': cache_prune,
+    'cache_verify': cache_verify,
+    'cancel_downloads': cancel_downloads,
+    'sync': sync,
+}
+
+# Server commands that send intermediate {"id", "event"} lines before their result
+SERVER_STREAM_COMMANDS = {
+    'stream_listing': stream_listing,
+    'download_full_image': scheduled_full_image,
+    'download_thumbnails': download_thumbnails,
+    'download_gallery': download_gallery_to_desktop,
+    'download_video': download_video,
+}
+
+def handle_server_request(request, send=None, received_at=None):
+    """Run one decoded server request and return the response dict.
+
+    Streaming commands pass each event to send (as {"id", "event"}) before
+    the final response is returned. received_at is when the request was read
+    (default now); downloads it schedules are stopped only by cancels read
+    after it.
+    """
+    request_id = request.get('id')
+    command = request.get('command', '')
+    params = request.get('params') or {}
+
+    if command == 'ping':
+        return {'id': request_id, 'result': {'success': True, 'pid': os.getpid()}}
+
+    if command == 'pool_stats':
+        stats = HTTP_POOL.stats()
+        if DOWNLOAD_SCHEDULER is not None:
+            stats['downloads'] = DOWNLOAD_SCHEDULER.stats()
+        return {'id': request_id, 'result': {'success': True, 'stats': stats}}
+
+    handler = SERVER_COMMANDS.get(command)
+    if handler is None and command in SERVER_STREAM_COMMANDS:
+        handler = SERVER_STREAM_COMMANDS[command]
+        if isinstance(params, dict):
+            params = dict(params, emit=lambda event: send({'id': request_id, 'event': event}) if send else None)
+    if handler is None:
+        return {'id': request_id, 'result': {'success': False, 'error': f'Unknown command: {command}'}}
+
+    trace = begin_trace(command)
+    REQUEST_STATE.received_at = received_at or time.time()
+    try:
+        if isinstance(params, list):
+            result = handler(*params)
+        else:
+            result = handler(**params)
+    except Exception as e:
+        print(f"DEBUG: Server command {command} failed: {e}", file=sys.stderr)
+        sys.stderr.flush()
+        result = {'success': False, 'error': str(e)}
+    finally:
+        REQUEST_STATE.received_at = None
+
+    return {'id': request_id, 'result': finish_trace(trace, result)}
+
+def serve_stream(infile, outfile, executor):
+    """Read newline-delimited JSON requests from infile and answer them on outfile.
+
+    Requests run on the shared executor so several can be in flight at once;
+    responses carry the request id and may come back out of order.
+    Returns True if a shutdown command was received.
+    """
+    write_lock = threading.Lock()
+
+    def write_response(response):
+        line = json.dumps(response, separators=(',', ':'))
+        with write_lock:
+            try:
+                outfile.write(line + '\n')
+                outfile.flush()
+            except (OSError, ValueError) as e:
+                print(f"DEBUG: Could not write response: {e}", file=sys.stderr)
+
+    def run_and_respond(request, received_at=None):
+        write_response(handle_server_request(request, write_response, received_at))
+
+    pending = []
+    for line in infile:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            write_response({'id': None, 'result': {'success': False, 'error': f'Invalid JSON request: {e}'}})
+            continue
+
+        if not isinstance(request, dict):
+            write_response({'id': None, 'result': {'success': False, 'error': 'Request must be a JSON object'}})
+            continue
+
+        if request.get('command') == 'shutdown':
+            for future in pending:
+                future.result()
+            write_response({'id': request.get('id'), 'result': {'success': True}})
+            return True
+
+        if request.get('command') == 'cancel_downloads':
+            # Answered right away: the requests it cancels may be holding every worker
+            run_and_respond(request)
+            continue
+
+        pending = [future for future in pending if not future.done()]
+        pending.append(executor.submit(run_and_respond, request, time.time()))
+
+    # Input closed - let in-flight requests finish before returning
+    for future in pending:
+        future.result()
+    return False
+
+def serve(socket_path=None, workers=4):
+    """Stay resident and answer JSON requests on stdin/stdout or a Unix socket"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    global BACKGROUND_EXECUTOR
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    BACKGROUND_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+    print(f"DEBUG: Server started (pid {os.getpid()}, {workers} workers)", file=sys.stderr)
+    sys.stderr.flush()
+
+    try:
+        if not socket_path:
+            serve_stream(sys.stdin, sys.stdout, executor)
+            return
+
+        import socketserver
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                infile = io.TextIOWrapper(self.rfile, encoding='utf-8')
+                outfile = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+                if serve_stream(infile, outfile, executor):
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        with Server(socket_path, RequestHandler) as server:
+            print(f"DEBUG: Listening on {socket_path}", file=sys.stderr)
+            sys.stderr.flush()
+            try:
+                server.serve_forever()
+            finally:
+                try:
+                    os.remove(socket_path)
+                except OSError:
+                    pass
+    finally:
+        executor.shutdown(wait=True)
+        BACKGROUND_EXECUTOR.shutdown(wait=True)
+        BACKGROUND_EXECUTOR = None
+        HTTP_POOL.close_idle()
+        print(f"DEBUG: Server stopped, HTTP pool stats: {json.dumps(HTTP_POOL.stats())}", file=sys.stderr)
+        sys.stderr.flush()
+
+def print_result(result, compact=False):
+    """Print a command's JSON result, finishing the current trace first"""
+    result = finish_trace(current_trace(), result)
+    print(json.dumps(result, separators=(',', ':') if compact else None))
+
+def print_download_result(result, emit=None):
+    """Print a download result, as a final done event when progress events were streamed"""
+    if emit:
+        emit(dict(finish_trace(current_trace(), result), event='done'))
+    else:
+        print_result(result)
+
+def parse_comment_options(args):
+    """Parse the optional fetch_comments flags into keyword arguments"""
+    options = {}
+    args = list(args)
+    while args:
+        option = args.pop(0)
+        if option == "--flat":
+            options['flat'] = True
+        elif option == "--max-depth" and args:
+            options['max_depth'] = int(args.pop(0))
+            options['flat'] = True
+        elif option == "--max-comments" and args:
+            options['max_comments'] = int(args.pop(0))
+            options['flat'] = True
+        elif option == "--fields" and args:
+            options['fields'] = [field for field in args.pop(0).split(',') if field]
+            options['flat'] = True
+        elif option == "--expand-more":
+            options['expand_more'] = True
+        elif option == "--more-limit" and args:
+            options['more_limit'] = int(args.pop(0))
+            options['expand_more'] = True
+        elif option == "--more-time" and args:
+            options['more_time'] = float(args.pop(0))
+            options['expand_more'] = True
+    return options
+
+def parse_listing_options(args):
+    """Split the listing projection flags out of args.
+
+    Returns (positional arguments, keyword arguments) for
+    --fields a,b,c, --skip-defaults and --rows.
+    """
+    options = {}
+    positional = []
+    args = list(args)
+    while args:
+        option = args.pop(0)
+        if option == "--fields" and args:
+            options['fields'] = [field for field in args.pop(0).split(',') if field]
+        elif option == "--skip-defaults":
+            options['skip_defaults'] = True
+        elif option == "--rows":
+            options['rows'] = True
+        else:
+            positional.append(option)
+    return positional, options
+
 def main():
     try:
         if len(sys.argv) < 2:
@@ -660,56 +4478,178 @@ def main():
 
         command = sys.argv[1]
 
-        if command == "download_full_image":
-            image_url = sys.argv[2] if len(sys.argv) > 2 else ""
-            post_title = sys.argv[3] if len(sys.argv) > 3 else None
-            result = download_full_image_to_desktop(image_url, post_title)
-            print(json.dumps(result))
+        if command == "serve":
+            # serve [--socket PATH] [--workers N]
+            args = sys.argv[2:]
+            socket_path = None
+            workers = 4
+            while args:
+                option = args.pop(0)
+                if option == "--socket" and args:
+                    socket_path = args.pop(0)
+                elif option == "--workers" and args:
+                    workers = int(args.pop(0))
+            serve(socket_path, workers)
+            return
+
+        elif command == "background":
+            # Detached helper started by schedule_background; produces no output
+            job = json.loads(sys.argv[2]) if len(sys.argv) > 2 else {}
+            run_background_command(job.get('command', ''), job.get('params', {}))
+            return
+
+        begin_trace(' '.join(sys.argv[1:]))
+
+        if command == "cache_stats":
+            print_result(cache_stats())
+
+        elif command == "cache_prune":
+            # cache_prune [max_bytes] [max_entries]
+            max_bytes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+            max_entries = int(sys.argv[3]) if len(sys.argv) > 3 else None
+            print_result(cache_prune(max_bytes, max_entries))
+
+        elif command == "stream":
+            # stream SUBREDDIT [SORT] [LIMIT] [AFTER] [BEFORE] [--fields a,b,c] [--skip-defaults]
+            # - NDJSON events on stdout
+            args, options = parse_listing_options(sys.argv[2:])
+            options.pop('rows', None)
+            subreddit = args[0] if len(args) > 0 else "all"
+            sort = args[1] if len(args) > 1 else "hot"
+            limit = int(args[2]) if len(args) > 2 else 10
+            after = args[3] if len(args) > 3 and args[3] != "None" else None
+            before = args[4] if len(args) > 4 and args[4] != "None" else None
+            stream_listing(subreddit, sort, limit, after, before, **options)
+            finish_trace(current_trace())
+
+        elif command == "sync":
+            # sync [CONFIG|-] [--max-bytes N] [--max-seconds N] [--no-thumbnails]
+            args = [arg for arg in sys.argv[2:] if arg != "--no-thumbnails"]
+            options = {}
+            for option, name, kind in (("--max-bytes", 'max_bytes', int), ("--max-seconds", 'max_seconds', float)):
+                if option in args[:-1]:
+                    position = args.index(option)
+                    options[name] = kind(args[position + 1])
+                    del args[position:position + 2]
+            if "--no-thumbnails" in sys.argv:
+                options['thumbnails'] = False
+            print_result(sync(args[0] if args else None, **options))
+
+        elif command == "cache_verify":
+            # cache_verify [--dry-run]
+            print_result(cache_verify(remove="--dry-run" not in sys.argv))
+
+        elif command == "download_full_image":
+            # download_full_image URL [TITLE] [--progress]
+            args = [arg for arg in sys.argv[2:] if arg != "--progress"]
+            emit = write_event_line if "--progress" in sys.argv else None
+            image_url = args[0] if len(args) > 0 else ""
+            post_title = args[1] if len(args) > 1 else None
+            result = download_full_image_to_desktop(image_url, post_title, emit=emit)
+            print_download_result(result, emit)
+
+        elif command == "download_video":
+            # download_video URL [TITLE] [--max-height N] [--max-bytes N] [--progress]
+            args = [arg for arg in sys.argv[2:] if arg != "--progress"]
+            emit = write_event_line if "--progress" in sys.argv else None
+            options = {}
+            for option, name in (("--max-height", 'max_height'), ("--max-bytes", 'max_bytes')):
+                if option in args[:-1]:
+                    position = args.index(option)
+                    options[name] = int(args[position + 1])
+                    del args[position:position + 2]
+            video_url = args[0] if len(args) > 0 else ""
+            post_title = args[1] if len(args) > 1 else None
+            result = download_video(video_url, post_title, emit=emit, **options)
+            print_download_result(result, emit)
 
         elif command == "download_gallery":
-            gallery_urls = sys.argv[2].split(',') if len(sys.argv) > 2 else []
-            post_title = sys.argv[3] if len(sys.argv) > 3 else "Gallery"
-            result = download_gallery_to_desktop(gallery_urls, post_title)
-            print(json.dumps(result))
+            # download_gallery --manifest FILE|- [TITLE] [--progress]
+            # download_gallery URL1,URL2,... [TITLE] [--progress]   (legacy form)
+            args = [arg for arg in sys.argv[2:] if arg != "--progress"]
+            emit = write_event_line if "--progress" in sys.argv else None
+            manifest_title = None
+            if args and args[0] == "--manifest":
+                gallery_urls, manifest_title = read_download_manifest(args[1] if len(args) > 1 else '-')
+                args = args[2:]
+            else:
+                gallery_urls = args.pop(0).split(',') if args else []
+            post_title = args[0] if args else (manifest_title or "Gallery")
+            result = download_gallery_to_desktop(gallery_urls, post_title, emit=emit)
+            print_download_result(result, emit)
+
+        elif command == "multi":
+            # multi SUB1+SUB2+... [SORT] [LIMIT] [CURSOR] [--merge hot|score|new]
+            #       [--fields a,b,c] [--skip-defaults] [--rows]
+            args, options = parse_listing_options(sys.argv[2:])
+            merge = "hot"
+            if "--merge" in args:
+                position = args.index("--merge")
+                merge = args[position + 1] if position + 1 < len(args) else merge
+                del args[position:position + 2]
+            subreddits = args[0] if args else ""
+            sort = args[1] if len(args) > 1 else "hot"
+            limit = int(args[2]) if len(args) > 2 else 25
+            after = args[3] if len(args) > 3 and args[3] != "None" else None
+            print_result(fetch_multi_listing(subreddits, sort, limit, after, merge, **options), compact=True)
+
+        elif command == "refresh_comments":
+            # refresh_comments PERMALINK [--limit N] [--fields a,b,c]
+            permalink = sys.argv[2] if len(sys.argv) > 2 else ""
+            args = sys.argv[3:]
+            limit = int(args[args.index("--limit") + 1]) if "--limit" in args[:-1] else None
+            fields = parse_comment_options(args).get('fields')
+            print_result(refresh_comments(permalink, limit, fields), compact=True)
 
         elif command == "fetch_comments":
+            # fetch_comments PERMALINK [--flat] [--max-depth N] [--max-comments N] [--fields a,b,c]
+            #                [--expand-more] [--more-limit N] [--more-time SECONDS]
             permalink = sys.argv[2] if len(sys.argv) > 2 else ""
             print(f"DEBUG: Comments fetch requested for: {permalink}", file=sys.stderr)
             sys.stderr.flush()
-            result = fetch_comments(permalink)
-
-            # For comments, output the raw JSON directly if it's a list (Reddit API format)
-            if isinstance(result, list):
-                # This is the raw Reddit API response - output it directly as JSON
-                print(json.dumps(result, separators=(',', ':')))
+            options = parse_comment_options(sys.argv[3:])
+            if not options.get('expand_more'):
+                # Parse (or copy) the thread as it downloads instead of holding it all;
+                # only an error from before anything was written comes back to print
+                result = write_comments_stream(permalink, **options)
+                if result is not None:
+                    print_result(result, compact=True)
             else:
-                # This is an error response - output as normal
-                print(json.dumps(result))
+                # Expanding "load more" stubs needs the whole tree in memory
+                result = fetch_comments(permalink, **options)
+
+                # For comments, output the raw JSON directly if it's a list (Reddit API format);
+                # its timings can only go to the trace file
+                if isinstance(result, list):
+                    # This is the raw Reddit API response - output it directly as JSON
+                    finish_trace(current_trace())
+                    print(json.dumps(result, separators=(',', ':')))
+                else:
+                    # Flattened comments or an error response
+                    print_result(result, compact=True)
 
         else:
             # Regular Reddit data fetch
-            subreddit = sys.argv[1] if len(sys.argv) > 1 else "all"
-            sort = sys.argv[2] if len(sys.argv) > 2 else "hot"
-            limit = int(sys.argv[3]) if len(sys.argv) > 3 else 10
-            after = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] != "None" else None
-            before = sys.argv[5] if len(sys.argv) > 5 and sys.argv[5] != "None" else None
-
-            result = fetch_reddit_data_with_pagination(subreddit, sort, limit, after, before)
-
-            # Download thumbnails if successful
-            if result['success'] and len(result['posts']) > 0:
-                result = download_thumbnails_for_posts(result)
+            # SUBREDDIT [SORT] [LIMIT] [AFTER] [BEFORE] [--fields a,b,c] [--skip-defaults] [--rows]
+            args, options = parse_listing_options(sys.argv[1:])
+            subreddit = args[0] if len(args) > 0 else "all"
+            sort = args[1] if len(args) > 1 else "hot"
+            limit = int(args[2]) if len(args) > 2 else 10
+            after = args[3] if len(args) > 3 and args[3] != "None" else None
+            before = args[4] if len(args) > 4 and args[4] != "None" else None
 
-            print(json.dumps(result, separators=(',', ':')))
+            result = fetch_listing_with_thumbnails(subreddit, sort, limit, after, before, **options)
+            print_result(result, compact=True)
 
         sys.stdout.flush()
+        print(f"DEBUG: HTTP pool stats: {json.dumps(HTTP_POOL.stats())}", file=sys.stderr)
         sys.stderr.flush()
 
     except Exception as e:
         print(f"DEBUG: Script error: {e}", file=sys.stderr)
         sys.stderr.flush()
         error_result = {'success': False, 'error': str(e)}
-        print(json.dumps(error_result))
+        print_result(error_result)
         sys.stdout.flush()
 
 if __name__ == "__main__":
@@ -0,0 +1,36 @@
+"""Shared fixtures for the reddit_fetcher tests"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reddit_fetcher
+
+
+class CacheDirTestCase(unittest.TestCase):
+    """Runs each test against a fresh cache directory, with no cache or scheduler state carried over"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, True)
+        mock.patch.dict(os.environ, {'REDDIT_VIEWER_CACHE_DIR': self.cache_dir}).start()
+        self.addCleanup(mock.patch.stopall)
+        for name in ('CACHE_DIR', 'IMAGE_CACHE', 'DOWNLOAD_SCHEDULER'):
+            self.patch(name, None)
+
+    def patch(self, name, new=mock.DEFAULT, **kwargs):
+        """Replace reddit_fetcher.name for the rest of the test and return the replacement"""
+        return mock.patch.object(reddit_fetcher, name, new, **kwargs).start()
+
+    def write_image(self, seed):
+        """Write a small distinct JPEG into the cache directory; returns (filename, size)"""
+        body = b'\xff\xd8\xff\xe0' + bytes([seed]) * 64 + b'\xff\xd9'
+        filename = reddit_fetcher.image_cache_filename(body)
+        with open(os.path.join(self.cache_dir, filename), 'wb') as f:
+            f.write(body)
+        return filename, len(body)
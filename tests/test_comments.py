@@ -0,0 +1,37 @@
+import os
+import unittest
+from unittest import mock
+
+from support import CacheDirTestCase, reddit_fetcher
+
+PERMALINK = '/r/test/comments/abc123/title/'
+
+
+def comments_result(records):
+    return {'success': True, 'post': {'title': 'Title'}, 'comments': records,
+            'truncated': False, 'more': 0}
+
+
+class RefreshCommentsTest(CacheDirTestCase):
+    def test_second_refresh_returns_only_changes(self):
+        first = [{'id': 'c1', 'parent': None, 'score': 1}, {'id': 'c2', 'parent': 'c1', 'score': 1}]
+        second = [{'id': 'c3', 'parent': None, 'score': 1}, {'id': 'c1', 'parent': None, 'score': 5}]
+
+        with mock.patch.object(reddit_fetcher, 'fetch_comments', return_value=comments_result(first)):
+            result = reddit_fetcher.refresh_comments(PERMALINK)
+        self.assertTrue(result['full'])
+        self.assertEqual(len(result['new']), 2)
+
+        with mock.patch.object(reddit_fetcher, 'fetch_comments', return_value=comments_result(second)):
+            result = reddit_fetcher.refresh_comments(PERMALINK, limit=10)
+        self.assertFalse(result['full'])
+        self.assertEqual([record['id'] for record in result['new']], ['c3'])
+        self.assertEqual(result['scores'], {'c1': 5})
+
+        snapshot = reddit_fetcher.read_thread_snapshot(reddit_fetcher.thread_cache_path(PERMALINK))
+        self.assertEqual(set(snapshot['comments']), {'c1', 'c2', 'c3'})
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'listings')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import io
+import json
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from support import CacheDirTestCase, reddit_fetcher
+
+
+class CancelBeforeStartTest(CacheDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.downloads = []
+        self.patch('download_single_image', self.fake_download)
+
+    def fake_download(self, url, cancel=None, throttle=None):
+        self.downloads.append(url)
+        return ''
+
+    def test_serve_cancel_reaches_request_still_waiting_for_a_worker(self):
+        def slow_comments(*args, **kwargs):
+            time.sleep(0.3)
+            return {'success': True, 'comments': []}
+
+        items = [{'post_id': f'p{i}', 'url': f'https://b.thumbs.redditmedia.com/t{i}.jpg'} for i in range(4)]
+        requests = [
+            {'id': 1, 'command': 'fetch_comments', 'params': {'permalink': '/r/test/comments/x'}},
+            {'id': 2, 'command': 'download_thumbnails', 'params': {'items': items, 'batch_id': 'b1'}},
+            {'id': 3, 'command': 'cancel_downloads', 'params': {'batch_id': 'b1'}},
+        ]
+        infile = io.StringIO(''.join(json.dumps(request) + '\n' for request in requests))
+        outfile = io.StringIO()
+
+        executor = ThreadPoolExecutor(max_workers=1) # serve --workers 1
+        try:
+            with mock.patch.dict(reddit_fetcher.SERVER_COMMANDS, {'fetch_comments': slow_comments}):
+                reddit_fetcher.serve_stream(infile, outfile, executor)
+        finally:
+            executor.shutdown()
+
+        lines = [json.loads(line) for line in outfile.getvalue().splitlines()]
+        results = {line['id']: line['result'] for line in lines if 'result' in line}
+        events = [line['event'] for line in lines if line.get('event', {}).get('event') == 'thumbnail_ready']
+        self.assertEqual(self.downloads, [])
+        self.assertEqual(results[2]['downloaded'], 0)
+        self.assertEqual(len(events), 4)
+        self.assertFalse(any(event['success'] for event in events))
+
+    def test_cancel_of_post_stops_only_requests_received_before_it(self):
+        scheduler = reddit_fetcher.DownloadScheduler(workers=1)
+        received_before = time.time()
+        scheduler.cancel(post_ids=['p1'])
+
+        with mock.patch.object(reddit_fetcher.REQUEST_STATE, 'received_at', received_before, create=True):
+            waiting = scheduler.submit(lambda cancel=None: 'stale', post_id='p1', priority='prefetch')
+        # Scrolling back to the row, then clicking it, both come after the cancel
+        visible = scheduler.submit(lambda cancel=None: 'thumbnail', post_id='p1')
+        full_image = scheduler.run(lambda cancel=None: 'image', post_id='p1')
+
+        self.assertEqual(waiting.state, 'cancelled')
+        self.assertEqual(visible.wait(5), 'thumbnail')
+        self.assertEqual(full_image, 'image')
+
+    def test_cancel_is_forgotten_after_ttl(self):
+        scheduler = reddit_fetcher.DownloadScheduler(workers=1)
+        with mock.patch.object(reddit_fetcher, 'DOWNLOAD_CANCEL_TTL', 0.0):
+            scheduler.cancel(batch_id='b1')
+        self.assertFalse(scheduler.cancelled(batch_id='b1'))
+        self.assertEqual(scheduler.submit(lambda cancel=None: 'ok', batch_id='b1').wait(5), 'ok')
+
+
+if __name__ == '__main__':
+    unittest.main()
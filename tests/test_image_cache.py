@@ -0,0 +1,70 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+from support import CacheDirTestCase, reddit_fetcher
+
+
+class ImageCacheSaveTest(CacheDirTestCase):
+    def saved_index(self):
+        with open(os.path.join(self.cache_dir, reddit_fetcher.IMAGE_CACHE_INDEX), encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_concurrent_saves_keep_every_entry(self):
+        # Three fetchers load the same (empty) index, then each adds one file
+        caches = [reddit_fetcher.ImageCache(self.cache_dir) for _ in range(3)]
+        for cache in caches:
+            cache.load()
+        for seed, cache in enumerate(caches):
+            filename, size = self.write_image(seed)
+            url = f'https://i.redd.it/image{seed}.jpg'
+            cache.add(filename, url, size, reddit_fetcher.image_url_key(url))
+            cache.save()
+
+        index = self.saved_index()
+        self.assertEqual(len(index['files']), 3)
+        self.assertEqual(len(index['urls']), 3)
+
+    def test_save_drops_files_another_process_evicted(self):
+        first = reddit_fetcher.ImageCache(self.cache_dir)
+        first.load()
+        kept, size = self.write_image(1)
+        gone, gone_size = self.write_image(2)
+        first.add(kept, 'https://i.redd.it/kept.jpg', size)
+        first.add(gone, 'https://i.redd.it/gone.jpg', gone_size)
+        first.save()
+
+        second = reddit_fetcher.ImageCache(self.cache_dir)
+        second.remove(gone)
+        second.save()
+
+        first.lookup(kept)
+        first.save()
+        self.assertEqual(set(self.saved_index()['files']), {kept})
+
+    def test_save_reads_nothing_back_when_no_one_else_saved(self):
+        cache = reddit_fetcher.ImageCache(self.cache_dir)
+        filename, size = self.write_image(1)
+        cache.add(filename, 'https://i.redd.it/one.jpg', size)
+        cache.save()
+
+        cache.lookup(filename)
+        with mock.patch.object(reddit_fetcher.ImageCache, 'merge_saved') as merge_saved:
+            cache.save()
+        merge_saved.assert_not_called()
+
+    def test_reconcile_adds_files_no_index_lists(self):
+        cache = reddit_fetcher.ImageCache(self.cache_dir)
+        kept, size = self.write_image(1)
+        cache.add(kept, 'https://i.redd.it/kept.jpg', size)
+        cache.save()
+
+        # A process that exited before saving its index left this one behind
+        orphan, _ = self.write_image(3)
+        cache.reconcile()
+        cache.save()
+        self.assertEqual(set(self.saved_index()['files']), {kept, orphan})
+
+if __name__ == '__main__':
+    unittest.main()
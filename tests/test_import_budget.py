@@ -0,0 +1,30 @@
+import os
+import sys
+import unittest
+
+from support import CacheDirTestCase
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+import check_import_budget
+
+
+class ImportBudgetTest(CacheDirTestCase):
+    """The checks of make check-startup; seeding the cache goes through CacheDirTestCase's directory"""
+
+    def test_cached_commands_import_no_network_modules(self):
+        for description, _, loaded, _ in check_import_budget.run_checks():
+            with self.subTest(description):
+                self.assertEqual(loaded, [])
+
+    def test_cached_commands_stay_within_import_budget(self):
+        # Wall-clock time depends on the machine, so only check it when a budget is given
+        if 'IMPORT_BUDGET_MS' not in os.environ:
+            self.skipTest('set IMPORT_BUDGET_MS to check import time')
+        for description, added_ms, _, _ in check_import_budget.run_checks():
+            with self.subTest(description):
+                self.assertLessEqual(added_ms, check_import_budget.IMPORT_BUDGET_MS)
+
+
+if __name__ == '__main__':
+    unittest.main()
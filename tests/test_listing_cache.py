@@ -0,0 +1,67 @@
+import time
+import unittest
+import urllib.error
+
+from support import CacheDirTestCase, reddit_fetcher
+
+
+class SyncedListingTest(CacheDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patch('LISTING_STALE_WHILE_REVALIDATE', False)
+        self.schedule = self.patch('schedule_background')
+        self.http_open = self.patch('http_open', side_effect=urllib.error.URLError('offline'))
+
+    def seed(self, age, after=None, **fields):
+        path = reddit_fetcher.listing_cache_path('pics', 'hot', 25, after)
+        reddit_fetcher.write_listing_cache(path, dict({
+            'stored_at': time.time() - age,
+            'url': 'https://www.reddit.com/r/pics/hot.json?limit=25',
+            'etag': None,
+            'last_modified': None,
+            'posts': [],
+            'pagination': {'after': None, 'before': None},
+        }, **fields))
+
+    def test_recently_synced_listing_is_served_stale(self):
+        self.seed(600, synced_at=time.time() - 600)
+        result = reddit_fetcher.fetch_reddit_data_with_pagination('pics', 'hot', 25)
+
+        self.assertTrue(result['cache']['stale'])
+        self.schedule.assert_called_once()
+        self.http_open.assert_not_called()
+
+    def test_sync_older_than_interval_falls_back_to_ttl(self):
+        self.seed(600, synced_at=time.time() - reddit_fetcher.SYNC_INTERVAL - 600)
+        reddit_fetcher.fetch_reddit_data_with_pagination('pics', 'hot', 25)
+
+        self.schedule.assert_not_called()
+        self.http_open.assert_called()
+
+    def test_legacy_synced_flag_is_ignored(self):
+        self.seed(600, synced=True)
+        reddit_fetcher.fetch_reddit_data_with_pagination('pics', 'hot', 25)
+
+        self.schedule.assert_not_called()
+        self.http_open.assert_called()
+
+
+    def test_prefetched_page_is_served_stale_within_prefetch_ttl(self):
+        self.seed(600, after='t3_next')
+        reddit_fetcher.prefetch_listing('pics', 'hot', 25, after='t3_next', depth=1)
+        self.schedule.reset_mock()
+
+        result = reddit_fetcher.fetch_reddit_data_with_pagination('pics', 'hot', 25, 't3_next')
+        self.assertTrue(result['cache']['stale'])
+        self.schedule.assert_called_once()
+
+    def test_prefetch_older_than_ttl_falls_back_to_ttl(self):
+        self.seed(600, after='t3_next', prefetched_at=time.time() - reddit_fetcher.PREFETCH_TTL - 600)
+        reddit_fetcher.fetch_reddit_data_with_pagination('pics', 'hot', 25, 't3_next')
+
+        self.schedule.assert_not_called()
+        self.http_open.assert_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
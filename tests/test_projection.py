@@ -0,0 +1,35 @@
+import unittest
+from unittest import mock
+
+from support import reddit_fetcher
+
+
+class ProjectPostTest(unittest.TestCase):
+    def test_skip_defaults_keeps_zero_and_false(self):
+        post = {'title': '', 'score': 0, 'num_comments': 0, 'is_nsfw': False,
+                'thumbnail': None, 'gallery_urls': [], 'author': 'someone'}
+        projected = reddit_fetcher.project_post(post, list(post), skip_defaults=True)
+
+        self.assertEqual(projected, {'score': 0, 'num_comments': 0, 'is_nsfw': False, 'author': 'someone'})
+
+    def test_fields_keep_order_and_missing_values(self):
+        projected = reddit_fetcher.project_post({'score': 3, 'title': 'x'}, ['title', 'score', 'author'])
+
+        self.assertEqual(list(projected.items()), [('title', 'x'), ('score', 3), ('author', None)])
+
+
+class UnknownFieldsTest(unittest.TestCase):
+    def test_listing_commands_reject_unknown_fields_before_fetching(self):
+        with mock.patch.object(reddit_fetcher, 'fetch_reddit_data_with_pagination') as fetch:
+            listing = reddit_fetcher.fetch_listing_with_thumbnails('pics', fields=['title', 'scroe'])
+            multi = reddit_fetcher.fetch_multi_listing('pics+aww', fields=['scroe'])
+            stream = reddit_fetcher.stream_listing('pics', fields=['scroe'], emit=lambda event: None)
+
+        fetch.assert_not_called()
+        for result in (listing, multi, stream):
+            self.assertFalse(result['success'])
+            self.assertEqual(result['error'], 'Unknown fields: scroe')
+
+
+if __name__ == '__main__':
+    unittest.main()
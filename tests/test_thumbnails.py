@@ -0,0 +1,33 @@
+import os
+import unittest
+from unittest import mock
+
+from support import CacheDirTestCase, reddit_fetcher
+
+
+class CachedThumbnailTest(CacheDirTestCase):
+    def seed(self, url, seed):
+        filename, size = self.write_image(seed)
+        reddit_fetcher.get_image_cache().add(filename, url, size, reddit_fetcher.image_url_key(url))
+        return os.path.join(self.cache_dir, filename)
+
+    def test_cached_batch_never_acquires_throttle(self):
+        posts = []
+        expected = {}
+        for i in range(8):
+            url = f'https://b.thumbs.redditmedia.com/thumb{i}.jpg'
+            expected[i] = self.seed(url, i)
+            posts.append({'id': f'p{i}', 'has_image': True, 'thumbnail': url})
+
+        with mock.patch.object(reddit_fetcher.HostThrottle, 'acquire') as acquire, \
+                mock.patch.object(reddit_fetcher, 'http_open') as http_open:
+            result = reddit_fetcher.download_thumbnails_for_posts({'success': True, 'posts': posts})
+
+        acquire.assert_not_called()
+        http_open.assert_not_called()
+        for i, post in enumerate(result['posts']):
+            self.assertEqual(post['thumbnail'], expected[i])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+#
+# Build the precompiled bundle of reddit_fetcher.py that the app runs instead
+# of the plain script. Python never caches bytecode for the script it is
+# started with, so `python3 reddit_fetcher.py` recompiles the whole file on
+# every launch. The bundle is a zipapp holding:
+#
+#   __main__.py         - two lines that import the module and call main()
+#   reddit_fetcher.pyc  - bytecode compiled by the Python running this script
+#   reddit_fetcher.py   - the source, used if that bytecode does not match
+#                         the interpreter on the target Mac
+#
+# Entries are stored uncompressed so loading needs neither zlib nor inflating.
+# Build with the same Python version as the one installed on the Tiger machine
+# (3.11) or the bytecode is skipped and the source is compiled as before.
+#
+# Usage: python3 tools/build_pyz.py [OUTPUT]   (default build/reddit_fetcher.pyz)
+#
+
+import os
+import sys
+import time
+import zipfile
+import tempfile
+import py_compile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = os.path.join(REPO_DIR, 'reddit_fetcher.py')
+MAIN = "import reddit_fetcher\nreddit_fetcher.main()\n"
+
+def build(output):
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        bytecode = os.path.join(tmp, 'reddit_fetcher.pyc')
+        # Unchecked hash: zipimport uses the bytecode without comparing it to the source
+        py_compile.compile(SOURCE, cfile=bytecode, dfile='reddit_fetcher.py', doraise=True,
+                           invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+
+        tmp_output = output + '.tmp'
+        date_time = time.localtime()[:6]
+        with zipfile.ZipFile(tmp_output, 'w', compression=zipfile.ZIP_STORED) as archive:
+            archive.writestr(zipfile.ZipInfo('__main__.py', date_time), MAIN)
+            archive.write(bytecode, 'reddit_fetcher.pyc')
+            archive.write(SOURCE, 'reddit_fetcher.py')
+        os.replace(tmp_output, output)
+
+    print(f"Built {output} ({os.path.getsize(output)} bytes, "
+          f"bytecode for Python {sys.version_info[0]}.{sys.version_info[1]})")
+
+if __name__ == "__main__":
+    build(sys.argv[1] if len(sys.argv) > 1 else os.path.join(REPO_DIR, 'build', 'reddit_fetcher.pyz'))
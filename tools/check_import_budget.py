@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#
+# Startup import budget for the precompiled bundle (make check-startup).
+#
+# Builds the bundle into a temporary folder and runs commands that are
+# answered from local caches under `python3 -X importtime`. A check fails if
+#   - one of the network-stack modules below gets imported, or
+#   - the imports added on top of a bare interpreter take longer than the budget.
+#
+# The module list is exact. The time budget is machine dependent: the default
+# suits a current desktop, set IMPORT_BUDGET_MS for slower hardware.
+#
+# Usage: python3 tools/check_import_budget.py
+#
+# tests/test_import_budget.py runs the same checks under pytest; there the time
+# budget is only enforced when IMPORT_BUDGET_MS is set.
+#
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TOOLS_DIR)
+sys.path.insert(0, TOOLS_DIR)
+from build_pyz import build
+
+IMPORT_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_MS', '40'))
+
+# Modules that only network commands may load
+NETWORK_MODULES = ('http.client', 'ssl', 'email.parser', 'urllib.request', 'urllib.error',
+                   'tempfile', 'concurrent.futures', 'socket')
+
+# (description, arguments) - all answered without touching the network
+CHECKS = [
+    ('cache_stats', ['cache_stats']),
+    ('cache_verify', ['cache_verify', '--dry-run']),
+    ('cached listing', ['budgetcheck', 'hot', '10']),
+]
+
+def import_times(argv, env):
+    """Run python -X importtime and return {module: self_microseconds}"""
+    process = subprocess.run([sys.executable, '-X', 'importtime'] + argv, env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    times = {}
+    for line in process.stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(self_us)
+    return times
+
+# Smallest body that passes image_integrity_problem as a JPEG
+CACHED_THUMBNAIL = b'\xff\xd8\xff\xe0' + b'\x00' * 16 + b'\xff\xd9'
+CACHED_THUMBNAIL_URL = 'https://i.redd.it/budgetcheck.jpg'
+
+def seed_listing_cache(cache_dir):
+    """Write a fresh cached listing, and its one cached thumbnail, so the listing check is answered from disk"""
+    os.environ['REDDIT_VIEWER_CACHE_DIR'] = cache_dir
+    sys.path.insert(0, REPO_DIR)
+    import reddit_fetcher
+
+    posts = [{'title': f'Post {i}', 'author': 'someone', 'subreddit': 'budgetcheck', 'score': i,
+              'num_comments': 0, 'url': '', 'permalink': '', 'is_self': True, 'selftext': '',
+              'created_utc': 0, 'has_image': False, 'image_url': None, 'thumbnail': None,
+              'image_type': None, 'content_type': 'text', 'is_video': False, 'video_url': None,
+              'is_article': False, 'article_url': None, 'is_nsfw': False} for i in range(10)]
+    # A warm listing also goes through the thumbnail path, so one post has a cached image
+    posts[0].update(url=CACHED_THUMBNAIL_URL, is_self=False, has_image=True, image_url=CACHED_THUMBNAIL_URL,
+                    thumbnail=CACHED_THUMBNAIL_URL, image_type='direct', content_type='image')
+
+    image_cache = reddit_fetcher.get_image_cache()
+    filename = reddit_fetcher.image_cache_filename(CACHED_THUMBNAIL)
+    with open(os.path.join(cache_dir, filename), 'wb') as f:
+        f.write(CACHED_THUMBNAIL)
+    image_cache.add(filename, CACHED_THUMBNAIL_URL, len(CACHED_THUMBNAIL),
+                    reddit_fetcher.image_url_key(CACHED_THUMBNAIL_URL))
+    image_cache.save()
+    reddit_fetcher.write_listing_cache(reddit_fetcher.listing_cache_path('budgetcheck', 'hot', 10), {
+        'stored_at': time.time(), 'url': '', 'etag': None, 'last_modified': None,
+        'posts': posts, 'pagination': {'after': None, 'before': None}
+    })
+
+def run_checks():
+    """Build the bundle and run every check; returns [(description, added ms, network modules, slowest)]"""
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        bundle = os.path.join(tmp, 'reddit_fetcher.pyz')
+        build(bundle)
+        cache_dir = os.path.join(tmp, 'cache')
+        seed_listing_cache(cache_dir)
+
+        env = dict(os.environ, REDDIT_VIEWER_CACHE_DIR=cache_dir, HOME=tmp)
+        env.pop('REDDIT_VIEWER_TIMINGS', None)
+        env.pop('REDDIT_VIEWER_TRACE', None)
+        baseline = import_times(['-c', 'pass'], env)
+
+        for description, args in CHECKS:
+            times = import_times([bundle] + args, env)
+            added = {name: us for name, us in times.items() if name not in baseline}
+            loaded = [name for name in NETWORK_MODULES if name in added]
+            slowest = sorted(added.items(), key=lambda item: -item[1])[:3]
+            results.append((description, sum(added.values()) / 1000, loaded, slowest))
+    return results
+
+def main():
+    failures = 0
+    for description, added_ms, loaded, slowest in run_checks():
+        ok = not loaded and added_ms <= IMPORT_BUDGET_MS
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {description:<16} {added_ms:6.1f} ms of {IMPORT_BUDGET_MS:.0f} ms"
+              f"  slowest: {', '.join(f'{name} {us / 1000:.1f}' for name, us in slowest)}")
+        if loaded:
+            print(f"     network modules imported: {', '.join(loaded)}")
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()